@@ -0,0 +1,301 @@
+import argparse
+import copy
+import itertools
+import json
+import os
+
+import backend_registry
+import backend_runner
+import batch_converter
+import conversion_cache
+import converter
+import converter_util
+import inference_benchmark
+import model_loader
+import stage_trace
+
+# Backends whose artifacts can be measured on the CPU: backend -> (runtime, artifact role of conversion_cache). TensorRT
+# engines need an NVIDIA GPU, so TensorRT conversions are not tuned
+TUNABLE_BACKENDS = {'edgetpu': ('tflite', 'tflite'), 'openvino': ('openvino', 'xml')}
+
+# Boxes overlapping at least this much (intersection over union), with the same class, count as the same detection
+MATCH_IOU = 0.5
+
+
+def setup_args(parser):
+    parser.add_argument("--input", "-i", help="Path to input file", required=True, type=str)
+    parser.add_argument("--input_dims", "-id", help="Dimensions of input tensor of the baseline, and of variants that "
+                                                    "do not set input_dims", type=int, nargs='+')
+    parser.add_argument("--output_root", "-o", help="Directory for the converted variants and the report",
+                        default="./tuned_models")
+    parser.add_argument("--space", "-s", help="JSON file declaring the search space", required=True)
+    parser.add_argument("--validation_data", help="Directory of validation images (or .npy arrays)", required=True)
+    parser.add_argument("--validation_samples", help="Maximum number of validation images", type=int, default=32)
+    parser.add_argument("--tolerance", help="Largest acceptable output drift from the original graph, between 0 "
+                                            "(identical detections) and 1", type=float, default=0.05)
+    parser.add_argument("--score_threshold", help="Detections scoring lower are ignored when comparing outputs",
+                        type=float, default=0.3)
+    parser.add_argument("--threads", help="Number of CPU threads of every runtime", type=int, default=1)
+    parser.add_argument("--warmup", help="Number of untimed warm-up inferences", type=int, default=10)
+    parser.add_argument("--iterations", help="Number of timed inferences", type=int, default=50)
+    inference_benchmark.add_timeout_args(parser)
+    parser.add_argument("--json", help="Write the report to this JSON file. Defaults to tuning.json in the output "
+                                       "root")
+
+    # Backend-specific arguments provide the defaults of the options variants do not set
+    for backend in backend_registry.BACKENDS.values():
+        backend.add_args(parser)
+    backend_runner.add_runner_args(parser)
+    stage_trace.add_trace_args(parser)
+
+
+# A point of the search space
+# name: Variant name, also the name of its output directory
+# backend: Backend converting the variant
+# options: Dictionary of the conversion arguments the variant sets
+# args: Conversion arguments of the variant
+# input_dims: Input dimensions the variant is converted with
+class Variant:
+
+    def __init__(self, name, backend, options):
+        self.name = name
+        self.backend = backend
+        self.options = options
+        self.args = None
+        self.input_dims = None
+
+
+# Reads the search space at path, and returns its Variants. The search space is a JSON object of the form
+#   {"input_dims": [[1, 300, 300, 3], [1, 256, 256, 3]],
+#    "edgetpu": {"calibration_dir": [null, "calibration"]},
+#    "openvino": {"data_type": ["FP32", "FP16"]}}
+# Every backend key declares the values of its conversion arguments to try; each combination of them, at each of the
+# optional input_dims, is one variant. Relative paths are resolved against the file's directory
+def read_space(path):
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        space = json.load(f)
+
+    dims_options = space.get('input_dims') or [None]
+    unknown = set(space) - {'input_dims'} - set(TUNABLE_BACKENDS)
+    if unknown:
+        raise ValueError("Cannot tune {}; tunable backends are {}".format(sorted(unknown), sorted(TUNABLE_BACKENDS)))
+
+    variants = []
+    for backend in backend_registry.BACKENDS:
+        if backend not in space:
+            continue
+        keys = sorted(space[backend])
+        for idx, (dims, values) in enumerate(itertools.product(dims_options,
+                                                               itertools.product(*[space[backend][key]
+                                                                                   for key in keys]))):
+            options = dict(zip(keys, values))
+            for key in batch_converter.PATH_ARGS:
+                if options.get(key) is not None:
+                    options[key] = os.path.join(base_dir, options[key])
+            if dims is not None:
+                options['input_dims'] = dims
+            variants.append(Variant("{}_{}".format(backend, idx), backend, options))
+    return variants
+
+
+# Returns a copy of the tuner arguments with the options of variant. Each variant converts into its own directory,
+# with its own file name, since the compiled Edge TPU model is written to the working directory under the output name
+def variant_args(args, variant):
+    model_args = copy.copy(args)
+    model_args.output_dir = os.path.join(args.output_root, variant.name, variant.name)
+    for key, value in variant.options.items():
+        if not hasattr(model_args, key):
+            raise ValueError("Unknown conversion argument {} in variant {}".format(key, variant.name))
+        setattr(model_args, key, value)
+    return model_args
+
+
+# Returns the path of the artifact of a converted variant that is measured
+def artifact_path(variant):
+    _, role = TUNABLE_BACKENDS[variant.backend]
+    return conversion_cache.backend_artifacts(variant.backend, variant.args)[role]
+
+
+# Measures the latency of a model and collects its detections on the validation set. Runs in its own process
+def measure_model(runtime, path, dims, args):
+    runner = inference_benchmark.create_runner(runtime, path, dims, args.threads, args.validation_data,
+                                               input_count=args.validation_samples,
+                                               openvino_dir=getattr(args, 'openvino_dir', None))
+    result = inference_benchmark.measure(runner, args.warmup, args.iterations, dims[0])
+    result['detections'] = [runner.detections(runner.run(data)) for data in runner.inputs]
+    return result
+
+
+# Returns the intersection over union of every box of boxes_a (A x 4) with every box of boxes_b (B x 4), as an A x B
+# array. Boxes are (ymin, xmin, ymax, xmax)
+def iou_matrix(boxes_a, boxes_b):
+    import numpy as np
+
+    top_left = np.maximum(boxes_a[:, np.newaxis, :2], boxes_b[np.newaxis, :, :2])
+    bottom_right = np.minimum(boxes_a[:, np.newaxis, 2:], boxes_b[np.newaxis, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(np.clip(boxes_a[:, 2:] - boxes_a[:, :2], 0, None), axis=1)
+    area_b = np.prod(np.clip(boxes_b[:, 2:] - boxes_b[:, :2], 0, None), axis=1)
+    union = area_a[:, np.newaxis] + area_b[np.newaxis, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection, dtype=np.float64), where=union > 0)
+
+
+# Compares the detections of a variant with those of the original graph, image by image. Detections under
+# score_threshold are ignored. Returns a dictionary of:
+# drift: 1 - the mean IoU of every detection with its best same-class match in the other output, in both directions,
+#   so that missed and spurious detections both count. 0 for identical detections
+# score_drift: Mean absolute score difference of the matched (IoU >= MATCH_IOU) detections
+# recall: Fraction of the reference detections that are matched
+def output_drift(reference, candidate, score_threshold):
+    import numpy as np
+
+    best_ious = []
+    score_differences = []
+    matched = 0
+    total = 0
+    for expected, actual in zip(reference, candidate):
+        keep_expected = expected['scores'] >= score_threshold
+        keep_actual = actual['scores'] >= score_threshold
+        boxes_e, scores_e, classes_e = [expected[key][keep_expected] for key in ('boxes', 'scores', 'classes')]
+        boxes_a, scores_a, classes_a = [actual[key][keep_actual] for key in ('boxes', 'scores', 'classes')]
+
+        ious = iou_matrix(boxes_e.astype(np.float64), boxes_a.astype(np.float64))
+        ious *= np.round(classes_e)[:, np.newaxis] == np.round(classes_a)[np.newaxis, :]
+        if ious.size:
+            best_ious.extend([ious.max(axis=1), ious.max(axis=0)])
+            best = ious.argmax(axis=1)
+            is_match = ious[np.arange(len(best)), best] >= MATCH_IOU
+            score_differences.append(np.abs(scores_e[is_match] - scores_a[best[is_match]]))
+            matched += int(is_match.sum())
+        else:
+            best_ious.append(np.zeros(len(boxes_e) + len(boxes_a)))
+        total += len(boxes_e)
+
+    best_ious = np.concatenate(best_ious) if best_ious else np.zeros(0)
+    score_differences = np.concatenate(score_differences) if score_differences else np.zeros(0)
+    return {'drift': float(1 - best_ious.mean()) if best_ious.size else 0.0,
+            'score_drift': float(score_differences.mean()) if score_differences.size else 0.0,
+            'recall': matched / total if total else 1.0}
+
+
+# Returns the names of the points on the Pareto front of (latency, drift), given as (name, latency, drift) tuples: the
+# points no other point is both at least as fast and at least as accurate as, and better at one of them
+def pareto_front(points):
+    front = []
+    best_drift = None
+    for name, latency, drift in sorted(points, key=lambda point: (point[1], point[2])):
+        if best_drift is None or drift < best_drift:
+            front.append(name)
+            best_drift = drift
+    return front
+
+
+# Converts every variant in worker processes, at most jobs at a time. Returns a dictionary that maps variant names to
+# their BackendResults
+def convert_variants(variants, args, graph_chars, model):
+    if backend_runner.worker_context().get_start_method() != 'fork':
+        graph_chars = model = None
+    jobs = [(variant.name, backend_runner.run_backend,
+             (variant.backend, variant.args, variant.input_dims, graph_chars, model)) for variant in variants]
+    results = backend_runner.run_jobs(jobs, max_workers=args.jobs or os.cpu_count(), timeout=args.timeout)
+    return {result.name: result for result in results}
+
+
+# Converts and measures every variant of the search space, and returns the tuning report
+def tune(args):
+    model = model_loader.load_model(args.input)
+    graph_chars = model.graph_chars
+    input_node = graph_chars.input_nodes[0]
+    baseline_dims = [int(dim) for dim in converter_util.get_input_dims(args, input_node, graph_chars=graph_chars)]
+
+    variants = read_space(args.space)
+    report = {'input': args.input, 'tolerance': args.tolerance, 'score_threshold': args.score_threshold,
+              'threads': args.threads, 'variants': []}
+    entries = {}
+    convertible = []
+    for variant in variants:
+        entry = {'name': variant.name, 'backend': variant.backend, 'options': variant.options}
+        try:
+            variant.args = variant_args(args, variant)
+            variant.input_dims = [int(dim) for dim in
+                                  converter_util.get_input_dims(variant.args, input_node, graph_chars=graph_chars)]
+        except ValueError as e:
+            entry.update({'status': "error", 'error': str(e)})
+        else:
+            entry['input_dims'] = variant.input_dims
+            convertible.append(variant)
+        entries[variant.name] = entry
+        report['variants'].append(entry)
+
+    with stage_trace.stage("tune/convert", variants=len(convertible)):
+        conversions = convert_variants(convertible, args, graph_chars, model)
+
+    with stage_trace.stage("tune/baseline"):
+        baseline = inference_benchmark.run_isolated(measure_model, 'tensorflow', args.input, baseline_dims, args,
+                                                    timeout=args.benchmark_timeout)
+    reference = baseline.pop('detections')
+    report['baseline'] = dict(baseline, input_dims=baseline_dims)
+
+    points = []
+    for variant in convertible:
+        entry = entries[variant.name]
+        conversion = conversions[variant.name]
+        entry.update({'status': conversion.status, 'error': conversion.error, 'convert_seconds': conversion.elapsed})
+        if conversion.status != "ok":
+            continue
+
+        runtime, _ = TUNABLE_BACKENDS[variant.backend]
+        with stage_trace.stage("tune/measure", variant=variant.name):
+            try:
+                result = inference_benchmark.run_isolated(measure_model, runtime, artifact_path(variant),
+                                                          variant.input_dims, args, timeout=args.benchmark_timeout)
+            except RuntimeError as e:
+                entry.update({'status': "error", 'error': str(e)})
+                continue
+        entry.update(output_drift(reference, result.pop('detections'), args.score_threshold))
+        entry.update(result)
+        points.append((variant.name, entry['latency_ms']['p50'], entry['drift']))
+
+    front = set(pareto_front(points))
+    for entry in report['variants']:
+        entry['pareto'] = entry['name'] in front
+    acceptable = [point for point in points if point[2] <= args.tolerance]
+    report['selected'] = min(acceptable, key=lambda point: point[1])[0] if acceptable else None
+    return report
+
+
+def print_report(report):
+    print("\nTuning results (baseline p50 {:.2f} ms):".format(report['baseline']['latency_ms']['p50']))
+    for entry in report['variants']:
+        if 'latency_ms' in entry:
+            print("  {}{:<12} p50 {:>8.2f} ms  drift {:.4f}  recall {:.3f}  {}".format(
+                '*' if entry['pareto'] else ' ', entry['name'], entry['latency_ms']['p50'], entry['drift'],
+                entry['recall'], json.dumps(entry['options'])))
+        else:
+            print("   {:<12} {:<8} {}".format(entry['name'], entry['status'], json.dumps(entry['options'])))
+    print("(* Pareto front)")
+    if report['selected'] is None:
+        print("No variant is within the drift tolerance of {}".format(report['tolerance']))
+    else:
+        print("Selected: {}".format(report['selected']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    setup_args(parser)
+    args = parser.parse_args()
+
+    stage_trace.configure(args)
+    converter.check_tensorflow_version()
+
+    try:
+        os.makedirs(args.output_root, exist_ok=True)
+        report = tune(args)
+    finally:
+        stage_trace.write_traces(args)
+
+    with open(args.json or os.path.join(args.output_root, "tuning.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    exit(0 if report['selected'] is not None else 1)
@@ -0,0 +1,74 @@
+import importlib
+
+
+# A conversion backend, registered by module name so that its module (and the frameworks the conversion needs) is only
+# imported when the backend is used. Backend modules keep their heavy framework imports inside the conversion
+# functions, so importing one to register its arguments stays cheap
+# name: Backend name, also the args attribute that selects it
+# module: Name of the module implementing the backend
+# convert_function: Name of the conversion function, called as convert(args, input_dims, graph_chars=, model=)
+# args_function: Name of the function adding the backend-specific arguments to a parser
+# flags: Command line flags selecting the backend
+# help: Help text of the selecting flag
+# frameworks: Names of the framework modules the conversion imports, which long-lived workers import ahead of their
+#   first conversion
+class Backend:
+
+    def __init__(self, name, module, convert_function, args_function, flags, help, frameworks=()):
+        self.name = name
+        self.module = module
+        self.convert_function = convert_function
+        self.args_function = args_function
+        self.flags = flags
+        self.help = help
+        self.frameworks = tuple(frameworks)
+
+    def load(self):
+        return importlib.import_module(self.module)
+
+    # Imports the backend module and its frameworks
+    def preload(self):
+        module = self.load()
+        for framework in self.frameworks:
+            importlib.import_module(framework)
+        return module
+
+    def convert(self, args, input_dims, graph_chars=None, model=None):
+        return getattr(self.load(), self.convert_function)(args, input_dims, graph_chars=graph_chars, model=model)
+
+    def add_args(self, parser):
+        getattr(self.load(), self.args_function)(parser)
+
+
+# Backend name -> Backend, in registration order, which is also the order backends run in
+BACKENDS = {}
+
+
+def register_backend(name, module, convert_function, args_function, flags, help, frameworks=()):
+    BACKENDS[name] = Backend(name, module, convert_function, args_function, flags, help, frameworks=frameworks)
+
+
+def get_backend(name):
+    return BACKENDS[name]
+
+
+# Adds the selecting flag and the specific arguments of every registered backend to parser
+def add_backend_args(parser):
+    for backend in BACKENDS.values():
+        parser.add_argument(*backend.flags, dest=backend.name, help=backend.help, action='store_true')
+    for backend in BACKENDS.values():
+        backend.add_args(parser)
+
+
+# Returns the names of the backends selected in args
+def selected_backends(args):
+    return [name for name in BACKENDS if getattr(args, name, False)]
+
+
+register_backend('edgetpu', 'edgetpu_converter', 'convert_to_edgetpu', 'add_edgetpu_args', ["--edgetpu", "-c"],
+                 "Perform conversion for Coral EdgeTPU.", frameworks=['tensorflow'])
+register_backend('tensorrt', 'tensorrt_converter', 'convert_to_tensorrt', 'add_tensorrt_arguments',
+                 ["--tensorrt", "-t"], "Perform Tensorrt conversion.",
+                 frameworks=['tensorflow', 'tensorrt', 'uff', 'graphsurgeon'])
+register_backend('openvino', 'openvino_converter', 'convert_to_openvino', 'add_openvino_args', ["--openvino", "-ov"],
+                 "Perform OpenVINO IR conversion", frameworks=['tensorflow'])
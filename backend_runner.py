@@ -0,0 +1,194 @@
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+
+import backend_registry
+import conversion_cache
+import stage_trace
+
+
+def add_runner_args(parser):
+    conversion_cache.add_cache_args(parser)
+    parser.add_argument("--jobs", "-j", help="Run the selected backends in up to this many isolated worker processes",
+                        type=int)
+    parser.add_argument("--timeout", help="Per-backend timeout in seconds, when running with --jobs", type=float)
+
+
+# Outcome of one backend conversion
+# name: Backend name
+# status: One of "ok", "error" or "timeout"
+# elapsed: Wall time in seconds
+# error: Error message or traceback, if the conversion failed
+class BackendResult:
+
+    def __init__(self, name, status, elapsed, error=None):
+        self.name = name
+        self.status = status
+        self.elapsed = elapsed
+        self.error = error
+
+
+# Returns the (modification time, size, inode) of each artifact path that exists, to tell the artifacts a conversion
+# writes from the ones an earlier run left behind
+def _artifact_stats(artifacts):
+    stats = {}
+    for path in artifacts.values():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        stats[path] = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    return stats
+
+
+# Returns the messages of the error events the calling thread recorded from the first_event-th event on. The converters
+# report some failures with an error event and return, rather than exit
+def _errors_since(first_event):
+    thread = threading.get_ident()
+    return [event.message for event in stage_trace.TRACER.events[first_event:]
+            if event.name == "error" and event.tid == thread]
+
+
+# Runs one backend conversion in the current process, traced as the stage name. When a conversion cache is enabled in
+# args, the artifacts of an identical earlier conversion are restored instead, and the artifacts a successful
+# conversion wrote are stored. Returns None if the conversion succeeded, or the message of the error it failed with
+def convert_backend(name, args, input_dims, graph_chars=None, model=None):
+    with stage_trace.stage(name):
+        cache = conversion_cache.from_args(args)
+        if cache is not None:
+            with stage_trace.stage("cache/lookup"):
+                model_hash = conversion_cache.hash_model(args.input, model=model)
+                fields = conversion_cache.backend_key_fields(name, args, input_dims)
+                key = cache.key(model_hash, fields)
+                artifacts = conversion_cache.backend_artifacts(name, args)
+                restored = cache.restore(key, artifacts)
+            if restored:
+                stage_trace.event("cache_hit", "Restored {} conversion from cache".format(name), backend=name, key=key)
+                return None
+            stats = _artifact_stats(artifacts)
+
+        first_event = len(stage_trace.TRACER.events)
+        backend_registry.get_backend(name).convert(args, input_dims, graph_chars=graph_chars, model=model)
+        errors = _errors_since(first_event)
+        if errors:
+            return errors[-1]
+
+        if cache is not None:
+            with stage_trace.stage("cache/store"):
+                # Artifacts this conversion did not write, such as segments of an earlier run split into more
+                # segments, are not part of its result
+                written_stats = _artifact_stats(artifacts)
+                stale = {role for role, path in artifacts.items()
+                         if path in stats and written_stats.get(path) == stats[path]}
+                if all(role.startswith('?') for role in stale):
+                    cache.store(key, {role: path for role, path in artifacts.items() if role not in stale},
+                                fields=fields)
+        return None
+
+
+# Runs one backend conversion in the current process and returns its (status, error) pair. SystemExit is caught, since
+# the converters exit on unrecoverable errors
+def run_backend(name, args, input_dims, graph_chars=None, model=None):
+    try:
+        error = convert_backend(name, args, input_dims, graph_chars=graph_chars, model=model)
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            return "error", "Exited with status {}".format(e.code)
+        return "ok", None
+    except BaseException:
+        return "error", traceback.format_exc()
+    if error is not None:
+        return "error", error
+    return "ok", None
+
+
+# Runs target in a worker process and sends its result back along with the stages and events it recorded. Whatever the
+# worker inherited from its parent's trace is dropped first, so it is not reported twice
+def _worker(conn, target, target_args):
+    stage_trace.TRACER.drain()
+    result = target(*target_args)
+    conn.send((result, stage_trace.TRACER.drain()))
+    conn.close()
+
+
+# Returns the multiprocessing context workers are started with. Forking lets workers inherit already-loaded models
+def worker_context():
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+# Runs jobs in isolated worker processes, at most max_workers at a time, and returns a list of BackendResults in job
+# order. Each job is a (name, target, target_args) tuple, where target(*target_args) runs in the worker and returns a
+# (status, error) pair. A job still running after timeout seconds is terminated. on_finish, if given, is called with
+# each BackendResult as soon as its job finishes
+def run_jobs(jobs, max_workers=None, timeout=None, on_finish=None):
+    context = worker_context()
+    max_workers = max(1, max_workers or len(jobs))
+    pending = list(jobs)
+    running = {}
+    results = {}
+
+    while pending or running:
+        while pending and len(running) < max_workers:
+            name, target, target_args = pending.pop(0)
+            parent_conn, child_conn = context.Pipe(duplex=False)
+            process = context.Process(target=_worker, name="convert-" + name,
+                                      args=(child_conn, target, target_args))
+            process.start()
+            child_conn.close()
+            running[name] = (process, parent_conn, time.monotonic())
+            stage_trace.event("job_started", "Started {} conversion (pid {})".format(name, process.pid), job=name,
+                              worker_pid=process.pid)
+
+        for name, (process, conn, start) in list(running.items()):
+            elapsed = time.monotonic() - start
+            if conn.poll():
+                try:
+                    (status, error), (stages, events) = conn.recv()
+                    stage_trace.TRACER.merge(stages, events)
+                except EOFError:
+                    status, error = "error", "Worker exited without a result"
+            elif not process.is_alive():
+                status, error = "error", "Worker exited with status {}".format(process.exitcode)
+            elif timeout is not None and elapsed > timeout:
+                process.terminate()
+                status, error = "timeout", "Timed out after {:g}s".format(timeout)
+            else:
+                continue
+
+            process.join()
+            conn.close()
+            del running[name]
+            results[name] = BackendResult(name, status, elapsed, error)
+            stage_trace.event("job_finished", "Finished {} conversion: {} ({:.1f}s)".format(name, status, elapsed),
+                              job=name, status=status, elapsed=elapsed)
+            if on_finish is not None:
+                on_finish(results[name])
+
+        if running:
+            time.sleep(0.05)
+
+    return [results[name] for name, _, _ in jobs]
+
+
+# Runs the named backends in isolated worker processes, at most jobs at a time, and returns a list of BackendResults in
+# the order of names. Where processes are forked, workers inherit the already-loaded model and graph analysis;
+# otherwise each worker loads the model itself. A backend still running after timeout seconds is terminated
+def run_backends(names, args, input_dims, graph_chars=None, model=None, jobs=None, timeout=None):
+    if worker_context().get_start_method() != 'fork':
+        graph_chars = model = None
+
+    backend_jobs = [(name, run_backend, (name, args, input_dims, graph_chars, model)) for name in names]
+    return run_jobs(backend_jobs, max_workers=jobs, timeout=timeout)
+
+
+def print_summary(results):
+    print("\nConversion summary:")
+    for result in results:
+        print("  {:<10} {:<8} {:>8.1f}s".format(result.name, result.status, result.elapsed))
+    for result in results:
+        if result.error:
+            print("\n{} {}:\n{}".format(result.name, result.status, result.error))
@@ -0,0 +1,242 @@
+import argparse
+import copy
+import json
+import os
+import time
+
+import backend_registry
+import backend_runner
+import converter
+import converter_util
+import graph_optimizer
+import model_loader
+import mo_worker
+import openvino_converter
+import stage_trace
+
+# Column titles of the compatibility table, by backend
+TABLE_TITLES = {'edgetpu': "EdgeTPU", 'tensorrt': "TensorRT", 'openvino': "OpenVINO IR"}
+
+# Conversion arguments holding paths, which manifests give relative to their own directory
+PATH_ARGS = ('transformations_config', 'pipeline_config', 'openvino_dir', 'calibration_dir')
+
+
+def setup_args(parser):
+    parser.add_argument("--models", "-m", help="Directory of models, one subdirectory per model")
+    parser.add_argument("--manifest", help="JSON manifest listing the models to convert")
+    parser.add_argument("--output_root", "-o", help="Directory for the converted models, journal and table",
+                        default="./converted_models")
+    parser.add_argument("--input_dims", "-id", help="Dimensions of input tensor", type=int, nargs='+')
+    parser.add_argument("--restart", help="Ignore the journal of an earlier run and convert everything again",
+                        action='store_true')
+    parser.add_argument("--skip_failed", help="When resuming, do not retry jobs that failed in an earlier run",
+                        action='store_true')
+    parser.add_argument("--mo_workers", help="Number of persistent Model Optimizer processes shared by the OpenVINO "
+                                             "conversions. Defaults to --jobs", type=int)
+
+    graph_optimizer.add_optimizer_args(parser)
+    backend_registry.add_backend_args(parser)
+    backend_runner.add_runner_args(parser)
+    stage_trace.add_trace_args(parser)
+
+
+# A model to convert
+# name: Model name, used for its output directory and in the table
+# input: Path to the frozen graph
+# args: Dictionary of argument overrides for this model (e.g. transformations_config)
+# backends: Backends to convert this model for, or None for all selected backends
+class ModelEntry:
+
+    def __init__(self, name, input, args=None, backends=None):
+        self.name = name
+        self.input = input
+        self.args = args or {}
+        self.backends = backends
+
+
+# Returns a ModelEntry for every subdirectory of models_dir holding a frozen graph, in name order. Subdirectories with
+# several .pb files use frozen_inference_graph.pb
+def discover_models(models_dir):
+    entries = []
+    for name in sorted(os.listdir(models_dir)):
+        model_dir = os.path.join(models_dir, name)
+        if not os.path.isdir(model_dir):
+            continue
+        graphs = sorted(f for f in os.listdir(model_dir) if f.endswith(".pb"))
+        if "frozen_inference_graph.pb" in graphs:
+            graphs = ["frozen_inference_graph.pb"]
+        if len(graphs) != 1:
+            print("Skipping {}: no clear frozen graph".format(model_dir))
+            continue
+        entries.append(ModelEntry(name, os.path.join(model_dir, graphs[0])))
+    return entries
+
+
+# Reads a manifest of the form
+# {"models": [{"name": ..., "input": ..., "args": {...}, "backends": [...]}, ...]}
+# where "args" and "backends" are optional. Relative paths are resolved against the manifest's directory
+def read_manifest(path):
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        manifest = json.load(f)
+
+    entries = []
+    for model in manifest['models']:
+        model_args = dict(model.get('args', {}))
+        for key in PATH_ARGS:
+            if model_args.get(key) is not None:
+                model_args[key] = os.path.join(base_dir, model_args[key])
+        input_path = os.path.join(base_dir, model['input'])
+        name = model.get('name') or os.path.basename(os.path.dirname(input_path))
+        entries.append(ModelEntry(name, input_path, model_args, model.get('backends')))
+    return entries
+
+
+# Append-only JSON lines record of finished jobs. The latest record of a job wins
+class Journal:
+
+    def __init__(self, path, restart=False):
+        self.path = path
+        self.records = {}
+        if restart and os.path.exists(path):
+            os.remove(path)
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A line cut short by an interrupted run
+                        continue
+                    self.records[(record['model'], record['backend'])] = record
+
+    def status(self, model, backend):
+        record = self.records.get((model, backend))
+        return None if record is None else record['status']
+
+    def append(self, model, backend, result):
+        record = {'model': model, 'backend': backend, 'status': result.status, 'elapsed': result.elapsed,
+                  'error': result.error, 'finished': time.time()}
+        self.records[(model, backend)] = record
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+# Returns a copy of the batch arguments, specialized for one model
+def job_args(args, entry, output_root):
+    model_args = copy.copy(args)
+    model_args.input = entry.input
+    model_args.output_dir = os.path.join(output_root, entry.name, entry.name)
+    for key, value in entry.args.items():
+        setattr(model_args, key, value)
+    return model_args
+
+
+# Worker body of a (model, backend) job: loads the model, determines its input dimensions, optionally optimizes it and
+# converts it
+def convert_job(backend, args):
+    try:
+        directory = os.path.dirname(args.output_dir)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with stage_trace.stage("parse"):
+            model = model_loader.load_model(args.input)
+        with stage_trace.stage("graph_analysis"):
+            graph_chars = model.graph_chars
+        with stage_trace.stage("input_dims"):
+            input_dims = converter_util.get_input_dims(args, graph_chars.input_nodes[0], graph_chars=graph_chars)
+        model, graph_chars = graph_optimizer.optimize_model(args, model, graph_chars, input_dims)
+    except SystemExit as e:
+        return "error", "Exited with status {}".format(e.code)
+    except Exception as e:
+        return "error", "Could not load model: {}".format(e)
+    return backend_runner.run_backend(backend, args, input_dims, graph_chars=graph_chars, model=model)
+
+
+# Returns a markdown table in the style of COMPATIBILITY.md, with the conversion time of every successful job
+def compatibility_table(entries, backends, journal):
+    lines = ["Model | " + " | ".join(TABLE_TITLES.get(backend, backend) for backend in backends),
+             "--- | " + " | ".join("---" for _ in backends)]
+    for entry in entries:
+        cells = []
+        for backend in backends:
+            record = journal.records.get((entry.name, backend))
+            if record is None:
+                cells.append("-")
+            elif record['status'] == "ok":
+                cells.append("YES ({:.1f}s)".format(record['elapsed']))
+            else:
+                cells.append("NO ({})".format(record['status']))
+        lines.append(entry.name + " | " + " | ".join(cells))
+    return "\n".join(lines) + "\n"
+
+
+def run_batch(args):
+    if (args.models is None) == (args.manifest is None):
+        raise ValueError("Exactly one of --models and --manifest is required")
+    entries = discover_models(args.models) if args.models else read_manifest(args.manifest)
+    backends = backend_registry.selected_backends(args)
+
+    os.makedirs(args.output_root, exist_ok=True)
+    journal = Journal(os.path.join(args.output_root, "journal.jsonl"), restart=args.restart)
+
+    jobs = []
+    skipped = 0
+    for entry in entries:
+        for backend in backends:
+            if entry.backends is not None and backend not in entry.backends:
+                continue
+            status = journal.status(entry.name, backend)
+            if status == "ok" or (status is not None and args.skip_failed):
+                skipped += 1
+                continue
+            name = entry.name + "/" + backend
+            jobs.append((name, convert_job, (backend, job_args(args, entry, args.output_root))))
+
+    print("{} jobs to run, {} already finished".format(len(jobs), skipped))
+
+    def on_finish(result):
+        model_name, backend = result.name.rsplit("/", 1)
+        journal.append(model_name, backend, result)
+
+    max_workers = args.jobs or os.cpu_count()
+    if any(job_backend == 'openvino' for _, _, (job_backend, _) in jobs):
+        # OpenVINO jobs send their conversions to Model Optimizer processes started once for the whole batch
+        service = mo_worker.ModelOptimizerService(openvino_converter.openvino_install_dir(args),
+                                                  workers=args.mo_workers or max_workers, max_jobs=args.mo_max_jobs)
+        with service:
+            results = backend_runner.run_jobs(jobs, max_workers=max_workers, timeout=args.timeout, on_finish=on_finish)
+    else:
+        results = backend_runner.run_jobs(jobs, max_workers=max_workers, timeout=args.timeout, on_finish=on_finish)
+
+    table = compatibility_table(entries, backends, journal)
+    with open(os.path.join(args.output_root, "COMPATIBILITY.md"), "w") as f:
+        f.write(table)
+    print("\n" + table)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    setup_args(parser)
+    args = parser.parse_args()
+
+    stage_trace.configure(args)
+
+    if backend_registry.selected_backends(args):
+        converter.check_tensorflow_version()
+
+    try:
+        results = run_batch(args)
+    finally:
+        stage_trace.write_traces(args)
+    for result in results:
+        if result.error:
+            print("\n{} {}:\n{}".format(result.name, result.status, result.error))
+
+    exit(1 if any(result.status != "ok" for result in results) else 0)
@@ -0,0 +1,175 @@
+import hashlib
+import multiprocessing
+import os
+import queue
+
+import stage_trace
+
+# File extensions of calibration samples. Images are decoded with Pillow; .npy files hold already-preprocessed arrays
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.ppm', '.webp'}
+ARRAY_EXTENSIONS = {'.npy'}
+
+# Tensorflow DataType enum values of the supported input placeholder types
+DT_FLOAT = 1
+DT_UINT8 = 4
+
+# Seconds between checks that a decode worker is still alive, while waiting for its next sample
+_POLL_SECONDS = 1.0
+
+
+def add_calibration_args(parser):
+    parser.add_argument("--calibration_dir", help="Directory of sample images. When given, float models are quantized "
+                                                  "to full integer (int8) using these images as calibration data")
+    parser.add_argument("--calibration_samples", help="Maximum number of calibration images to use", type=int,
+                        default=300)
+    parser.add_argument("--calibration_workers", help="Number of processes decoding and resizing calibration images",
+                        type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--calibration_prefetch", help="Maximum number of decoded images held in memory ahead of the "
+                                                       "converter", type=int, default=16)
+
+
+# Returns the paths of the calibration samples in directory, in name order, at most max_samples of them
+def list_samples(directory, max_samples=None):
+    extensions = IMAGE_EXTENSIONS | ARRAY_EXTENSIONS
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                   if os.path.splitext(name)[1].lower() in extensions)
+    return paths[:max_samples] if max_samples else paths
+
+
+# Returns a digest identifying the calibration set selected in args, from the names, sizes and modification times of
+# its files rather than their contents, so that large sets are cheap to fingerprint
+def fingerprint(args):
+    hasher = hashlib.sha256()
+    for path in list_samples(args.calibration_dir, args.calibration_samples):
+        stat = os.stat(path)
+        hasher.update("{}\0{}\0{}\n".format(os.path.basename(path), stat.st_size, stat.st_mtime_ns).encode())
+    return hasher.hexdigest()
+
+
+# Preprocessing applied to every sample, picklable so that it can be handed to decode workers
+# height, width, channels: Dimensions samples are resized to
+# dtype: Tensorflow DataType of the input placeholder, DT_UINT8 or DT_FLOAT
+# mean, std: Float inputs are normalized as (pixel - mean) / std
+class SampleSpec:
+
+    def __init__(self, height, width, channels, dtype, mean, std):
+        self.height = height
+        self.width = width
+        self.channels = channels
+        self.dtype = dtype
+        self.mean = mean
+        self.std = std
+
+
+# Decodes, resizes and normalizes the sample at path into an array of shape (height, width, channels)
+def load_sample(path, spec):
+    import numpy as np
+
+    numpy_dtype = np.uint8 if spec.dtype == DT_UINT8 else np.float32
+    if os.path.splitext(path)[1].lower() in ARRAY_EXTENSIONS:
+        array = np.load(path).astype(numpy_dtype)
+        if array.shape != (spec.height, spec.width, spec.channels):
+            raise ValueError("Array of shape {} does not match the input dimensions".format(array.shape))
+        return array
+
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image = image.convert('L' if spec.channels == 1 else 'RGB')
+        image = image.resize((spec.width, spec.height), Image.BILINEAR)
+        array = np.asarray(image, dtype=numpy_dtype)
+    if spec.channels == 1:
+        array = array[..., np.newaxis]
+    if spec.dtype == DT_FLOAT:
+        array = (array - spec.mean) / spec.std
+    return array
+
+
+# Decode worker: loads each of paths in order and puts (path, array, error) on samples, which blocks while the queue is
+# full, so a worker never runs more than the queue capacity ahead of the converter
+def _decode_worker(paths, spec, samples):
+    for path in paths:
+        try:
+            samples.put((path, load_sample(path, spec), None))
+        except Exception as e:
+            samples.put((path, None, str(e)))
+
+
+# Returns the next item of samples, raising a RuntimeError if its worker process died without producing it
+def _next_sample(samples, process):
+    while True:
+        try:
+            return samples.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            if not process.is_alive():
+                try:
+                    return samples.get_nowait()
+                except queue.Empty:
+                    raise RuntimeError("Calibration decode worker exited with status {}".format(process.exitcode))
+
+
+# Yields the preprocessed samples at paths, in order, decoded by a pool of worker processes. Worker i decodes paths i,
+# i + workers, ... into its own bounded queue, and queues are read in turn, so at most prefetch samples are held in
+# memory however many paths there are. Samples that cannot be decoded are skipped
+def stream_samples(paths, spec, workers=1, prefetch=16):
+    workers = max(1, min(workers, len(paths)))
+    # Workers are spawned rather than forked, since the converter runs them while Tensorflow's threads are active
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue(max(1, prefetch // workers)) for _ in range(workers)]
+    processes = [context.Process(target=_decode_worker, args=(paths[idx::workers], spec, queues[idx]), daemon=True)
+                 for idx in range(workers)]
+    for process in processes:
+        process.start()
+
+    used = 0
+    skipped = 0
+    try:
+        for idx in range(len(paths)):
+            path, array, error = _next_sample(queues[idx % workers], processes[idx % workers])
+            if error is not None:
+                skipped += 1
+                stage_trace.event("calibration_skipped", "Skipping calibration sample {}: {}".format(path, error),
+                                  path=path, error=error)
+                continue
+            used += 1
+            yield array
+    finally:
+        # Also reached when the consumer stops early, in which case workers may be blocked on a full queue
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        stage_trace.event("calibration", "Calibrated with {} of {} samples".format(used, len(paths)), samples=used,
+                          skipped=skipped)
+
+
+# Returns a representative dataset generator function for the TFLite converter, yielding batches of the calibration
+# samples selected in args, shaped like input_dims
+# input_node: The input placeholder NodeDef
+# input_dims: Input dimensions, in NHWC order
+def representative_dataset(args, input_node, input_dims):
+    import numpy as np
+
+    dtype = input_node.attr['dtype'].type
+    if dtype not in (DT_UINT8, DT_FLOAT):
+        raise ValueError("Calibration only supports uint8 and float inputs, not type {}".format(dtype))
+    if len(input_dims) != 4:
+        raise ValueError("Calibration requires NHWC input dimensions, not {}".format(input_dims))
+
+    paths = list_samples(args.calibration_dir, args.calibration_samples)
+    if not paths:
+        raise ValueError("No calibration samples found in {}".format(args.calibration_dir))
+
+    batch_size, height, width, channels = [int(dim) for dim in input_dims]
+    spec = SampleSpec(height, width, channels, dtype, float(args.q_mean[0]), float(args.q_std[0]))
+
+    def generate():
+        batch = []
+        for array in stream_samples(paths, spec, workers=args.calibration_workers,
+                                    prefetch=args.calibration_prefetch):
+            batch.append(array)
+            if len(batch) == batch_size:
+                yield [np.stack(batch)]
+                batch = []
+
+    return generate
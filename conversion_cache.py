@@ -0,0 +1,244 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import calibration_data
+import model_segmentation
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "edge-model-converter")
+DEFAULT_CACHE_SIZE_MB = 4096
+
+# Bump when the layout of cache entries or the key derivation changes
+CACHE_VERSION = 1
+
+
+def add_cache_args(parser):
+    parser.add_argument("--no_cache", "--no-cache", help="Do not read or write the conversion cache",
+                        action='store_true')
+    parser.add_argument("--cache_dir", help="Conversion cache directory", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--cache_size", help="Conversion cache size limit in MB", type=int,
+                        default=DEFAULT_CACHE_SIZE_MB)
+
+
+def _hash_file(path, hasher=None):
+    hasher = hasher or hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+# Returns the sha256 of the frozen graph. Uses the already-mapped file of model, if given
+def hash_model(path, model=None):
+    if model is None:
+        return _hash_file(path)
+    hasher = hashlib.sha256()
+    hasher.update(model.buffer)
+    return hasher.hexdigest()
+
+
+def _hash_optional_file(path):
+    if path is None or not os.path.isfile(path):
+        return None
+    return _hash_file(path)
+
+
+def _command_version(command):
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return result.stdout.decode(errors='replace').strip()
+
+
+def _module_version(module_name):
+    try:
+        module = __import__(module_name)
+    except ImportError:
+        return None
+    return getattr(module, '__version__', None)
+
+
+# Returns the pipeline config the OpenVINO converter would pick for args
+def _openvino_pipeline_config(args):
+    if args.pipeline_config is not None:
+        return args.pipeline_config
+    pipelines = glob.glob(os.path.join(os.path.dirname(args.input) or '.', '*.config'))
+    return pipelines[0] if len(pipelines) == 1 else None
+
+
+def _openvino_dir(args):
+    return args.openvino_dir or os.getenv("INTEL_OPENVINO_DIR") or "/opt/intel/openvino"
+
+
+# Returns the normalized arguments and tool versions that determine the output of a backend
+def backend_key_fields(name, args, input_dims):
+    fields = {'backend': name, 'input_dims': [int(dim) for dim in input_dims]}
+
+    if name == 'edgetpu':
+        fields['q_mean'] = list(args.q_mean)
+        fields['q_std'] = list(args.q_std)
+        if args.calibration_dir is not None:
+            fields['calibration'] = calibration_data.fingerprint(args)
+        fields['num_segments'] = args.num_segments
+        if args.num_segments == 'auto':
+            fields['segment_memory'] = args.segment_memory
+        fields['tflite_optimize'] = not args.no_tflite_optimize
+        fields['keep_tflite_metadata'] = bool(args.keep_tflite_metadata)
+        fields['tensorflow'] = _module_version('tensorflow')
+        fields['edgetpu_compiler'] = _command_version(["edgetpu_compiler", "--version"])
+    elif name == 'tensorrt':
+        fields['no_cuda'] = bool(args.no_cuda)
+        fields['tensorrt'] = _module_version('tensorrt')
+        fields['uff'] = _module_version('uff')
+        fields['graphsurgeon'] = _module_version('graphsurgeon')
+    elif name == 'openvino':
+        fields['channel_order'] = args.channel_order
+        fields['data_type'] = args.data_type
+        fields['transformations_config'] = _hash_optional_file(args.transformations_config)
+        fields['pipeline_config'] = _hash_optional_file(_openvino_pipeline_config(args))
+        # The IR files are named after the input model
+        fields['model_name'] = os.path.splitext(os.path.basename(args.input))[0]
+        fields['model_optimizer'] = _hash_optional_file(
+            os.path.join(_openvino_dir(args), "deployment_tools", "model_optimizer", "version.txt"))
+
+    return fields
+
+
+# Returns a dictionary that maps artifact roles to the paths a backend writes them to. Optional artifacts are prefixed
+# with "?"
+def backend_artifacts(name, args):
+    output = args.output_dir
+    if name == 'edgetpu':
+        artifacts = {'tflite': output + ".tflite", 'edgetpu_tflite': output + "_edgetpu.tflite",
+                     'compile_report': output + "_edgetpu_report.json", '?compile_log': output + "_edgetpu.log",
+                     'tflite_report': output + "_tflite_report.json"}
+        if args.num_segments != 1:
+            # The number of segments is only known after planning them with --num_segments auto
+            artifacts['segments'] = output + "_segments.json"
+            count = model_segmentation.MAX_SEGMENTS if args.num_segments == 'auto' else args.num_segments
+            optional = '?' if args.num_segments == 'auto' else ''
+            for index in range(count):
+                segment = "{}_segment_{}".format(output, index)
+                artifacts[optional + 'segment_{}'.format(index)] = segment + ".tflite"
+                artifacts[optional + 'segment_{}_edgetpu'.format(index)] = segment + "_edgetpu.tflite"
+        return artifacts
+    if name == 'tensorrt':
+        artifacts = {'uff': output + ".uff"}
+        if not args.no_cuda:
+            artifacts['engine'] = output + "_tensorrt.bin"
+        return artifacts
+    if name == 'openvino':
+        ir_base = os.path.join(os.path.dirname(output), os.path.splitext(os.path.basename(args.input))[0])
+        return {'xml': ir_base + ".xml", 'bin': ir_base + ".bin", '?mapping': ir_base + ".mapping"}
+    raise ValueError("Unknown backend {}".format(name))
+
+
+# On-disk cache of conversion artifacts, keyed by the content hash of the input graph and the normalized backend
+# arguments. Each entry is a directory holding the artifacts and a manifest.json; the manifest's modification time is
+# refreshed on every hit, and the least recently used entries are evicted once the cache exceeds max_bytes
+class ConversionCache:
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_SIZE_MB << 20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # Returns the cache key of a backend conversion of the graph with content hash model_hash
+    @staticmethod
+    def key(model_hash, fields):
+        payload = json.dumps({'version': CACHE_VERSION, 'model': model_hash, 'fields': fields}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    # Copies the cached artifacts of key to the paths in artifacts. Returns False on a cache miss
+    def restore(self, key, artifacts):
+        entry_dir = self._entry_dir(key)
+        manifest_path = os.path.join(entry_dir, "manifest.json")
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        for role, path in artifacts.items():
+            stored = manifest['files'].get(role)
+            if stored is None:
+                if role.startswith('?'):
+                    continue
+                return False
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            shutil.copyfile(os.path.join(entry_dir, stored), path)
+
+        os.utime(manifest_path)
+        return True
+
+    # Stores the artifacts of a finished conversion under key. Returns False, storing nothing, if a required artifact
+    # is missing or the key is already stored. Conversions of the same key may finish at once (with --jobs, in a batch
+    # or in the daemon), so an existing entry is left as it is, rather than replaced while another process restores it
+    def store(self, key, artifacts, fields=None):
+        files = {}
+        for role, path in artifacts.items():
+            if not os.path.isfile(path):
+                if role.startswith('?'):
+                    continue
+                return False
+            files[role] = role.lstrip('?') + os.path.splitext(path)[1]
+
+        # Build the entry next to its final location and move it into place, so readers never see partial entries
+        staging_dir = tempfile.mkdtemp(prefix=".staging-", dir=self.cache_dir)
+        try:
+            size = 0
+            for role, stored in files.items():
+                shutil.copyfile(artifacts[role], os.path.join(staging_dir, stored))
+                size += os.path.getsize(artifacts[role])
+            with open(os.path.join(staging_dir, "manifest.json"), "w") as f:
+                json.dump({'files': files, 'size': size, 'fields': fields, 'created': time.time()}, f, indent=2)
+            try:
+                os.rename(staging_dir, self._entry_dir(key))
+            except OSError:
+                # Renaming onto an existing (non-empty) entry fails
+                return False
+        finally:
+            if os.path.isdir(staging_dir):
+                shutil.rmtree(staging_dir)
+
+        self.evict()
+        return True
+
+    # Removes least recently used entries until the cache fits in max_bytes
+    def evict(self):
+        entries = []
+        total = 0
+        for key in os.listdir(self.cache_dir):
+            manifest_path = os.path.join(self._entry_dir(key), "manifest.json")
+            try:
+                with open(manifest_path) as f:
+                    size = json.load(f)['size']
+                last_used = os.path.getmtime(manifest_path)
+            except (OSError, ValueError, KeyError):
+                continue
+            entries.append((last_used, key, size))
+            total += size
+
+        for _, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total -= size
+
+
+# Returns the ConversionCache selected by args, or None if caching is disabled
+def from_args(args):
+    if getattr(args, 'no_cache', True):
+        return None
+    return ConversionCache(args.cache_dir, args.cache_size << 20)
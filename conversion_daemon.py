@@ -0,0 +1,672 @@
+import argparse
+import hmac
+import http.client
+import http.server
+import json
+import math
+import multiprocessing
+import os
+import queue
+import secrets
+import signal
+import socket
+import socketserver
+import threading
+import time
+import traceback
+import urllib.parse
+
+import backend_registry
+import backend_runner
+import batch_converter
+import conversion_cache
+import converter
+import stage_trace
+
+# Unix socket the daemon listens on by default
+DEFAULT_SOCKET = os.path.join(conversion_cache.DEFAULT_CACHE_DIR, "daemon.sock")
+
+# Localhost port the daemon listens on where there are no Unix sockets
+DEFAULT_PORT = 8642
+
+# File the token clients present to a daemon on a localhost port is written to
+DEFAULT_TOKEN_FILE = os.path.join(conversion_cache.DEFAULT_CACHE_DIR, "daemon.token")
+
+# Host names requests to a daemon on a localhost port may be addressed to. Others come from pages of other sites whose
+# name resolves to 127.0.0.1
+LOCAL_HOSTS = ('127.0.0.1', 'localhost')
+
+# Number of conversions a worker process runs before it is replaced, to bound its memory growth
+DEFAULT_MAX_JOBS = 20
+
+# Number of finished jobs whose status is kept
+MAX_FINISHED_JOBS = 1000
+
+# Longest a status request waits for its job to finish, in seconds
+MAX_WAIT = 60
+
+# Task and job states. A job is finished once none of its tasks is queued or running
+QUEUED = "queued"
+RUNNING = "running"
+CANCELLED = "cancelled"
+FINISHED_STATES = ("ok", "error", "timeout", CANCELLED)
+
+
+# Arguments locating the daemon, shared by the daemon and its clients
+def add_address_args(parser):
+    parser.add_argument("--socket", help="Unix socket of the daemon. Defaults to {}".format(DEFAULT_SOCKET))
+    parser.add_argument("--port", help="Localhost port of the daemon, used instead of a Unix socket. Requests must "
+                                       "then present the token of --token_file", type=int)
+    parser.add_argument("--token_file", help="File holding the token of a daemon on a localhost port, only readable "
+                                             "by its user. Defaults to {}".format(DEFAULT_TOKEN_FILE),
+                        default=DEFAULT_TOKEN_FILE)
+
+
+# Returns the (socket_path, port) pair of a daemon address, exactly one of which is None: the Unix socket, unless a
+# port is given or the platform has no Unix sockets
+def resolve_address(socket_path=None, port=None):
+    if socket_path is not None:
+        return socket_path, None
+    if port is not None or not hasattr(socket, 'AF_UNIX'):
+        return None, port or DEFAULT_PORT
+    return DEFAULT_SOCKET, None
+
+
+def setup_args(parser):
+    add_address_args(parser)
+    parser.add_argument("--backends", help="Backends to serve. Defaults to all", nargs='+',
+                        choices=list(backend_registry.BACKENDS))
+    parser.add_argument("--concurrency", help="Number of conversions of a backend that run at once, as backend=count "
+                                              "(e.g. edgetpu=2). Defaults to 1 per backend", nargs='+', default=[])
+    parser.add_argument("--max_jobs", help="Number of conversions a worker process runs before it is replaced",
+                        type=int, default=DEFAULT_MAX_JOBS)
+    parser.add_argument("--timeout", help="Per-conversion timeout in seconds", type=float)
+    parser.add_argument("--preload", help="Start every worker, importing its frameworks, before accepting jobs",
+                        action='store_true')
+
+
+# Returns the dictionary that maps each of backends to its number of workers, from backend=count arguments
+def parse_concurrency(values, backends):
+    concurrency = dict.fromkeys(backends, 1)
+    for value in values:
+        name, _, count = value.partition('=')
+        if name not in concurrency or not count.isdigit() or int(count) < 1:
+            raise ValueError("Invalid concurrency {}: expected backend=count for one of {}"
+                             .format(value, ", ".join(backends)))
+        concurrency[name] = int(count)
+    return concurrency
+
+
+# Body of a worker process: imports the backend and its frameworks once, then runs each (args, cwd) pair received on
+# connection as a conversion in directory cwd, and answers with its (status, error, artifacts, stages, events) tuple
+def _worker_main(connection, backend):
+    try:
+        backend_registry.get_backend(backend).preload()
+        converter.check_tensorflow_version()
+    except SystemExit as e:
+        connection.send(('error', "Exited with status {}".format(e.code)))
+        return
+    except Exception:
+        connection.send(('error', traceback.format_exc()))
+        return
+    connection.send(('ready', None))
+
+    while True:
+        try:
+            item = connection.recv()
+        except EOFError:
+            break
+        if item is None:
+            break
+        args, cwd = item
+        stage_trace.TRACER.drain()
+        try:
+            os.chdir(cwd)
+            stage_trace.configure(args)
+            status, error = batch_converter.convert_job(backend, args)
+            artifacts = {key.lstrip('?'): os.path.abspath(path)
+                         for key, path in conversion_cache.backend_artifacts(backend, args).items()
+                         if os.path.exists(path)}
+        except BaseException:
+            status, error, artifacts = "error", traceback.format_exc(), {}
+        stages, events = stage_trace.TRACER.drain()
+        connection.send((status, error, artifacts, stages, events))
+
+
+# A long-lived process converting for one backend, taking conversions over a pipe so that its frameworks are only
+# imported once. The process is started on the first conversion, and replaced after max_jobs conversions, or when a
+# conversion times out or crashes it
+class ConversionWorker:
+
+    def __init__(self, backend, max_jobs=DEFAULT_MAX_JOBS):
+        self.backend = backend
+        self.max_jobs = max_jobs
+        self.jobs = 0
+        # Process id of the worker that ran the last conversion
+        self.last_pid = None
+        self._process = None
+        self._connection = None
+
+    @property
+    def pid(self):
+        return None if self._process is None else self._process.pid
+
+    # Whether the worker has run its max_jobs conversions
+    @property
+    def exhausted(self):
+        return self._process is not None and self.jobs >= self.max_jobs
+
+    def start(self):
+        # Spawned rather than forked, as the daemon runs request threads
+        context = multiprocessing.get_context('spawn')
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(target=_worker_main, args=(child_connection, self.backend),
+                                        name="convert-" + self.backend, daemon=True)
+        self._process.start()
+        child_connection.close()
+        self.jobs = 0
+        try:
+            status, error = self._connection.recv()
+        except EOFError:
+            status, error = 'error', "Worker exited with status {}".format(self._process.exitcode)
+        if status != 'ready':
+            self.close()
+            raise RuntimeError("Could not start a {} worker:\n{}".format(self.backend, error))
+
+    # Runs a conversion with the converter arguments args (an argparse.Namespace) in directory cwd, and returns its
+    # (status, error, artifacts, stages, events) tuple. A conversion still running after timeout seconds is terminated
+    # along with the worker
+    def run(self, args, cwd, timeout=None):
+        if self.exhausted:
+            self.close()
+        if self._process is None or not self._process.is_alive():
+            self.start()
+        self.jobs += 1
+        self.last_pid = self._process.pid
+        self._connection.send((args, cwd))
+        if not self._connection.poll(timeout):
+            self.close(terminate=True)
+            return "timeout", "Timed out after {:g}s".format(timeout), {}, [], []
+        try:
+            return self._connection.recv()
+        except EOFError:
+            self._process.join(5)
+            exitcode = self._process.exitcode
+            self.close(terminate=True)
+            return "error", "Worker exited with status {}".format(exitcode), {}, [], []
+
+    def close(self, terminate=False):
+        if self._process is not None:
+            if not terminate:
+                try:
+                    self._connection.send(None)
+                except (OSError, ValueError):
+                    pass
+                self._process.join(5)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join()
+            self._connection.close()
+        self._process = None
+        self._connection = None
+
+
+# The conversion of a job for one backend
+class ConversionTask:
+
+    def __init__(self, job, backend):
+        self.job = job
+        self.backend = backend
+        self.status = QUEUED
+        self.error = None
+        self.artifacts = {}
+        self.elapsed = None
+        self.worker_pid = None
+        self.stages = []
+        self.events = []
+
+    def to_json(self):
+        return {'status': self.status, 'error': self.error, 'artifacts': self.artifacts, 'elapsed': self.elapsed,
+                'worker_pid': self.worker_pid, 'events': [event.to_json() for event in self.events]}
+
+
+# A conversion request: the converter.py arguments of a client, converted for each selected backend
+# args: Dictionary of the parsed converter.py arguments
+# cwd: Directory of the client, which relative paths of args are resolved against
+class ConversionJob:
+
+    def __init__(self, job_id, args, cwd):
+        self.id = job_id
+        self.args = args
+        self.cwd = cwd
+        self.submitted = time.time()
+        self.finished = None
+        namespace = argparse.Namespace(**args)
+        self.tasks = {name: ConversionTask(self, name) for name in backend_registry.selected_backends(namespace)}
+
+    @property
+    def status(self):
+        states = [task.status for task in self.tasks.values()]
+        if any(state in (QUEUED, RUNNING) for state in states):
+            return RUNNING if any(state != QUEUED for state in states) else QUEUED
+        if all(state == "ok" for state in states):
+            return "ok"
+        return CANCELLED if all(state == CANCELLED for state in states) else "error"
+
+    def to_json(self):
+        return {'id': self.id, 'status': self.status, 'input': self.args.get('input'), 'cwd': self.cwd,
+                'submitted': self.submitted, 'finished': self.finished,
+                'backends': {name: task.to_json() for name, task in self.tasks.items()}}
+
+
+# Queues conversion jobs and runs them on long-lived worker processes, one pool of concurrency[backend] workers per
+# backend, so that the frameworks of a backend are imported once per worker rather than once per conversion
+class ConversionDaemon:
+
+    def __init__(self, concurrency, max_jobs=DEFAULT_MAX_JOBS, timeout=None):
+        self.concurrency = concurrency
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.jobs = {}
+        self._next_id = 1
+        self._condition = threading.Condition()
+        self._queues = {name: queue.Queue() for name in concurrency}
+        self._workers = []
+        self._threads = []
+        for name, count in concurrency.items():
+            for i in range(count):
+                worker = ConversionWorker(name, max_jobs=max_jobs)
+                thread = threading.Thread(target=self._dispatch, args=(worker,), name="{}-{}".format(name, i),
+                                          daemon=True)
+                self._workers.append(worker)
+                self._threads.append(thread)
+                thread.start()
+
+    # Starts every worker ahead of the first job. Workers failing to start are retried on their first job
+    def preload(self):
+        for worker in self._workers:
+            print("Starting {} worker".format(worker.backend))
+            try:
+                worker.start()
+            except RuntimeError as e:
+                print(e)
+
+    def _dispatch(self, worker):
+        tasks = self._queues[worker.backend]
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            with self._condition:
+                if task.status == CANCELLED:
+                    continue
+                task.status = RUNNING
+            job = task.job
+            print("Job {}: converting {} for {}".format(job.id, job.args.get('input'), task.backend))
+            start = time.monotonic()
+            try:
+                # The client's --timeout takes precedence over the daemon's
+                timeout = job.args.get('timeout') or self.timeout
+                status, error, artifacts, stages, events = worker.run(argparse.Namespace(**job.args), job.cwd,
+                                                                      timeout=timeout)
+            except Exception as e:
+                status, error, artifacts, stages, events = "error", str(e), {}, [], []
+            with self._condition:
+                task.status, task.error, task.artifacts = status, error, artifacts
+                task.elapsed = time.monotonic() - start
+                task.worker_pid = worker.last_pid
+                task.stages, task.events = stages, events
+                finished = job.status in FINISHED_STATES
+                if finished:
+                    job.finished = time.time()
+                self._condition.notify_all()
+            print("Job {}: {} conversion {} ({:.1f}s)".format(job.id, task.backend, status, task.elapsed))
+            if finished:
+                self._finish(job)
+
+            # A worker due for replacement is replaced while idle, so the next conversion finds its frameworks imported
+            if worker.exhausted:
+                worker.close()
+                try:
+                    worker.start()
+                except RuntimeError as e:
+                    print(e)
+
+    # Writes the trace files requested by a finished job
+    def _finish(self, job):
+        tracer = stage_trace.Tracer()
+        for task in job.tasks.values():
+            tracer.merge(task.stages, task.events)
+        for key, build in (('trace', tracer.to_json), ('chrome_trace', tracer.to_chrome_trace)):
+            if job.args.get(key):
+                try:
+                    with open(os.path.join(job.cwd, job.args[key]), "w") as f:
+                        json.dump(build(), f, indent=2 if key == 'trace' else None, default=str)
+                except OSError as e:
+                    print("Job {}: could not write {}: {}".format(job.id, job.args[key], e))
+
+    # Queues a job converting with the converter.py arguments args (a dictionary) in directory cwd, and returns it
+    def submit(self, args, cwd):
+        if not os.path.isabs(cwd):
+            raise ValueError("The client directory must be absolute, got {}".format(cwd))
+        with self._condition:
+            job = ConversionJob(str(self._next_id), args, cwd)
+            if not job.tasks:
+                raise ValueError("No backend selected")
+            unserved = [name for name in job.tasks if name not in self._queues]
+            if unserved:
+                raise ValueError("Backends not served by this daemon: {}".format(", ".join(unserved)))
+            self._next_id += 1
+            self.jobs[job.id] = job
+            self._forget_finished()
+            print("Job {}: queued {} for {}".format(job.id, args.get('input'), ", ".join(job.tasks)))
+            for name, task in job.tasks.items():
+                self._queues[name].put(task)
+        return job
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    # Returns the job with id job_id, or None. With wait, waits up to that many seconds for the job to finish
+    def job(self, job_id, wait=None):
+        deadline = None if wait is None else time.monotonic() + min(wait, MAX_WAIT)
+        with self._condition:
+            job = self.jobs.get(job_id)
+            while job is not None and deadline is not None and job.status not in FINISHED_STATES:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return job
+
+    # Cancels the conversions of a job that have not started yet, and returns the job or None
+    def cancel(self, job_id):
+        with self._condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            for task in job.tasks.values():
+                if task.status == QUEUED:
+                    task.status = CANCELLED
+            if job.status in FINISHED_STATES and job.finished is None:
+                job.finished = time.time()
+            self._condition.notify_all()
+            return job
+
+    def jobs_json(self):
+        with self._condition:
+            return [job.to_json() for job in self.jobs.values()]
+
+    def to_json(self):
+        with self._condition:
+            queued = {name: 0 for name in self.concurrency}
+            for job in self.jobs.values():
+                for name, task in job.tasks.items():
+                    if task.status == QUEUED:
+                        queued[name] += 1
+            return {'pid': os.getpid(), 'max_jobs': self.max_jobs, 'timeout': self.timeout,
+                    'backends': {name: {'workers': count, 'queued': queued[name]}
+                                 for name, count in self.concurrency.items()},
+                    'workers': [{'backend': worker.backend, 'pid': worker.pid, 'jobs': worker.jobs}
+                                for worker in self._workers]}
+
+    def close(self):
+        for name, tasks in self._queues.items():
+            for _ in range(self.concurrency[name]):
+                tasks.put(None)
+        for worker in self._workers:
+            worker.close(terminate=True)
+
+
+# HTTP handler of the job API:
+# GET /                    Daemon status: workers and queue lengths
+# GET /jobs                Status of every job
+# POST /jobs               Queue a job, from a {"args": {...}, "cwd": ...} body
+# GET /jobs/<id>?wait=<s>  Status of a job, after waiting up to s seconds for it to finish
+# DELETE /jobs/<id>        Cancel the conversions of a job that have not started
+# Jobs run code and write files as the daemon's user, so requests from web pages and other users are refused: on a
+# localhost port, requests must be addressed to a local host name and present the daemon's token, and jobs are only
+# queued from JSON bodies, which pages cannot post without a CORS preflight
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    def _send(self, code, body):
+        data = json.dumps(body, default=str).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self):
+        url = urllib.parse.urlsplit(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        return parts, urllib.parse.parse_qs(url.query)
+
+    def _job(self, parts, lookup):
+        if len(parts) != 2 or parts[0] != 'jobs':
+            self._send(404, {'error': "Not found"})
+            return
+        job = lookup(parts[1])
+        if job is None:
+            self._send(404, {'error': "No job {}".format(parts[1])})
+            return
+        self._send(200, job.to_json())
+
+    # Sends an error response and returns False if the request is not allowed
+    def _check_request(self, json_body=False):
+        token = self.server.token
+        if token is not None:
+            host = urllib.parse.urlsplit("//" + self.headers.get('Host', '')).hostname
+            if host not in LOCAL_HOSTS:
+                self._send(403, {'error': "Requests must be addressed to localhost"})
+                return False
+            if not hmac.compare_digest(self.headers.get('Authorization', ''), "Bearer " + token):
+                self._send(401, {'error': "Missing or wrong daemon token"})
+                return False
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if json_body and content_type != 'application/json':
+            self._send(415, {'error': "Expected an application/json body"})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self._check_request():
+            return
+        daemon = self.server.conversion_daemon
+        parts, query = self._route()
+        if not parts:
+            self._send(200, daemon.to_json())
+        elif parts == ['jobs']:
+            self._send(200, daemon.jobs_json())
+        else:
+            try:
+                wait = float(query['wait'][0]) if 'wait' in query else None
+                if wait is not None and not (math.isfinite(wait) and wait >= 0):
+                    raise ValueError("wait must be a non-negative number of seconds")
+            except ValueError as e:
+                self._send(400, {'error': str(e)})
+                return
+            self._job(parts, lambda job_id: daemon.job(job_id, wait=wait))
+
+    def do_POST(self):
+        if not self._check_request(json_body=True):
+            return
+        parts, _ = self._route()
+        if parts != ['jobs']:
+            self._send(404, {'error': "Not found"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            job = self.server.conversion_daemon.submit(request['args'], request['cwd'])
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {'error': str(e)})
+            return
+        self._send(201, job.to_json())
+
+    def do_DELETE(self):
+        if not self._check_request():
+            return
+        parts, _ = self._route()
+        self._job(parts, self.server.conversion_daemon.cancel)
+
+    # Unix socket clients have no address
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else self.server.server_address
+
+    # Requests are not logged; jobs are
+    def log_message(self, format, *args):
+        pass
+
+
+class _HTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+# Writes a new random token to token_file, only readable by the current user, and returns it
+def _write_token(token_file):
+    directory = os.path.dirname(token_file)
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    token = secrets.token_urlsafe(32)
+    fd = os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        os.chmod(token_file, 0o600)
+        f.write(token)
+    return token
+
+
+# Returns an HTTP server for daemon on the Unix socket socket_path, only accessible to the user running the daemon, or
+# else on the localhost port, requiring the token it writes to token_file (see resolve_address)
+def make_server(daemon, socket_path=None, port=None, token_file=DEFAULT_TOKEN_FILE):
+    socket_path, port = resolve_address(socket_path, port)
+    if socket_path is None:
+        server = _HTTPServer(('127.0.0.1', port), _Handler)
+        server.token = _write_token(token_file)
+    else:
+        if os.path.exists(socket_path):
+            # Reuse the socket of a daemon that is gone, but not of one still running
+            try:
+                with socket.socket(socket.AF_UNIX) as probe:
+                    probe.connect(socket_path)
+                raise OSError("A daemon is already listening on {}".format(socket_path))
+            except ConnectionRefusedError:
+                os.remove(socket_path)
+        directory = os.path.dirname(socket_path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        # Created without permissions for others, rather than restricted once it already accepts connections
+        umask = os.umask(0o177)
+        try:
+            server = _UnixHTTPServer(socket_path, _Handler)
+        finally:
+            os.umask(umask)
+        server.token = None
+    server.conversion_daemon = daemon
+    return server
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+# Client of the job API of a daemon, on the Unix socket socket_path, or else on the localhost port, presenting the token
+# in token_file (see resolve_address)
+class DaemonClient:
+
+    def __init__(self, socket_path=None, port=None, token_file=DEFAULT_TOKEN_FILE):
+        self.socket_path, self.port = resolve_address(socket_path, port)
+        self.token_file = token_file
+
+    def _request(self, method, path, body=None):
+        headers = {'Content-Type': 'application/json'}
+        if self.socket_path is None:
+            with open(self.token_file) as f:
+                headers['Authorization'] = "Bearer " + f.read().strip()
+            connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=MAX_WAIT + 30)
+        else:
+            connection = _UnixHTTPConnection(self.socket_path, timeout=MAX_WAIT + 30)
+        try:
+            data = None if body is None else json.dumps(body).encode('utf-8')
+            connection.request(method, path, body=data, headers=headers)
+            response = connection.getresponse()
+            result = json.loads(response.read().decode('utf-8'))
+        finally:
+            connection.close()
+        if response.status >= 400:
+            raise RuntimeError("Daemon error {}: {}".format(response.status, result.get('error')))
+        return result
+
+    def status(self):
+        return self._request('GET', '/')
+
+    def jobs(self):
+        return self._request('GET', '/jobs')
+
+    # Queues a conversion with the converter.py arguments args (an argparse.Namespace or dictionary), with relative
+    # paths resolved against cwd, and returns the job status
+    def submit(self, args, cwd=None):
+        args = dict(vars(args)) if isinstance(args, argparse.Namespace) else dict(args)
+        return self._request('POST', '/jobs', {'args': args, 'cwd': os.path.abspath(cwd or os.getcwd())})
+
+    def job(self, job_id, wait=None):
+        return self._request('GET', '/jobs/{}{}'.format(job_id, '' if wait is None else '?wait={:g}'.format(wait)))
+
+    def cancel(self, job_id):
+        return self._request('DELETE', '/jobs/{}'.format(job_id))
+
+    # Returns the status of a job once it has finished, or after timeout seconds
+    def wait(self, job_id, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = MAX_WAIT if deadline is None else max(0.0, min(MAX_WAIT, deadline - time.monotonic()))
+            job = self.job(job_id, wait=wait)
+            if job['status'] in FINISHED_STATES or (deadline is not None and time.monotonic() >= deadline):
+                return job
+
+
+# Returns the BackendResults of a job status, for backend_runner.print_summary
+def job_results(job):
+    return [backend_runner.BackendResult(name, task['status'], task['elapsed'] or 0.0, task['error'])
+            for name, task in job['backends'].items()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    setup_args(parser)
+    args = parser.parse_args()
+
+    backends = args.backends or list(backend_registry.BACKENDS)
+    daemon = ConversionDaemon(parse_concurrency(args.concurrency, backends), max_jobs=args.max_jobs,
+                              timeout=args.timeout)
+    socket_path, port = resolve_address(args.socket, args.port)
+    server = make_server(daemon, socket_path=socket_path, port=port, token_file=args.token_file)
+    # Stopped like on Ctrl-C, removing the socket or token file and the worker processes
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        if args.preload:
+            daemon.preload()
+        print("Serving {} on {}".format(", ".join(backends), socket_path or "http://127.0.0.1:{} (token in {})"
+                                        .format(port, args.token_file)))
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        created = args.token_file if socket_path is None else socket_path
+        if os.path.exists(created):
+            os.remove(created)
+        daemon.close()
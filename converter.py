@@ -1,12 +1,11 @@
 import argparse
-from packaging import version
 
-import tensorflow as tf
-
-import edgetpu_converter
-import tensorrt_converter
-import openvino_converter
 import converter_util
+import graph_optimizer
+import model_loader
+import backend_registry
+import backend_runner
+import stage_trace
 
 # TODO: Organize argument grouping
 def setup_args(parser):
@@ -16,41 +15,66 @@ def setup_args(parser):
     parser.add_argument("--input_dims", "-id", help="Dimensions of input tensor", type=int, nargs='+')
     parser.add_argument("--output_dir", "-o", help="Output dir and filename.", default="./converted_model")
 
-    parser.add_argument("--edgetpu", "-c", help="Perform conversion for Coral EdgeTPU.", action='store_true')
-    parser.add_argument("--tensorrt", "-t", help="Perform Tensorrt conversion.", action='store_true')
-    parser.add_argument("--openvino", "-ov", help="Perform OpenVINO IR conversion", action='store_true')
-
-    edgetpu_converter.add_edgetpu_args(parser)
-    tensorrt_converter.add_tensorrt_arguments(parser)
-    openvino_converter.add_openvino_args(parser)
+    graph_optimizer.add_optimizer_args(parser)
+    backend_registry.add_backend_args(parser)
+    backend_runner.add_runner_args(parser)
+    stage_trace.add_trace_args(parser)
 
 
-if __name__ == '__main__':
+def check_tensorflow_version():
+    import tensorflow as tf
+    from packaging import version
 
     if version.parse(tf.__version__) >= version.parse("2.0.0"):
-        print("ERROR: This script is only compatible with tensorflow 1")
+        stage_trace.event("error", "ERROR: This script is only compatible with tensorflow 1",
+                          tensorflow=tf.__version__)
         exit(1)
 
+
+if __name__ == '__main__':
+
     parser = argparse.ArgumentParser()
     setup_args(parser)
     args = parser.parse_args()
 
-    # Create graph
-    with tf.compat.v1.gfile.GFile(args.input, "rb") as f:
-        graph_def = tf.compat.v1.GraphDef()
-        graph_def.ParseFromString(f.read())
-
-    # Get graph data
-    graph_chars = converter_util.GraphCharacteristics(graph_def)
-
-    # Set input dimensions
-    input_dims = converter_util.get_input_dims(args, graph_chars.input_nodes[0])  # TODO: Only supports one input tensor
-
-    if args.edgetpu:
-        edgetpu_converter.convert_to_edgetpu(args, input_dims, graph_chars=graph_chars)
-
-    if args.tensorrt:
-        tensorrt_converter.convert_to_tensorrt(args, input_dims, graph_chars=graph_chars)
-
-    if args.openvino:
-        openvino_converter.convert_to_openvino(args, input_dims, graph_chars=graph_chars)
\ No newline at end of file
+    stage_trace.configure(args)
+
+    # Trace files are written however the run ends, including on the exit() of a failed conversion
+    try:
+        # Backend frameworks are only imported once the arguments are parsed, and only for the selected backends
+        backends = backend_registry.selected_backends(args)
+        if backends:
+            with stage_trace.stage("check_tensorflow"):
+                check_tensorflow_version()
+
+        # Load the graph once, and share it between backends
+        with stage_trace.stage("parse"):
+            model = model_loader.load_model(args.input)
+
+        # Get graph data
+        with stage_trace.stage("graph_analysis"):
+            graph_chars = model.graph_chars
+
+        # Set input dimensions
+        with stage_trace.stage("input_dims"):
+            input_dims = converter_util.get_input_dims(args, graph_chars.input_nodes[0], graph_chars=graph_chars)  # TODO: Only supports one input tensor
+
+        # Optionally convert a pruned and constant-folded copy of the graph instead
+        model, graph_chars = graph_optimizer.optimize_model(args, model, graph_chars, input_dims)
+
+        if args.jobs:
+            results = backend_runner.run_backends(backends, args, input_dims, graph_chars=graph_chars, model=model,
+                                                  jobs=args.jobs, timeout=args.timeout)
+            backend_runner.print_summary(results)
+            if any(result.status != "ok" for result in results):
+                exit(1)
+            exit(0)
+
+        failed = False
+        for name in backends:
+            error = backend_runner.convert_backend(name, args, input_dims, graph_chars=graph_chars, model=model)
+            failed = failed or error is not None
+        if failed:
+            exit(1)
+    finally:
+        stage_trace.write_traces(args)
@@ -0,0 +1,54 @@
+import argparse
+import sys
+
+import backend_runner
+import conversion_daemon
+import converter
+
+# Arguments of the client itself, which are not sent to the daemon
+CLIENT_ARGS = ('socket', 'port', 'token_file', 'no_wait', 'wait_timeout')
+
+
+# The arguments of converter.py, plus the daemon's address
+def setup_args(parser):
+    converter.setup_args(parser)
+    conversion_daemon.add_address_args(parser)
+    parser.add_argument("--no_wait", help="Print the job id and return without waiting for the conversion",
+                        action='store_true')
+    parser.add_argument("--wait_timeout", help="Give up waiting for the conversion after this many seconds (the job "
+                                               "keeps running)", type=float)
+
+
+# Prints the messages the conversions of a finished job recorded, their artifacts and the conversion summary
+def print_job(job):
+    for name, task in job['backends'].items():
+        for event in task['events']:
+            print(event['message'])
+        for key, path in sorted(task['artifacts'].items()):
+            print("{} {}: {}".format(name, key, path))
+    backend_runner.print_summary(conversion_daemon.job_results(job))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    setup_args(parser)
+    args = parser.parse_args()
+
+    client = conversion_daemon.DaemonClient(socket_path=args.socket, port=args.port, token_file=args.token_file)
+    job_args = {key: value for key, value in vars(args).items() if key not in CLIENT_ARGS}
+    try:
+        job = client.submit(job_args)
+    except (OSError, RuntimeError) as e:
+        print("Could not queue the conversion: {}".format(e), file=sys.stderr)
+        exit(2)
+
+    print("Queued job {} ({})".format(job['id'], ", ".join(job['backends'])))
+    if args.no_wait:
+        exit(0)
+
+    job = client.wait(job['id'], timeout=args.wait_timeout)
+    if job['status'] not in conversion_daemon.FINISHED_STATES:
+        print("Job {} is still {}".format(job['id'], job['status']))
+        exit(1)
+    print_job(job)
+    exit(0 if job['status'] == "ok" else 1)
@@ -1,9 +1,341 @@
-import queue
+import sys
+from array import array
+from bisect import bisect_right
+from collections import deque
+from collections.abc import Mapping
+from itertools import accumulate
+
+import shape_inference
+import stage_trace
+
+
+# Strips the control-dependency marker and output port from a node input string, leaving the producing node's name
+def input_node_name(input_name):
+    return input_name.split(':')[0].lstrip('^')
+
+
+# Returns the most specific of namespaces (a collection of namespace names) holding the node called name, matching whole
+# name components ("concat" holds "concat" and "concat/axis", not "concat_1"), or None
+def namespace_owner(name, namespaces):
+    owner = None
+    prefix = None
+    for component in name.split('/'):
+        prefix = component if prefix is None else prefix + '/' + component
+        if prefix in namespaces:
+            owner = prefix
+    return owner
+
+
+class _TrieNode:
+    __slots__ = ('children', 'names')
+
+    def __init__(self):
+        # Component -> _TrieNode of the namespaces directly under this one
+        self.children = {}
+        # Names of the nodes directly in this namespace, as an ordered set
+        self.names = {}
+
+
+# Hierarchical index of the namespaces of node names, whose components are separated by "/". The nodes of a namespace
+# are the node named like it, if any, and the nodes under it, matching whole components: "Postprocessor" holds
+# "Postprocessor" and "Postprocessor/Decode/add", but neither "Postprocessor_1" nor "SecondStagePostprocessor/add".
+# Queries take time proportional to the size of the namespace asked about, not to the number of nodes. Names are kept
+# in the order they were added, which is graph order for a trie built from a graph's node names
+# names: Node names to add
+class NamespaceTrie:
+
+    def __init__(self, names=()):
+        self._root = _TrieNode()
+        # Namespace name -> _TrieNode, so that adding a node does not walk down from the root
+        self._namespaces = {'': self._root}
+        # Name -> order in which it was added
+        self._order = {}
+        self._added = 0
+        # Inlined add, as the trie of a graph is built from all its node names at once
+        namespaces = self._namespaces
+        for name in names:
+            if name in self._order:
+                continue
+            self._order[name] = self._added
+            self._added += 1
+            namespace = name.rpartition('/')[0]
+            trie_node = namespaces.get(namespace)
+            if trie_node is None:
+                trie_node = self._namespace_node(namespace)
+            trie_node.names[name] = None
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, name):
+        return name in self._order
+
+    def _namespace_node(self, namespace):
+        trie_node = self._namespaces.get(namespace)
+        if trie_node is None:
+            parent, _, component = namespace.rpartition('/')
+            trie_node = self._namespaces[namespace] = _TrieNode()
+            self._namespace_node(parent).children[component] = trie_node
+        return trie_node
+
+    # Adds the node called name. Names already present keep their position
+    def add(self, name):
+        if name in self._order:
+            return
+        self._order[name] = self._added
+        self._added += 1
+        self._namespace_node(name.rpartition('/')[0]).names[name] = None
+
+    # Removes the node called name, if present
+    def remove(self, name):
+        if self._order.pop(name, None) is None:
+            return
+        del self._namespaces[name.rpartition('/')[0]].names[name]
+
+    # Returns the names of the nodes in namespaces (a namespace name, or a collection of them), in the order they were
+    # added
+    def members(self, namespaces):
+        if type(namespaces) is str:
+            namespaces = [namespaces]
+        names = set()
+        for namespace in namespaces:
+            if namespace in self._order:
+                names.add(namespace)
+            trie_node = self._namespaces.get(namespace)
+            stack = [trie_node] if trie_node is not None else []
+            while stack:
+                trie_node = stack.pop()
+                names.update(trie_node.names)
+                stack.extend(trie_node.children.values())
+        return sorted(names, key=self._order.__getitem__)
+
+    # Returns the names of the namespaces directly under namespace, or of the top-level namespaces if it is None
+    def children(self, namespace=None):
+        trie_node = self._namespaces.get('' if namespace is None else namespace)
+        if trie_node is None:
+            return []
+        prefix = '' if namespace is None else namespace + '/'
+        return [prefix + component for component in trie_node.children]
+
+
+# Lightweight view of a single node in a GraphIndex
+# id: Integer id of the node within the index
+# name: Node name
+# op: Node op type
+# node: The underlying NodeDef
+class NodeRecord:
+    __slots__ = ('id', 'name', 'op', 'node')
+
+    def __init__(self, node_id, name, op, node):
+        self.id = node_id
+        self.name = name
+        self.op = op
+        self.node = node
+
+    def __repr__(self):
+        return "NodeRecord({}, {!r}, {!r})".format(self.id, self.name, self.op)
+
+
+# Integer-id index over a tensorflow graphdef. Node names are interned once, in graph order, and the graph edges are
+# stored as CSR-style adjacency arrays, so traversals work on ints instead of re-splitting input strings. Properties:
+# names: List that maps node ids to node names
+# ids: Dictionary that maps node names to node ids
+# nodes: List that maps node ids to NodeDef objects
+# ops: List that maps node ids to op types
+# ops_by_type: Dictionary that maps op types to arrays of node ids. Built lazily
+# input_offsets, input_ids: CSR reverse adjacency. The producers feeding node i are
+#   input_ids[input_offsets[i]:input_offsets[i + 1]], in NodeDef input order (control inputs included)
+# output_offsets, output_ids: CSR forward adjacency, laid out the same way, listing the consumers of each node. Built
+#   lazily, since most analyses only walk the graph backwards
+# out_degrees: Array that maps node ids to their number of consumers. Built lazily
+# Inputs that reference nodes missing from the graph are ignored.
+class GraphIndex:
+
+    def __init__(self, graph_def):
+        self.nodes = nodes = list(graph_def.node)
+        self.names = names = [node.name for node in nodes]
+        self.ids = ids = dict(zip(names, range(len(names))))
+        self.ops = [node.op for node in nodes]
+
+        # Build the reverse (input) adjacency. Most inputs are plain node names and resolve with a single dictionary
+        # lookup; only the ones carrying a port or control marker are split afterwards
+        get = ids.get
+        sources = [get(input_name, -1) for node in nodes for input_name in node.input]
+        self.input_offsets = array('i', [0])
+        self.input_offsets.extend(accumulate(len(node.input) for node in nodes))
+        if -1 in sources:
+            self._resolve_inputs(sources)
+        self.input_ids = array('i', sources)
+
+        self._ops_by_type = None
+        self._out_degrees = None
+        self._output_offsets = None
+        self._output_ids = None
+        self._namespaces = None
+
+    # Resolves the inputs in sources that did not match a node name directly, then drops references to nodes that
+    # are not in the graph, adjusting the input offsets to match
+    def _resolve_inputs(self, sources):
+        offsets = self.input_offsets
+        missing = False
+        pos = -1
+        while True:
+            try:
+                pos = sources.index(-1, pos + 1)
+            except ValueError:
+                break
+            node_id = bisect_right(offsets, pos) - 1
+            input_name = self.nodes[node_id].input[pos - offsets[node_id]]
+            sources[pos] = self.ids.get(input_node_name(input_name), -1)
+            missing = missing or sources[pos] == -1
+
+        if missing:
+            dropped = 0
+            start = 0
+            for node_id in range(len(self.nodes)):
+                end = offsets[node_id + 1]
+                dropped += sources[start:end].count(-1)
+                offsets[node_id + 1] = end - dropped
+                start = end
+            sources[:] = [src for src in sources if src != -1]
+
+    # Dictionary that maps op types to arrays of node ids, in graph order. Built on first use
+    @property
+    def ops_by_type(self):
+        if self._ops_by_type is None:
+            self._ops_by_type = {}
+            for node_id, op in enumerate(self.ops):
+                bucket = self._ops_by_type.get(op)
+                if bucket is None:
+                    bucket = self._ops_by_type[op] = array('i')
+                bucket.append(node_id)
+        return self._ops_by_type
+
+    # NamespaceTrie of the node names, in which the order of a name is its node id. Built on first use
+    @property
+    def namespaces(self):
+        if self._namespaces is None:
+            self._namespaces = NamespaceTrie(self.names)
+        return self._namespaces
+
+    # Array that maps node ids to their number of consumers. Built on first use
+    @property
+    def out_degrees(self):
+        if self._out_degrees is None:
+            out_degrees = [0] * len(self.nodes)
+            for src in self.input_ids:
+                out_degrees[src] += 1
+            self._out_degrees = array('i', out_degrees)
+        return self._out_degrees
+
+    # CSR forward (output) adjacency, built on first use with a counting sort over the reverse edges
+    @property
+    def output_offsets(self):
+        if self._output_offsets is None:
+            self._build_outputs()
+        return self._output_offsets
+
+    @property
+    def output_ids(self):
+        if self._output_ids is None:
+            self._build_outputs()
+        return self._output_ids
+
+    def _build_outputs(self):
+        num_nodes = len(self.names)
+        output_offsets = array('i', [0]) * (num_nodes + 1)
+        total = 0
+        for node_id, degree in enumerate(self.out_degrees):
+            total += degree
+            output_offsets[node_id + 1] = total
+
+        cursor = output_offsets[:-1]
+        output_ids = array('i', bytes(4 * total))
+        input_offsets = self.input_offsets
+        input_ids = self.input_ids
+        for dst in range(num_nodes):
+            for pos in range(input_offsets[dst], input_offsets[dst + 1]):
+                src = input_ids[pos]
+                output_ids[cursor[src]] = dst
+                cursor[src] += 1
+
+        self._output_offsets = output_offsets
+        self._output_ids = output_ids
+
+    def __len__(self):
+        return len(self.names)
+
+    # Returns the ids of the nodes feeding node_id
+    def inputs(self, node_id):
+        return self.input_ids[self.input_offsets[node_id]:self.input_offsets[node_id + 1]]
+
+    # Returns the ids of the nodes consuming node_id
+    def outputs(self, node_id):
+        return self.output_ids[self.output_offsets[node_id]:self.output_offsets[node_id + 1]]
+
+    # Returns the number of consumers of node_id
+    def out_degree(self, node_id):
+        return self.out_degrees[node_id]
+
+    # Returns the ids of all nodes without consumers, in graph order
+    def sink_ids(self):
+        return [node_id for node_id, degree in enumerate(self.out_degrees) if degree == 0]
+
+    # Returns the ids of all nodes with the given op type
+    def find_by_op(self, op):
+        return self.ops_by_type.get(op, array('i'))
+
+    # Returns a NodeRecord for node_id
+    def record(self, node_id):
+        return NodeRecord(node_id, self.names[node_id], self.ops[node_id], self.nodes[node_id])
+
+
+# Read-only name -> NodeDef mapping backed by a GraphIndex
+class _NodesByName(Mapping):
+
+    def __init__(self, index):
+        self._index = index
+
+    def __getitem__(self, name):
+        return self._index.nodes[self._index.ids[name]]
+
+    def __contains__(self, name):
+        return name in self._index.ids
+
+    def __iter__(self):
+        return iter(self._index.names)
+
+    def __len__(self):
+        return len(self._index.names)
+
+    def values(self):
+        return self._index.nodes
+
+
+# Read-only name -> [output NodeDefs] mapping backed by a GraphIndex
+class _NodeOutputsByName(Mapping):
+
+    def __init__(self, index):
+        self._index = index
+
+    def __getitem__(self, name):
+        index = self._index
+        return [index.nodes[dst] for dst in index.outputs(index.ids[name])]
+
+    def __contains__(self, name):
+        return name in self._index.ids
+
+    def __iter__(self):
+        return iter(self._index.names)
+
+    def __len__(self):
+        return len(self._index.names)
 
 
 # Returns a GraphCharacteristics object given a tensorflow graphdef, which has the following properties:
-# nodes_by_name: A dictionary that maps node names to node objects in the graph
-# node_outputs_by_name: A dictionary that maps node names to their respective output node objects
+# index: The GraphIndex of the graph
+# nodes_by_name: A mapping from node names to node objects in the graph
+# node_outputs_by_name: A mapping from node names to their respective output node objects
 # input_node_names: List of likely input node names
 # input_names: List of likely input nodes
 # output_node_names: List of likely output node names
@@ -11,54 +343,77 @@ import queue
 class GraphCharacteristics:
 
     def __init__(self, graph_def):
-        self.nodes_by_name = {}
-        self.node_outputs_by_name = {}
-
-        # Build node-name graph
-        for node in graph_def.node:
-            self.nodes_by_name[node.name] = node
-            self.node_outputs_by_name[node.name] = []
-
-        # Build name-output graph
-        for node in graph_def.node:
-            for input_node_name in node.input:
-                input_node_proper = input_node_name.split(':')[0].lstrip('^')
-                self.node_outputs_by_name[input_node_proper].append(node)
+        self.index = index = GraphIndex(graph_def)
+        self.nodes_by_name = _NodesByName(index)
+        self.node_outputs_by_name = _NodeOutputsByName(index)
 
         # Ascertain input nodes
-        self.input_node_names = [node.name for node in graph_def.node if node.op == 'Placeholder']
-        self.input_nodes = [self.nodes_by_name[node_name] for node_name in self.input_node_names]
-        print("Input names: ", self.input_node_names)
+        self.input_ids = list(index.find_by_op('Placeholder'))
+        self.input_node_names = [index.names[node_id] for node_id in self.input_ids]
+        self.input_nodes = [index.nodes[node_id] for node_id in self.input_ids]
+        stage_trace.event("input_names", "Input names: {}".format(self.input_node_names),
+                          names=self.input_node_names)
 
         # Ascertain output nodes
-        self.output_node_names = [node for node in self.node_outputs_by_name.keys() if
-                                  self.node_outputs_by_name[node] == []]
-        self.output_nodes = [self.nodes_by_name[node_name] for node_name in self.output_node_names]
-        print("Output names: ", self.output_node_names)
-
-    # Returns all nodes that are inputs of (but not in) a particular subgraph
+        self.output_ids = index.sink_ids()
+        self.output_node_names = [index.names[node_id] for node_id in self.output_ids]
+        self.output_nodes = [index.nodes[node_id] for node_id in self.output_ids]
+        stage_trace.event("output_names", "Output names: {}".format(self.output_node_names),
+                          names=self.output_node_names)
+
+        self._ancestor_searches = {}
+        self._shape_inference = None
+
+    # Returns an AncestorSearch for the given target groups, shared with earlier callers asking for the same targets
+    def ancestor_search(self, targets):
+        key = tuple((name, target if type(target) is str else tuple(target)) for name, target in targets.items())
+        if key not in self._ancestor_searches:
+            self._ancestor_searches[key] = AncestorSearch(self, targets)
+        return self._ancestor_searches[key]
+
+    # Returns the ShapeInference of the graph with its placeholders' own shapes, computed on first use. With targets, a
+    # list of node names, only these and their ancestors need to be inferred (see ShapeInference for shallow), unless
+    # the whole graph already was
+    def shape_inference(self, targets=None, shallow=False):
+        if self._shape_inference is None:
+            if targets is not None:
+                return shape_inference.ShapeInference(self, targets=targets, shallow=shallow)
+            self._shape_inference = shape_inference.ShapeInference(self)
+        return self._shape_inference
+
+    # Returns the ids of the nodes of a subgraph, given as a namespace name or a list of them (see NamespaceTrie), in
+    # graph order
+    def get_subgraph_ids(self, subgraph_names):
+        ids = self.index.ids
+        return [ids[name] for name in self.index.namespaces.members(subgraph_names)]
+
+    # Returns all nodes that are inputs of (but not in) a particular subgraph, given as a namespace name or a list of
+    # them, in the order the subgraph reads them
     def get_subgraph_inputs(self, subgraph_names):
-
-        if type(subgraph_names) is str:
-            subgraph_names = [subgraph_names]
-
+        index = self.index
+        member_ids = self.get_subgraph_ids(subgraph_names)
+        members = set(member_ids)
+        seen = set()
         nodes = []
-
-        for node in self.nodes_by_name.values():
-            if not any(x in node.name for x in subgraph_names):
-                continue
-            for input_node in node.input:
-                input_node_proper = input_node.split(':')[0].lstrip('^')
-                if not any(x in input_node_proper for x in subgraph_names) and self.nodes_by_name[
-                        input_node_proper] not in nodes:
-                    nodes.append(self.nodes_by_name[input_node_proper])
-
+        for node_id in member_ids:
+            for input_id in index.inputs(node_id):
+                if input_id not in members and input_id not in seen:
+                    seen.add(input_id)
+                    nodes.append(index.nodes[input_id])
         return nodes
 
+    # Returns the nodes of a subgraph, given as a namespace name or a list of them, that nodes outside it read from
+    def get_subgraph_outputs(self, subgraph_names):
+        index = self.index
+        member_ids = self.get_subgraph_ids(subgraph_names)
+        members = set(member_ids)
+        return [index.nodes[node_id] for node_id in member_ids
+                if any(dst not in members for dst in index.outputs(node_id))]
+
 
-# Determines the input dimensions, by whichever means necessary
-# TODO: Automatically determine input dimensions for trickier graphs
-def get_input_dims(args, input_node):
+# Determines the input dimensions, by whichever means necessary: the given args, the input node's shape, static
+# inference over the graph (if graph_chars is given) and, as a last resort, prompting the user
+def get_input_dims(args, input_node, graph_chars=None):
     proposed_dims = args.input_dims
     node_dims = [input_node.attr['shape'].shape.dim[i].size for i in
                  range(len(input_node.attr['shape'].shape.dim))]
@@ -83,6 +438,17 @@ def get_input_dims(args, input_node):
     if unknown_dims == 0:
         return node_dims
 
+    if graph_chars is not None:
+        inferred_dims = shape_inference.infer_input_dims(graph_chars, input_node, node_dims)
+        if inferred_dims is not None:
+            stage_trace.event("input_dims", "Inferred input dimensions {}".format(inferred_dims), dims=inferred_dims,
+                              source="inferred")
+            return inferred_dims
+
+    if not sys.stdin.isatty():
+        raise ValueError("Could not determine the input dimensions of {} (existing: {}) and cannot prompt for them. "
+                         "Please provide them with --input_dims".format(input_node.name, node_dims))
+
     node_dims_print = [(dim if dim != -1 else '?') for dim in node_dims]
     while True:
         proposed_dims = input("Existing input structure is {}, enter {} missing dimensions:\n"
@@ -94,69 +460,213 @@ def get_input_dims(args, input_node):
 
     proposed_iter = iter(proposed_dims)
     node_dims = [(dim if dim != -1 else int(next(proposed_iter))) for dim in node_dims]
-    print("Using input dimensions ", node_dims)
+    stage_trace.event("input_dims", "Using input dimensions {}".format(node_dims), dims=node_dims, source="prompt")
     return node_dims
 
 
-# Performs a depth-first-search across a tensorflow graph for a node with a name containing the target string
+# Target strings used to recognise the SSD head tensors feeding the postprocessor
+SSD_TARGETS = {
+    'loc': ["BoxEncodingPredictor", "refined_locations"],
+    'conf': ["ClassPredictor", "class_predictions"],
+    'priorbox': ["GridAnchor", "TensorArrayStack_4"],
+    'class': ["ClassPredictor", "TFLite_Detection_PostProcess:1", "Reshape_5"],
+}
+
+
+# Answers "does node N have an ancestor matching target X" for a fixed set of named target groups, where a match is
+# an input string (as written in a NodeDef, port included) containing one of the group's target strings. Searches move
+# from outputs to inputs over the GraphIndex, and each node is expanded at most once per AncestorSearch: results are
+# memoized per node as a bitmask of the groups it reaches, so queries from different start nodes share their work.
+# Cycles (e.g. while loops) are handled by collapsing strongly connected components, so results do not depend on
+# search order or depth.
+# graph_chars: GraphCharacteristics object
+# targets: dictionary that maps group names to a target string or list of target strings
+class AncestorSearch:
+
+    def __init__(self, graph_chars, targets):
+        self.index = graph_chars.index
+        self.groups = []
+        self.bits = {}
+        for bit, (key, target) in enumerate(targets.items()):
+            if type(target) is str:
+                target = [target]
+            self.groups.append((1 << bit, list(target)))
+            self.bits[key] = 1 << bit
+
+        num_nodes = len(self.index)
+        self._masks = [None] * num_nodes
+        self._num = array('i', [-1]) * num_nodes
+        self._low = array('i', [-1]) * num_nodes
+        self._on_stack = bytearray(num_nodes)
+        self._counter = 0
+
+    # Returns True if node (a NodeDef, node name or node id) has an ancestor matching the target group key
+    def reaches(self, node, key):
+        return bool(self.mask(node) & self.bits[key])
+
+    # Returns the names of all target groups reached from node
+    def groups_reached(self, node):
+        mask = self.mask(node)
+        return [key for key, bit in self.bits.items() if mask & bit]
+
+    # Returns the bitmask of target groups reached from node
+    def mask(self, node):
+        node_id = self._node_id(node)
+        if self._masks[node_id] is None:
+            self.search([node_id])
+        return self._masks[node_id]
+
+    # Resolves the target groups reached by every node in start_nodes with a single traversal of their ancestors
+    def search(self, start_nodes):
+        masks = self._masks
+        num = self._num
+        low = self._low
+        on_stack = self._on_stack
+        input_offsets = self.index.input_offsets
+        input_ids = self.index.input_ids
+
+        # Iterative Tarjan SCC over the reverse graph. Components are finished in reverse topological order, so all
+        # of a component's external inputs are resolved by the time it is popped
+        stack = []
+        for root in map(self._node_id, start_nodes):
+            if masks[root] is not None:
+                continue
+            num[root] = low[root] = self._counter
+            self._counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            work = [[root, input_offsets[root]]]
+
+            while work:
+                frame = work[-1]
+                node_id, pos = frame
+                if pos < input_offsets[node_id + 1]:
+                    frame[1] = pos + 1
+                    src = input_ids[pos]
+                    if masks[src] is not None:
+                        continue
+                    if num[src] == -1:
+                        num[src] = low[src] = self._counter
+                        self._counter += 1
+                        stack.append(src)
+                        on_stack[src] = 1
+                        work.append([src, input_offsets[src]])
+                    elif on_stack[src]:
+                        low[node_id] = min(low[node_id], num[src])
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node_id])
+                if low[node_id] != num[node_id]:
+                    continue
+
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = 0
+                    component.append(member)
+                    if member == node_id:
+                        break
+
+                # Members of a component reach each other, so they share the union of their matches
+                mask = 0
+                for member in component:
+                    mask |= self._edge_mask(member)
+                    for pos in range(input_offsets[member], input_offsets[member + 1]):
+                        src_mask = masks[input_ids[pos]]
+                        if src_mask is not None:
+                            mask |= src_mask
+                for member in component:
+                    masks[member] = mask
+
+    # Returns the bitmask of target groups matched by the input strings of a single node
+    def _edge_mask(self, node_id):
+        mask = 0
+        for input_name in self.index.nodes[node_id].input:
+            for bit, target in self.groups:
+                if not mask & bit and any(x in input_name for x in target):
+                    mask |= bit
+        return mask
+
+    def _node_id(self, node):
+        if type(node) is int:
+            return node
+        if type(node) is str:
+            return self.index.ids[node]
+        return self.index.ids[node.name]
+
+
+# Performs a breadth-first-search across a tensorflow graph for a node with a name containing the target string
 # starting at the node "start"
 # note this search from moves outputs to inputs
 # target can be either a string or list of strings
 # returns a result node if one is found, otherwise returns None
-# Will not search more nodes than DFS_SEARCH_LIMIT
-def BFS(graph, start, target, graph_chars=None, search_limit=50):
+# Will not expand more than search_limit nodes, if given. Each node is expanded at most once
+def BFS(graph, start, target, graph_chars=None, search_limit=None):
     if graph_chars is None:
         graph_chars = GraphCharacteristics(graph)
 
     if type(target) == str:
         target = [target]
 
-    target_node = None
-
-    q = queue.Queue()
-    searchCount = 0
-    q.put(start)
-    while q is not None and not q.empty():
-        node = q.get()
-        for node_name in node.input:
-            if any(x in node_name for x in target):
-                target_node = graph_chars.nodes_by_name[node_name]
-                q = None
-                break
-            q.put(graph_chars.nodes_by_name[node_name.split(':')[0].lstrip('^')])
-
-        if searchCount > search_limit:
+    index = graph_chars.index
+    visited = bytearray(len(index))
+    start_id = index.ids[start.name]
+    visited[start_id] = 1
+
+    q = deque([start_id])
+    search_count = 0
+    while q:
+        node_id = q.popleft()
+        for input_name in index.nodes[node_id].input:
+            if any(x in input_name for x in target):
+                return index.nodes[index.ids[input_node_name(input_name)]]
+        for input_id in index.inputs(node_id):
+            if not visited[input_id]:
+                visited[input_id] = 1
+                q.append(input_id)
+
+        search_count += 1
+        if search_limit is not None and search_count > search_limit:
             break
 
-        searchCount += 1
-
-    return target_node
+    return None
 
 
 # returns number of classes in SSD classification, where
 # graph is a graphDef
 # graph_chars is the graph characteristics object, if you've already computed it
 def get_num_classes(graph, graph_chars=None):
-    import tensorflow as tf
 
-    initial_node_names = ["Postprocessor", "PostProcess"]
-    class_node_names = ["ClassPredictor", "TFLite_Detection_PostProcess:1", "Reshape_5"]
+    initial_node_names = ["Postprocessor", "TFLite_Detection_PostProcess"]
 
     if graph_chars is None:
         graph_chars = GraphCharacteristics(graph)
 
     search_nodes = graph_chars.get_subgraph_inputs(initial_node_names)
+    search = graph_chars.ancestor_search(SSD_TARGETS)
+    search.search(search_nodes)
 
     class_node = None
     for node in search_nodes:
-        if BFS(graph, node, class_node_names, graph_chars=graph_chars) is not None:
+        if search.reaches(node, 'class'):
             class_node = node
             break
     if class_node is None:
-        print("Error: Could not find a class output node for # class determination")
+        stage_trace.event("num_classes_error", "Error: Could not find a class output node for # class determination")
         exit(1)
 
-    # TODO: Remove tensorflow dependency, if possible
+    # The class count is usually set by the reshape targets of the class predictors, which a shallow pass reaches
+    # without inferring the feature extractor
+    for shallow in (True, False):
+        class_shape = graph_chars.shape_inference(targets=[class_node.name], shallow=shallow).shape(class_node.name)
+        if class_shape and class_shape[-1] > 0:
+            return class_shape[-1]
+
+    # Fall back to Tensorflow's shape inference for graphs the static pass does not cover
+    import tensorflow as tf
     class_tensor = tf.graph_util.import_graph_def(graph, return_elements=[class_node.name + ":0"])
 
     return int(class_tensor[0].shape[-1])
@@ -166,50 +676,34 @@ def get_num_classes(graph, graph_chars=None):
 # Where the order is the input order to the postprocessor subgraph with prefix postprocessor_prefix
 def get_NMS_input_order(graph, postprocessor_prefix, graph_chars=None):
 
-    loc_targets = ["BoxEncodingPredictor", "refined_locations"]
-    conf_targets = ["ClassPredictor", "class_predictions"]
-    priorbox_targets = ["GridAnchor", "TensorArrayStack_4"]
-    all_targets = loc_targets + conf_targets + priorbox_targets
-
     if graph_chars is None:
         graph_chars = GraphCharacteristics(graph)
 
     order = [-1, -1, -1]
 
     input_nodes = graph_chars.get_subgraph_inputs(postprocessor_prefix)
+    search = graph_chars.ancestor_search(SSD_TARGETS)
+    search.search(input_nodes)
 
     # Trim irrelevant inputs
     relevant_input_nodes = []
     for input_node in input_nodes:
-        if BFS(graph, input_node, all_targets, graph_chars=graph_chars) \
-                is not None and input_node not in relevant_input_nodes:
+        if any(search.reaches(input_node, key) for key in ('loc', 'conf', 'priorbox')) \
+                and input_node not in relevant_input_nodes:
             relevant_input_nodes.append(input_node)
 
     if len(relevant_input_nodes) != 3:
-        print("NMS input order error: {} relevant input nodes, should be 3".format(len(relevant_input_nodes)))
-
-    # Find locations
-    for idx, node in enumerate(relevant_input_nodes):
-        if BFS(graph, node, loc_targets, graph_chars=graph_chars) is not None:
-            order[0] = idx
-            break
-    if order[0] == -1:
-        print("NMS input order error: Could not find the locations input")
-
-    # Find confidences
-    for idx, node in enumerate(relevant_input_nodes):
-        if BFS(graph, node, conf_targets, graph_chars=graph_chars) is not None:
-            order[1] = idx
-            break
-    if order[1] == -1:
-        print("NMS input order error: Could not find the classes input")
-
-    # Find priorboxes
-    for idx, node in enumerate(relevant_input_nodes):
-        if BFS(graph, node, priorbox_targets, graph_chars=graph_chars) is not None:
-            order[2] = idx
-            break
-    if order[2] == -1:
-        print("NMS input order error: Could not find the priorboxes input")
+        stage_trace.event("nms_input_order_error", "NMS input order error: {} relevant input nodes, should be 3"
+                          .format(len(relevant_input_nodes)), relevant_inputs=len(relevant_input_nodes))
+
+    for order_idx, key, description in [(0, 'loc', "locations"), (1, 'conf', "classes"),
+                                        (2, 'priorbox', "priorboxes")]:
+        for idx, node in enumerate(relevant_input_nodes):
+            if search.reaches(node, key):
+                order[order_idx] = idx
+                break
+        if order[order_idx] == -1:
+            stage_trace.event("nms_input_order_error", "NMS input order error: Could not find the {} input"
+                              .format(description), missing=key)
 
     return order
@@ -0,0 +1,499 @@
+import argparse
+import json
+
+import backend_registry
+import converter_util
+import graph_optimizer
+import model_loader
+import model_segmentation
+import shape_inference
+import tensorrt_converter
+
+# How a backend runs a node
+ACCELERATED = "accelerated"
+# Removed, forwarded or constant-folded by the conversion, costing nothing at run time
+FOLDED = "folded"
+# Replaced by a plugin, custom op or custom layer
+PLUGIN = "plugin"
+# Falls back to the CPU
+CPU = "cpu"
+# Expected to make the conversion fail
+UNSUPPORTED = "unsupported"
+
+STATUSES = [ACCELERATED, FOLDED, PLUGIN, CPU, UNSUPPORTED]
+
+# Namespace depth of the per-namespace totals
+DEFAULT_DEPTH = 2
+
+# Number of namespaces, nodes and flagged nodes listed in the text report
+DEFAULT_TOP = 10
+
+# Bytes per element assumed for tensors of unknown dtype
+DEFAULT_ELEMENT_SIZE = 4
+
+# Ops that do not run once converted
+FOLDED_OPS = {
+    'Const', 'Placeholder', 'PlaceholderWithDefault', 'Identity', 'Snapshot', 'StopGradient', 'CheckNumerics', 'NoOp',
+    'Assert', 'FakeQuantWithMinMaxVars', 'FakeQuantWithMinMaxArgs',
+}
+
+# Ops counting one operation per output element
+ELEMENTWISE_OPS = (shape_inference.UNARY_OPS | shape_inference.BINARY_OPS | {'AddN'}) - FOLDED_OPS
+
+# Reductions, counting one operation per input element
+REDUCE_OPS = {'Mean', 'Sum', 'Max', 'Min', 'Prod', 'ArgMax', 'ArgMin'}
+
+# Tensorflow ops the Edge TPU compiler maps to the Edge TPU, once converted to their TFLite counterparts
+EDGETPU_OPS = {
+    'Conv2D', 'DepthwiseConv2dNative', 'Conv2DBackpropInput', 'MatMul', 'BiasAdd', 'Add', 'AddV2', 'Sub', 'Mul',
+    'Maximum', 'Minimum', 'SquaredDifference', 'Relu', 'Relu6', 'LeakyRelu', 'Sigmoid', 'Tanh', 'Softmax', 'AvgPool',
+    'MaxPool', 'ConcatV2', 'Reshape', 'Squeeze', 'ExpandDims', 'Pack', 'Pad', 'PadV2', 'Mean', 'Sum', 'Max', 'Min',
+    'ResizeBilinear', 'ResizeNearestNeighbor', 'Rsqrt', 'Slice', 'StridedSlice', 'Split', 'SplitV', 'Transpose',
+    'SpaceToDepth', 'FusedBatchNorm', 'FusedBatchNormV2', 'FusedBatchNormV3',
+}
+
+# TFLite custom ops, which run on the CPU next to the Edge TPU
+EDGETPU_CUSTOM_OPS = {'TFLite_Detection_PostProcess'}
+
+# Control flow and resource ops the TFLite converter cannot convert
+TFLITE_UNSUPPORTED_OPS = {
+    'Enter', 'Exit', 'Merge', 'Switch', 'LoopCond', 'NextIteration', 'TensorArrayV3', 'TensorArrayReadV3',
+    'TensorArrayWriteV3', 'TensorArrayGatherV3', 'TensorArrayScatterV3', 'TensorArraySizeV3', 'VariableV2',
+    'VarHandleOp', 'ReadVariableOp',
+}
+
+# Ops the UFF parser converts to TensorRT layers. TensorRT has no CPU fallback, so the others fail the conversion
+TENSORRT_OPS = {
+    'Conv2D', 'DepthwiseConv2dNative', 'Conv2DBackpropInput', 'MatMul', 'BiasAdd', 'Add', 'AddV2', 'Sub', 'Mul',
+    'RealDiv', 'Maximum', 'Minimum', 'Relu', 'Relu6', 'Elu', 'Selu', 'Softplus', 'Sigmoid', 'Tanh', 'Softmax', 'Neg',
+    'Abs', 'Exp', 'Log', 'Sqrt', 'Rsqrt', 'Square', 'Reciprocal', 'Floor', 'AvgPool', 'MaxPool', 'ConcatV2',
+    'Reshape', 'Squeeze', 'ExpandDims', 'Pack', 'Pad', 'Mean', 'Sum', 'Max', 'Min', 'Prod', 'Transpose',
+    'StridedSlice', 'FusedBatchNorm', 'FusedBatchNormV2', 'FusedBatchNormV3', 'LRN', 'Shape',
+}
+
+# Ops the Model Optimizer converts to IR layers
+OPENVINO_OPS = TENSORRT_OPS | {
+    'LeakyRelu', 'SquaredDifference', 'Pow', 'Greater', 'GreaterEqual', 'Less', 'LessEqual', 'Equal', 'NotEqual',
+    'LogicalAnd', 'LogicalOr', 'AddN', 'Cast', 'ToFloat', 'PadV2', 'MirrorPad', 'Slice', 'Split', 'SplitV', 'Unpack',
+    'Tile', 'Fill', 'Range', 'Gather', 'GatherV2', 'GatherNd', 'Where', 'TopKV2', 'ArgMax', 'ArgMin', 'Size', 'Rank',
+    'ResizeBilinear', 'ResizeNearestNeighbor', 'SpaceToDepth', 'DepthToSpace', 'SpaceToBatchND', 'BatchToSpaceND',
+    'NonMaxSuppressionV3', 'ZerosLike', 'OnesLike', 'LogSoftmax', 'Round', 'FloorDiv', 'Div',
+}
+
+# SSD namespaces the Model Optimizer's object detection API transformations replace, and the layer replacing each
+# (None where the namespace is removed)
+OPENVINO_NAMESPACES = {
+    "Preprocessor": None,
+    "MultipleGridAnchorGenerator": "PriorBoxClustered",
+    "Postprocessor": "DetectionOutput",
+}
+
+
+# Returns the namespace of a node name truncated to depth components, or "" for top-level nodes
+def namespace(name, depth):
+    return '/'.join(name.split('/')[:-1][:depth])
+
+
+def _element_size(node, port):
+    return model_segmentation.DTYPE_SIZES.get(model_segmentation._tensor_dtype(node, port), DEFAULT_ELEMENT_SIZE)
+
+
+# Returns the floating point operations of one run of node, a multiply-add counting as two, from the shapes of its data
+# inputs and outputs. Returns -1 if they depend on unknown shapes. Data movement ops count none
+def node_flops(node, inputs, outputs):
+    op = node.op
+    if op in FOLDED_OPS:
+        return 0
+    out = shape_inference._num_elements(outputs[0]) if outputs else -1
+
+    if op in ('Conv2D', 'DepthwiseConv2dNative'):
+        kernel = inputs[1] if len(inputs) > 1 else None
+        if out < 0 or kernel is None or len(kernel) != 4 or min(kernel) < 0:
+            return -1
+        per_output = kernel[0] * kernel[1] * (kernel[2] if op == 'Conv2D' else 1)
+        return 2 * out * per_output
+
+    if op == 'Conv2DBackpropInput':
+        kernel, gradient = inputs[1], shape_inference._num_elements(inputs[2])
+        if gradient < 0 or kernel is None or len(kernel) != 4 or min(kernel) < 0:
+            return -1
+        return 2 * gradient * kernel[0] * kernel[1] * kernel[2]
+
+    if op == 'MatMul':
+        shape_a = inputs[0]
+        if out < 0 or shape_a is None or len(shape_a) != 2:
+            return -1
+        depth = shape_a[0] if shape_inference._attr_b(node, 'transpose_a') else shape_a[1]
+        return -1 if depth < 0 else 2 * out * depth
+
+    if op in ('MaxPool', 'AvgPool'):
+        window = 1
+        for size in shape_inference._attr_ints(node, 'ksize'):
+            window *= size
+        return -1 if out < 0 else out * window
+
+    if op in REDUCE_OPS:
+        return shape_inference._num_elements(inputs[0]) if inputs else -1
+
+    if op.startswith('FusedBatchNorm'):
+        return -1 if out < 0 else 2 * out
+
+    if op in ELEMENTWISE_OPS:
+        if out < 0:
+            return -1
+        return out * (len(inputs) - 1) if op == 'AddN' else out
+
+    return 0
+
+
+# Static cost estimate of a graph from its GraphDef and statically inferred shapes. Properties, dictionaries that map
+# node names to numbers, with -1 where shapes are unknown:
+# flops: Floating point operations of one inference (see node_flops)
+# parameter_bytes: Bytes of the parameter Consts (weights, biases, batch norm statistics) a node reads, directly or
+#   through Identity. A Const read by several nodes counts for the first, and one read by none counts for itself
+# activation_bytes: Bytes of the output tensors of a node. Consts and forwarded tensors take none
+# graph_chars: GraphCharacteristics object
+# input_shapes: Optional dictionary that maps placeholder names to shapes
+class CostModel:
+
+    def __init__(self, graph_chars, input_shapes=None):
+        self.graph_chars = graph_chars
+        self.index = index = graph_chars.index
+        self.inference = inference = shape_inference.ShapeInference(graph_chars, input_shapes=input_shapes)
+
+        self.flops = {}
+        self.parameter_bytes = {}
+        self.activation_bytes = {}
+        claimed = set()
+        for node in index.nodes:
+            outputs = inference.shapes.get(node.name) or [None]
+            inputs = []
+            params = 0
+            for input_name in node.input:
+                parsed = shape_inference.parse_input(input_name)
+                if parsed is None:
+                    continue
+                inputs.append(inference.shape(input_name))
+                if node.op not in graph_optimizer.FORWARDED_OPS:
+                    const = self._parameter_const(parsed[0])
+                    if const is not None and const.name not in claimed:
+                        claimed.add(const.name)
+                        params += self._const_bytes(const)
+            self.flops[node.name] = node_flops(node, inputs, outputs)
+            self.parameter_bytes[node.name] = params
+            self.activation_bytes[node.name] = self._activation_bytes(node, outputs)
+
+        for node_id in index.find_by_op('Const'):
+            node = index.nodes[node_id]
+            if node.name not in claimed and model_segmentation.parameter_bytes(node):
+                self.parameter_bytes[node.name] = self._const_bytes(node)
+
+    # Returns the parameter Const a tensor is read from, looking through forwarded ops, or None
+    def _parameter_const(self, name):
+        nodes_by_name = self.graph_chars.nodes_by_name
+        while name in nodes_by_name:
+            node = nodes_by_name[name]
+            if node.op == 'Const':
+                return node if model_segmentation.parameter_bytes(node) else None
+            if node.op not in graph_optimizer.FORWARDED_OPS or not node.input:
+                return None
+            parsed = shape_inference.parse_input(node.input[0])
+            if parsed is None:
+                return None
+            name = parsed[0]
+        return None
+
+    def _const_bytes(self, node):
+        return model_segmentation.parameter_bytes(node) * _element_size(node, 0)
+
+    def _activation_bytes(self, node, outputs):
+        if node.op == 'Const' or node.op in graph_optimizer.FORWARDED_OPS:
+            return 0
+        total = 0
+        for port, shape in enumerate(outputs):
+            elements = shape_inference._num_elements(shape)
+            if elements < 0:
+                return -1
+            total += elements * _element_size(node, port)
+        return total
+
+    # Returns the largest total of live activations over a run of the graph in topological order, where a node's
+    # outputs stay live until their last consumer has run. Unknown activations count as none
+    def peak_activation_bytes(self):
+        index = self.index
+        remaining = list(index.out_degrees)
+        sizes = [max(0, self.activation_bytes[name]) for name in index.names]
+        live = peak = 0
+        for node_id in model_segmentation._topological_order(index, range(len(index))):
+            live += sizes[node_id]
+            peak = max(peak, live)
+            for input_id in index.inputs(node_id):
+                remaining[input_id] -= 1
+                if remaining[input_id] == 0:
+                    live -= sizes[input_id]
+        return peak
+
+    # Returns the totals of the graph: flops, parameter_bytes and activation_bytes over the nodes where they are known,
+    # and unknown_flops, the number of nodes whose operations could not be estimated
+    def totals(self, names=None):
+        names = self.index.names if names is None else names
+        totals = {'nodes': 0, 'flops': 0, 'parameter_bytes': 0, 'activation_bytes': 0, 'unknown_flops': 0}
+        for name in names:
+            totals['nodes'] += 1
+            flops = self.flops[name]
+            if flops < 0:
+                totals['unknown_flops'] += 1
+            else:
+                totals['flops'] += flops
+            totals['parameter_bytes'] += self.parameter_bytes[name]
+            totals['activation_bytes'] += max(0, self.activation_bytes[name])
+        return totals
+
+    # Returns a dictionary that maps namespaces, truncated to depth components, to their totals
+    def namespaces(self, depth=DEFAULT_DEPTH):
+        members = {}
+        for name in self.index.names:
+            members.setdefault(namespace(name, depth), []).append(name)
+        return {ns: self.totals(names) for ns, names in members.items()}
+
+    # Returns a dictionary that maps node names to (status, detail, cause) triples telling how backend runs them (see
+    # STATUSES): detail explains the ones it does not accelerate, and cause names what made it so, the node itself or
+    # the node or namespace it depends on
+    def coverage(self, backend):
+        if backend == 'edgetpu':
+            return self._edgetpu_coverage()
+        if backend == 'tensorrt':
+            return self._namespace_coverage(TENSORRT_OPS, "the UFF parser", self._tensorrt_namespace)
+        if backend == 'openvino':
+            return self._namespace_coverage(OPENVINO_OPS, "the Model Optimizer", self._openvino_namespace)
+        raise ValueError("Unknown backend {}".format(backend))
+
+    # Nodes the conversion folds whatever the backend: no-ops and shape arithmetic with a statically known value
+    def _folded(self, node):
+        return node.op in FOLDED_OPS or (node.name in self.inference.values and node.op != 'Placeholder')
+
+    def _tensorrt_namespace(self, name):
+        collapsed = converter_util.namespace_owner(name, tensorrt_converter.PLUGIN_NAMESPACES)
+        if collapsed is None:
+            return None
+        target = tensorrt_converter.PLUGIN_NAMESPACES[collapsed]
+        op = tensorrt_converter.PLUGIN_OPS[target]
+        if op == 'Placeholder':
+            return FOLDED, "replaced by the {} input".format(target), collapsed
+        return PLUGIN, "collapsed into the {} {} plugin".format(target, op), collapsed
+
+    def _openvino_namespace(self, name):
+        replaced = converter_util.namespace_owner(name, OPENVINO_NAMESPACES)
+        if replaced is None:
+            return None
+        layer = OPENVINO_NAMESPACES[replaced]
+        if layer is None:
+            return FOLDED, "removed by the object detection API transformations", replaced
+        return PLUGIN, "replaced by a {} layer".format(layer), replaced
+
+    # Coverage of backends that replace whole namespaces and fail on the ops they do not support
+    def _namespace_coverage(self, supported, converter, namespace_status):
+        coverage = {}
+        for node in self.index.nodes:
+            status = namespace_status(node.name)
+            if status is None:
+                if self._folded(node):
+                    status = FOLDED, "", None
+                elif node.op in supported:
+                    status = ACCELERATED, "", None
+                else:
+                    status = UNSUPPORTED, "{} does not support {}".format(converter, node.op), node.name
+            coverage[node.name] = status
+        return coverage
+
+    # The Edge TPU compiler only splits a model once: from the first op it cannot map, that op and every op after it
+    # run on the CPU
+    def _edgetpu_coverage(self):
+        index = self.index
+        fallback = [None] * len(index)
+        coverage = {}
+        for node_id in model_segmentation._topological_order(index, range(len(index))):
+            node = index.nodes[node_id]
+            after = next((fallback[input_id] for input_id in index.inputs(node_id) if fallback[input_id] is not None),
+                         None)
+            if self._folded(node):
+                status = FOLDED, "", None
+            elif node.op in TFLITE_UNSUPPORTED_OPS:
+                status = UNSUPPORTED, "the TFLite converter does not support {}".format(node.op), node.name
+            elif node.op in EDGETPU_CUSTOM_OPS:
+                status = PLUGIN, "{} custom op, run on the CPU".format(node.op), node.name
+            elif node.op not in EDGETPU_OPS:
+                after = after or node.name
+                status = CPU, "the Edge TPU does not support {}".format(node.op), after
+            elif after is not None:
+                status = CPU, "after the CPU fallback at {}".format(after), after
+            else:
+                status = ACCELERATED, "", None
+            fallback[node_id] = after
+            coverage[node.name] = status
+        return coverage
+
+
+# Returns the per-backend summary of a coverage: node counts and operations per status, and the causes of the nodes the
+# backend does not accelerate, with the nodes and operations of each, most expensive first
+def coverage_summary(model, coverage):
+    counts = dict.fromkeys(STATUSES, 0)
+    flops = dict.fromkeys(STATUSES, 0)
+    causes = {}
+    for name, (status, detail, cause) in coverage.items():
+        counts[status] += 1
+        flops[status] += max(0, model.flops[name])
+        if status in (ACCELERATED, FOLDED):
+            continue
+        entry = causes.get(cause)
+        if entry is None:
+            entry = causes[cause] = {'cause': cause, 'status': status, 'detail': detail, 'nodes': 0, 'flops': 0,
+                                     'parameter_bytes': 0}
+        entry['nodes'] += 1
+        entry['flops'] += max(0, model.flops[name])
+        entry['parameter_bytes'] += model.parameter_bytes[name]
+        if name == cause:
+            entry['detail'] = detail
+    return {'nodes': counts, 'flops': flops,
+            'causes': sorted(causes.values(), key=lambda entry: (-entry['flops'], -entry['nodes']))}
+
+
+# Returns the report of a CostModel as a JSON-serializable dictionary: the graph totals, the namespaces and nodes ranked
+# by operations, the coverage summary of each of backends, and the costs of the nodes with any, or that a backend does
+# not accelerate, with the status, detail and cause of each such backend under 'coverage'
+def build_report(model, backends, depth=DEFAULT_DEPTH, top=DEFAULT_TOP):
+    namespaces = [dict(totals, namespace=ns) for ns, totals in model.namespaces(depth).items()]
+    namespaces.sort(key=lambda entry: (-entry['flops'], -entry['parameter_bytes']))
+
+    coverages = {backend: model.coverage(backend) for backend in backends}
+    nodes = []
+    for name in model.index.names:
+        flagged = {backend: {'status': status, 'detail': detail, 'cause': cause}
+                   for backend, (status, detail, cause) in ((backend, coverage[name])
+                                                            for backend, coverage in coverages.items())
+                   if status not in (ACCELERATED, FOLDED)}
+        if flagged or model.flops[name] or model.parameter_bytes[name] or model.activation_bytes[name]:
+            entry = {'node': name, 'op': model.graph_chars.nodes_by_name[name].op, 'namespace': namespace(name, depth),
+                     'flops': model.flops[name], 'parameter_bytes': model.parameter_bytes[name],
+                     'activation_bytes': model.activation_bytes[name]}
+            if flagged:
+                entry['coverage'] = flagged
+            nodes.append(entry)
+    nodes.sort(key=lambda entry: (-entry['flops'], -entry['parameter_bytes']))
+
+    totals = model.totals()
+    totals['peak_activation_bytes'] = model.peak_activation_bytes()
+    return {'totals': totals, 'namespaces': namespaces, 'hot_spots': nodes[:top], 'nodes': nodes,
+            'backends': {backend: coverage_summary(model, coverage) for backend, coverage in coverages.items()}}
+
+
+def format_flops(flops):
+    if flops < 0:
+        return "?"
+    for scale, unit in ((1e12, "T"), (1e9, "G"), (1e6, "M"), (1e3, "K")):
+        if flops >= scale:
+            return "{:.2f} {}FLOPs".format(flops / scale, unit)
+    return "{} FLOPs".format(flops)
+
+
+def format_bytes(size):
+    if size < 0:
+        return "?"
+    for scale, unit in ((2 ** 30, "GiB"), (2 ** 20, "MiB"), (2 ** 10, "KiB")):
+        if size >= scale:
+            return "{:.2f} {}".format(size / scale, unit)
+    return "{} B".format(size)
+
+
+def _share(part, total):
+    return "{:.1%}".format(part / total) if total else "-"
+
+
+# Returns the text form of a report, listing the top entries of each ranking
+def report_text(report, top=DEFAULT_TOP):
+    totals = report['totals']
+    lines = ["{} nodes: {}, {} of parameters, {} of activations, {} at peak".format(
+        totals['nodes'], format_flops(totals['flops']), format_bytes(totals['parameter_bytes']),
+        format_bytes(totals['activation_bytes']), format_bytes(totals['peak_activation_bytes']))]
+    if totals['unknown_flops']:
+        lines.append("Operations of {} nodes could not be estimated; pass --input_dims if the input shape is not fixed"
+                     .format(totals['unknown_flops']))
+
+    lines += ["", "Namespaces by operations:"]
+    for entry in report['namespaces'][:top]:
+        lines.append("  {:>14} {:>7} {:>11} params {:>11} act  {} ({} nodes)".format(
+            format_flops(entry['flops']), _share(entry['flops'], totals['flops']),
+            format_bytes(entry['parameter_bytes']), format_bytes(entry['activation_bytes']),
+            entry['namespace'] or "(top level)", entry['nodes']))
+
+    lines += ["", "Nodes by operations:"]
+    for entry in report['hot_spots'][:top]:
+        lines.append("  {:>14} {:>7} {:>11} params {:>11} act  {} ({})".format(
+            format_flops(entry['flops']), _share(max(0, entry['flops']), totals['flops']),
+            format_bytes(entry['parameter_bytes']), format_bytes(entry['activation_bytes']), entry['node'],
+            entry['op']))
+
+    for backend, summary in report['backends'].items():
+        counts, flops = summary['nodes'], summary['flops']
+        lines += ["", "{}: {} of operations accelerated; {}".format(
+            backend, _share(flops[ACCELERATED], totals['flops']),
+            ", ".join("{} {}".format(counts[status], status) for status in STATUSES))]
+        for entry in summary['causes'][:top]:
+            lines.append("  {:<11} {:>14} {:>6} nodes  {}: {}".format(entry['status'], format_flops(entry['flops']),
+                                                                      entry['nodes'], entry['cause'], entry['detail']))
+        if len(summary['causes']) > top:
+            lines.append("  ... {} more".format(len(summary['causes']) - top))
+    return "\n".join(lines)
+
+
+# Returns graph_visualizer annotations of the nodes' costs
+def cost_annotations(report):
+    return {entry['node']: {'flops': max(0, entry['flops']), 'parameter_bytes': entry['parameter_bytes'],
+                            'activation_bytes': max(0, entry['activation_bytes'])}
+            for entry in report['nodes']}
+
+
+def setup_args(parser):
+    parser.add_argument("--input", "-i", help="Path to input file", required=True, type=str)
+    parser.add_argument("--input_dims", "-id", help="Dimensions of input tensor. Defaults to the input node's shape, "
+                                                    "with unknown dimensions inferred where possible", type=int,
+                        nargs='+')
+    parser.add_argument("--backends", help="Backends to report the coverage of", nargs='+',
+                        choices=list(backend_registry.BACKENDS), default=list(backend_registry.BACKENDS))
+    parser.add_argument("--depth", help="Namespace depth of the per-namespace totals", type=int, default=DEFAULT_DEPTH)
+    parser.add_argument("--top", help="Number of entries listed in each ranking", type=int, default=DEFAULT_TOP)
+    parser.add_argument("--json", help="Write the full report to this JSON file")
+    parser.add_argument("--annotations", help="Write the per-node costs to this JSON file, for graph_visualizer.py "
+                                              "--annotations")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    setup_args(parser)
+    args = parser.parse_args()
+
+    model = model_loader.load_model(args.input, structure_only=True)
+    graph_chars = model.graph_chars
+
+    input_shapes = None
+    if graph_chars.input_nodes:
+        input_node = graph_chars.input_nodes[0]
+        input_dims = args.input_dims
+        if input_dims is None:
+            node_dims = shape_inference.shape_from_proto(input_node.attr['shape'].shape)
+            input_dims = node_dims
+            if node_dims is not None and -1 in node_dims:
+                input_dims = shape_inference.infer_input_dims(graph_chars, input_node, node_dims) or node_dims
+        if input_dims is not None:
+            input_shapes = {input_node.name: list(input_dims)}
+
+    cost_model = CostModel(graph_chars, input_shapes=input_shapes)
+    report = build_report(cost_model, args.backends, depth=args.depth, top=args.top)
+    print(report_text(report, top=args.top))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.annotations:
+        with open(args.annotations, "w") as f:
+            json.dump(cost_annotations(report), f)
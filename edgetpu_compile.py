@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+
+# Operator table rows of the compiler report: operator, count and status
+_OPERATOR_ROW = re.compile(r'^(\w+)\s+(\d+)\s+(\S.*?)\s*$')
+
+# Summary lines of the compiler report, and the report fields they fill
+_SUMMARY_LINES = [
+    (re.compile(r'Model compiled successfully in (\d+) ms'), 'compile_ms', int),
+    (re.compile(r'Number of Edge TPU subgraphs: (\d+)'), 'subgraphs', int),
+    (re.compile(r'Total number of operations: (\d+)'), 'total_operations', int),
+    (re.compile(r'On-chip memory used for caching model parameters: (\S+)'), 'on_chip_memory', None),
+    (re.compile(r'On-chip memory remaining for caching model parameters: (\S+)'), 'on_chip_memory_remaining', None),
+    (re.compile(r'Off-chip memory used for streaming uncached model parameters: (\S+)'), 'off_chip_memory', None),
+]
+
+_SIZE_UNITS = {'B': 1, 'KiB': 2 ** 10, 'MiB': 2 ** 20, 'GiB': 2 ** 30}
+
+# Status of operators the compiler maps to the Edge TPU
+MAPPED_STATUS = "Mapped to Edge TPU"
+
+
+def add_compile_args(parser):
+    parser.add_argument("--compile_jobs", help="Maximum number of concurrent edgetpu_compiler processes", type=int,
+                        default=os.cpu_count() or 1)
+    parser.add_argument("--compile_timeout", help="Time limit of each edgetpu_compiler run, in seconds", type=float,
+                        default=600)
+
+
+# Converts a compiler memory size such as "3.75MiB" to bytes, or returns None if it is not one
+def parse_size(size):
+    match = re.match(r'^([\d.]+)(B|KiB|MiB|GiB)$', size)
+    if match is None:
+        return None
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+# Parses the report edgetpu_compiler prints with --show_operations. Returns a dictionary of the summary fields found
+# (compile_ms, subgraphs, total_operations, and the on-chip, remaining and off-chip memory in bytes), operations: a list
+# of {operator, count, status, mapped} dictionaries, one per row of the operator table, and the total counts of
+# tpu_operations and cpu_operations
+def parse_report(log):
+    report = {'operations': []}
+    in_table = False
+    for line in log.splitlines():
+        line = line.strip()
+        for pattern, field, convert in _SUMMARY_LINES:
+            match = pattern.search(line)
+            if match:
+                report[field] = convert(match.group(1)) if convert else parse_size(match.group(1))
+        if line.startswith("Operator") and "Status" in line:
+            in_table = True
+            continue
+        if in_table and line:
+            match = _OPERATOR_ROW.match(line)
+            if match is None:
+                in_table = False
+                continue
+            status = match.group(3)
+            report['operations'].append({'operator': match.group(1), 'count': int(match.group(2)), 'status': status,
+                                         'mapped': status.startswith(MAPPED_STATUS)})
+    report['tpu_operations'] = sum(op['count'] for op in report['operations'] if op['mapped'])
+    report['cpu_operations'] = sum(op['count'] for op in report['operations'] if not op['mapped'])
+    return report
+
+
+# A model to compile
+# model_path: Path of the .tflite model
+# output_dir: Directory the compiled model and its log are written to
+# timeout: Time limit in seconds, or None
+class CompileJob:
+
+    def __init__(self, model_path, output_dir, timeout=None):
+        self.model_path = model_path
+        self.output_dir = output_dir
+        self.timeout = timeout
+
+    # Path of the compiled model; the compiler appends _edgetpu to the input name
+    @property
+    def compiled_path(self):
+        base = os.path.splitext(os.path.basename(self.model_path))[0]
+        return os.path.join(self.output_dir, base + "_edgetpu.tflite")
+
+
+# Outcome of one compilation
+# job: The CompileJob
+# status: One of "ok", "error" or "timeout"
+# returncode: Exit status of the compiler, or None if it did not finish
+# stdout, stderr: Captured compiler output
+# elapsed: Wall time in seconds
+# report: Parsed compiler report (see parse_report)
+class CompileResult:
+
+    def __init__(self, job, status, returncode, stdout, stderr, elapsed):
+        self.job = job
+        self.status = status
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.elapsed = elapsed
+        self.report = parse_report(stdout)
+
+    def to_json(self):
+        return {'model': self.job.model_path, 'compiled': self.job.compiled_path, 'status': self.status,
+                'returncode': self.returncode, 'elapsed': self.elapsed, 'report': self.report,
+                'stdout': self.stdout, 'stderr': self.stderr}
+
+
+async def _compile(job, semaphore, compiler, extra_args):
+    async with semaphore:
+        os.makedirs(job.output_dir, exist_ok=True)
+        start = time.monotonic()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                compiler, "--show_operations", "--out_dir", job.output_dir, *(list(extra_args) + [job.model_path]),
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        except OSError as e:
+            return CompileResult(job, "error", None, "", "Cannot run {}: {}".format(compiler, e), 0.0)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), job.timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            stdout, stderr = await process.communicate()
+            status = "timeout"
+        else:
+            status = "ok" if process.returncode == 0 else "error"
+        return CompileResult(job, status, process.returncode if status != "timeout" else None,
+                             stdout.decode(errors='replace'), stderr.decode(errors='replace'),
+                             time.monotonic() - start)
+
+
+async def _compile_all(jobs, max_concurrency, compiler, extra_args):
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    return await asyncio.gather(*[_compile(job, semaphore, compiler, extra_args) for job in jobs])
+
+
+# Compiles the CompileJobs with edgetpu_compiler, running at most max_concurrency compilers at a time, and returns
+# their CompileResults in job order. compiler is the compiler executable, looked up on PATH, and extra_args are passed
+# to every run
+def compile_models(jobs, max_concurrency=1, compiler="edgetpu_compiler", extra_args=()):
+    loop = asyncio.new_event_loop()
+    try:
+        # Child process watchers attach to the current event loop
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(_compile_all(jobs, max_concurrency, compiler, extra_args))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+# Returns a one-line summary of a CompileResult
+def result_message(result):
+    report = result.report
+    if result.status != "ok":
+        return "{}: {} (status {})".format(result.job.model_path, result.status, result.returncode)
+    return "{}: compiled to {}, {} operations on the Edge TPU, {} on the CPU, {} subgraph(s)".format(
+        result.job.model_path, result.job.compiled_path, report['tpu_operations'], report['cpu_operations'],
+        report.get('subgraphs', '?'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("models", help="Paths of the .tflite models to compile", nargs='+')
+    parser.add_argument("--output_dir", "-o", help="Directory of the compiled models. Defaults to the directory of "
+                                                   "each model")
+    parser.add_argument("--json", help="Write the results, with the parsed compiler reports, to this JSON file")
+    add_compile_args(parser)
+    args = parser.parse_args()
+
+    jobs = [CompileJob(path, args.output_dir or os.path.dirname(path) or '.', timeout=args.compile_timeout)
+            for path in args.models]
+    results = compile_models(jobs, max_concurrency=args.compile_jobs)
+    for result in results:
+        print(result_message(result))
+        if result.status != "ok":
+            print(result.stdout + result.stderr)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([result.to_json() for result in results], f, indent=2)
+    exit(0 if all(result.status == "ok" for result in results) else 1)
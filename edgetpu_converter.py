@@ -1,8 +1,15 @@
 import argparse
-import tensorflow as tf
-import subprocess
+import json
+import os
 
+import calibration_data
 import converter_util
+import edgetpu_compile
+import model_loader
+import model_segmentation
+import stage_trace
+import structure_cache
+import tflite_inspector
 
 
 def setup_args(parser):
@@ -16,31 +23,139 @@ def add_edgetpu_args(parser):
                         default=[128], type=int, nargs='+')
     parser.add_argument("--q_std", help="STD of training data for quantization (if model is quantized)",
                         default=[128], type=int, nargs='+')
+    calibration_data.add_calibration_args(parser)
+    edgetpu_compile.add_compile_args(parser)
+    model_segmentation.add_segment_args(parser)
+    tflite_inspector.add_inspect_args(parser)
 
 
 # Accepts a tensorflow frozen graph and produces a edgetpu-compiled graph, as well as an intermediate tflite flatbuffer
 # Arguments:
 # args: program arguments
 # graph_chars: GraphCharacteristics object
-def convert_to_edgetpu(args, input_dims, graph_chars=None):
+# model: LoadedModel of args.input, if it has already been loaded
+def convert_to_edgetpu(args, input_dims, graph_chars=None, model=None):
+    import tensorflow as tf
 
     if len(args.q_mean) != len(args.q_std):
-        print("Error: Number of q_mean arguments ({}) not equal to number of q_std arguments ({})"
-              .format(len(args.q_mean), len(args.q_std)))
+        stage_trace.event("error", "Error: Number of q_mean arguments ({}) not equal to number of q_std arguments ({})"
+                          .format(len(args.q_mean), len(args.q_std)))
         return
 
-    if graph_chars is None:
-        with tf.compat.v1.gfile.GFile(args.input, "rb") as f:
-            graph_def = tf.compat.v1.GraphDef()
-            graph_def.ParseFromString(f.read())
+    if model is None:
+        model = model_loader.load_model(args.input)
 
-        graph_chars = converter_util.GraphCharacteristics(graph_def)
+    if graph_chars is None:
+        graph_chars = model.graph_chars
 
     if len(graph_chars.input_nodes) != len(args.q_mean):
-        print("Error: Number of input nodes ({}) not equal to number of quantization parameters ({})"
-              .format(len(graph_chars.input_nodes), len(args.q_mean)))
+        stage_trace.event("error", "Error: Number of input nodes ({}) not equal to number of quantization parameters "
+                          "({})".format(len(graph_chars.input_nodes), len(args.q_mean)))
+        return
+
+    # Graphs with the structure of an earlier conversion reuse its output analysis
+    outputs = structure_cache.cached(structure_cache.from_args(args), model, "edgetpu/outputs",
+                                     lambda: analyze_outputs(graph_chars))
+    output_nodes, quantized = outputs['output_nodes'], outputs['quantized']
+
+    stage_trace.event("output_names", "Corrected output names: {}".format(output_nodes), names=output_nodes)
+
+    if quantized:
+        stage_trace.event("quantization", "Quantization detected. Using quantized conversion with means and STDs "
+                          "({}, {})".format(args.q_mean, args.q_std), q_mean=args.q_mean, q_std=args.q_std)
+
+    q_stats = None
+    dataset = None
+    if quantized:
+        q_stats = {}
+        for idx, node in enumerate(graph_chars.input_node_names):
+            q_stats.update({node: (args.q_mean[idx], args.q_std[idx])})
+    elif args.calibration_dir is not None:
+        # Full integer post-training quantization, calibrated on a stream of sample images
+        try:
+            dataset = calibration_data.representative_dataset(args, graph_chars.input_nodes[0], input_dims)
+        except (OSError, ValueError) as e:
+            stage_trace.event("error", "Error: Cannot calibrate with {}: {}".format(args.calibration_dir, e))
+            return
+        stage_trace.event("quantization", "Float model. Quantizing to int8 with calibration samples from {}"
+                          .format(args.calibration_dir), calibration_dir=args.calibration_dir)
+
+    # Plan the segments first, so that a model that cannot be split fails before any conversion
+    segments = None
+    if args.num_segments != 1:
+        input_shapes = {graph_chars.input_node_names[0]: list(input_dims)}
+        try:
+            with stage_trace.stage("edgetpu/plan_segments"):
+                segments = model_segmentation.plan_segments(
+                    graph_chars, model_segmentation.output_tensor_names(output_nodes), args.num_segments,
+                    input_shapes=input_shapes, segment_memory=args.segment_memory, require_ranges=quantized)
+        except ValueError as e:
+            stage_trace.event("error", "Error: Cannot split the model: {}".format(e))
+            return
+
+    # Convert and save model. The converter is handed the already-parsed graph, rather than the path
+    # from_frozen_graph would read and parse again
+    input_arrays_with_shape = [(graph_chars.input_node_names[0], input_dims)]
+    converter = _tflite_converter(tf, model.graph_def, input_arrays_with_shape, output_nodes, q_stats, dataset)
+
+    calibrated = dataset is not None
+    with stage_trace.stage("edgetpu/tflite_convert", quantized=quantized, calibrated=calibrated):
+        tflite_model = converter.convert()
+    open(args.output_dir + ".tflite", "wb").write(tflite_model)
+    stage_trace.event("tflite_converted", "Model successfully converted to tflite flatbuffer",
+                      size=len(tflite_model))
+
+    segment_paths = []
+    if segments is not None:
+        segment_paths = convert_segments(tf, args, model, graph_chars, segments, q_stats, dataset)
+
+    # Shrink the flatbuffers in place and record what they contain before compiling them
+    try:
+        tflite_inspector.check_flatbuffer(args, args.output_dir + ".tflite",
+                                          report_path=args.output_dir + "_tflite_report.json")
+        for path in segment_paths:
+            tflite_inspector.check_flatbuffer(args, path)
+    except ValueError as e:
+        stage_trace.event("error", "Error: Invalid tflite flatbuffer: {}".format(e))
         return
 
+    # Compile the flatbuffers for edge TPU, next to them. The segments are compiled in parallel
+    output_dir = os.path.dirname(args.output_dir) or '.'
+    jobs = [edgetpu_compile.CompileJob(path, output_dir, timeout=args.compile_timeout)
+            for path in [args.output_dir + ".tflite"] + segment_paths]
+    with stage_trace.stage("edgetpu/compile", models=len(jobs)):
+        results = edgetpu_compile.compile_models(jobs, max_concurrency=args.compile_jobs)
+    for result in results:
+        if result.status != "ok":
+            stage_trace.event("error", "Error: edgetpu_compiler {} on {} (status {}):\n{}{}".format(
+                result.status, result.job.model_path, result.returncode, result.stdout, result.stderr),
+                status=result.returncode)
+            exit(1)
+    result = results[0]
+    with open(args.output_dir + "_edgetpu_report.json", "w") as f:
+        json.dump(result.report, f, indent=2)
+    stage_trace.event("edgetpu_compiled", "Model successfully compiled: {} operations on the Edge TPU, {} on the CPU"
+                      .format(result.report['tpu_operations'], result.report['cpu_operations']),
+                      tpu_operations=result.report['tpu_operations'], cpu_operations=result.report['cpu_operations'],
+                      subgraphs=result.report.get('subgraphs'), on_chip_memory=result.report.get('on_chip_memory'),
+                      off_chip_memory=result.report.get('off_chip_memory'))
+
+    if segments is not None:
+        manifest = model_segmentation.write_manifest(
+            args.output_dir + "_segments.json", segments, model_segmentation.output_tensor_names(output_nodes),
+            [os.path.basename(path) for path in segment_paths],
+            [os.path.basename(result.job.compiled_path) for result in results[1:]],
+            reports=[result.report for result in results[1:]])
+        for entry in manifest['segments']:
+            stage_trace.event("segment", model_segmentation.segment_message(entry), segment=entry['index'],
+                              parameter_bytes=entry['parameter_bytes'],
+                              on_chip_memory=entry['compile_report'].get('on_chip_memory'),
+                              off_chip_memory=entry['compile_report'].get('off_chip_memory'))
+
+
+# Returns the output tensors the TFLite converter is given, and whether the graph comes from quantization-aware
+# training (its outputs are quantized), as a dictionary with the keys output_nodes and quantized
+def analyze_outputs(graph_chars):
     output_nodes = []
 
     # Correct for multiple output dimensions.
@@ -51,42 +166,91 @@ def convert_to_edgetpu(args, input_dims, graph_chars=None):
         for node in graph_chars.output_nodes:
             num_out = len(node.attr['_output_types'].list.type)
             if num_out > 0:
-                print("Node {} has {} output dimensions".format(node.name, num_out))
+                stage_trace.event("output_dimensions", "Node {} has {} output dimensions".format(node.name, num_out),
+                                  node=node.name, outputs=num_out)
                 output_nodes = [node.name + ':' + str(i) for i in range(num_out)]
             output_nodes[0] = node.name
     else:
-        output_nodes = graph_chars.output_nodes
-
-    print("Corrected output names: ", output_nodes)
+        output_nodes = list(graph_chars.output_node_names)
 
     # Check for quantization
-    quantized = False
-    for node in output_nodes:
-        if graph_chars.nodes_by_name[node.split(':')[0]].attr['_output_quantized'].b:
-            print("Quantization detected. Using quantized conversion with means and STDs ({}, {})"
-                  .format(args.q_mean, args.q_std))
-            quantized = True
-            break
-
-    # Convert and save model
-    converter = tf.lite.TFLiteConverter.from_frozen_graph(args.input, graph_chars.input_node_names, output_nodes,
-                                                          input_shapes={graph_chars.input_node_names[0]: input_dims})
+    quantized = any(graph_chars.nodes_by_name[node.split(':')[0]].attr['_output_quantized'].b for node in output_nodes)
+    return {'output_nodes': output_nodes, 'quantized': quantized}
+
+
+# Returns a TFLiteConverter for graph_def: quantized with the input statistics q_stats if given, or else calibrated with
+# the representative dataset if given, or else in float
+def _tflite_converter(tf, graph_def, input_arrays_with_shape, output_arrays, q_stats=None, dataset=None):
+    converter = tf.compat.v1.lite.TFLiteConverter(graph_def, None, None,
+                                                  input_arrays_with_shape=input_arrays_with_shape,
+                                                  output_arrays=output_arrays)
     converter.allow_custom_ops = True
-    if quantized:
+    if q_stats is not None:
         converter.inference_type = tf.compat.v1.lite.constants.QUANTIZED_UINT8  # TODO: Fix assumption that quantization is 8-bit
         converter.inference_input_type = tf.compat.v1.lite.constants.QUANTIZED_UINT8
-        q_stats = {}
-        for idx, node in enumerate(graph_chars.input_node_names):
-            q_stats.update({node: (args.q_mean[idx], args.q_std[idx])})
         converter.quantized_input_stats = q_stats
+    elif dataset is not None:
+        converter.optimizations = [tf.compat.v1.lite.Optimize.DEFAULT]
+        converter.representative_dataset = tf.compat.v1.lite.RepresentativeDataset(dataset)
+        converter.target_spec.supported_ops = [tf.compat.v1.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+        converter.inference_output_type = tf.uint8
+    return converter
 
-    tflite_model = converter.convert()
-    open(args.output_dir + ".tflite", "wb").write(tflite_model)
-    print("Model successfully converted to tflite flatbuffer")
 
-    # Compile the flatbuffer for edge TPU
-    subprocess.run(["edgetpu_compiler", args.output_dir + ".tflite"], check=True)
-    print("Model successfully compiled")
+# Returns a representative dataset of the given tensors, computed by running the float graph on the samples of dataset.
+# It calibrates a segment on the activations the segments before it produce
+def _activation_dataset(tf, graph_def, input_name, dataset, tensors):
+    def generator():
+        graph = tf.Graph()
+        with graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        feed = graph.get_tensor_by_name(input_name + ':0')
+        fetches = [graph.get_tensor_by_name(tensor if ':' in tensor else tensor + ':0') for tensor in tensors]
+        with tf.compat.v1.Session(graph=graph) as session:
+            for sample in dataset():
+                yield session.run(fetches, {feed: sample[0]})
+    return generator
+
+
+# Converts each of the planned segments to a tflite flatbuffer, quantized like the whole model: quantized models take
+# the FakeQuant ranges of their interface tensors as input statistics, and calibrated ones are calibrated on
+# activations. Returns the paths of the flatbuffers, <output_dir>_segment_<index>.tflite
+def convert_segments(tf, args, model, graph_chars, segments, q_stats, dataset):
+    paths = []
+    for segment in segments:
+        segment_def = model_segmentation.segment_graph_def(model.graph_def, graph_chars, segment)
+        input_arrays_with_shape = [(spec['placeholder'], spec['shape']) for spec in segment.inputs]
+
+        segment_stats = None
+        if q_stats is not None:
+            segment_stats = {}
+            for spec in segment.inputs:
+                stats = q_stats.get(spec['tensor'])
+                if stats is None:
+                    stats = model_segmentation.quantization_stats(graph_chars, spec['tensor'])
+                segment_stats[spec['placeholder']] = stats
+        segment_dataset = None
+        if dataset is not None:
+            segment_dataset = _activation_dataset(tf, model.graph_def, graph_chars.input_node_names[0], dataset,
+                                                  [spec['tensor'] for spec in segment.inputs])
+
+        converter = _tflite_converter(tf, segment_def, input_arrays_with_shape, segment.outputs, segment_stats,
+                                      segment_dataset)
+        with stage_trace.stage("edgetpu/tflite_convert_segment", segment=segment.index):
+            tflite_model = converter.convert()
+        path = "{}_segment_{}.tflite".format(args.output_dir, segment.index)
+        with open(path, "wb") as f:
+            f.write(tflite_model)
+        paths.append(path)
+
+    # Remove the segments of an earlier conversion into more segments
+    for index in range(len(segments), model_segmentation.MAX_SEGMENTS):
+        for suffix in (".tflite", "_edgetpu.tflite", "_edgetpu.log"):
+            path = "{}_segment_{}{}".format(args.output_dir, index, suffix)
+            if os.path.isfile(path):
+                os.remove(path)
+    return paths
 
 
 if __name__ == '__main__':
@@ -96,14 +260,12 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     # Create graph
-    with tf.compat.v1.gfile.GFile(args.input, "rb") as f:
-        graph_def = tf.compat.v1.GraphDef()
-        graph_def.ParseFromString(f.read())
+    model = model_loader.load_model(args.input)
 
     # Get graph data
-    graph_chars = converter_util.GraphCharacteristics(graph_def)
+    graph_chars = model.graph_chars
 
     # Set input dimensions
-    input_dims = converter_util.get_input_dims(args, graph_chars.input_nodes[0])  # TODO: Only supports one input tensor
+    input_dims = converter_util.get_input_dims(args, graph_chars.input_nodes[0], graph_chars=graph_chars)  # TODO: Only supports one input tensor
 
-    convert_to_edgetpu(args, input_dims, graph_chars=graph_chars)
+    convert_to_edgetpu(args, input_dims, graph_chars=graph_chars, model=model)
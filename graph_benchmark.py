@@ -0,0 +1,386 @@
+import argparse
+import contextlib
+import io
+import json
+import time
+import tracemalloc
+
+import converter_util
+import graph_proto
+
+# Resolution of the synthetic SSD models
+SSD_IMAGE_SIZE = 300
+
+# Number of stride-2 layers taking the feature extractor from SSD_IMAGE_SIZE down to 1x1 (300 -> 150 -> ... -> 1)
+SSD_DOWNSAMPLINGS = 9
+
+# Number of trailing feature maps the box predictors read (19x19, 10x10, 5x5, 3x3, 2x2, 1x1)
+SSD_FEATURE_MAPS = 6
+
+# Feature extractor channels
+SSD_CHANNELS = 32
+
+# Nodes added per feature extractor layer: weights, Conv2D, biases, BiasAdd, Relu6
+NODES_PER_LAYER = 5
+
+# Approximate number of nodes outside the feature extractor layers
+SSD_FIXED_NODES = 110
+
+
+# Minimal stand-in for a NodeDef, carrying only the fields the graph index reads
+class _SyntheticNode:
+    __slots__ = ('name', 'op', 'input')
+
+    def __init__(self, name, op, inputs):
+        self.name = name
+        self.op = op
+        self.input = inputs
+
+
+class _SyntheticGraph:
+
+    def __init__(self, nodes):
+        self.node = nodes
+
+
+# Builds a chain-shaped synthetic graph of roughly num_nodes nodes, similar in shape to an SSD feature extractor: each
+# layer consumes the previous one plus a Const weight, with occasional multi-output references and control dependencies
+def build_synthetic_graph(num_nodes):
+    nodes = [_SyntheticNode("image_tensor", "Placeholder", [])]
+    prev = "image_tensor"
+    for i in range((num_nodes - 1) // 2):
+        scope = "FeatureExtractor/layer_{}/".format(i)
+        nodes.append(_SyntheticNode(scope + "weights", "Const", []))
+        inputs = [prev, scope + "weights"]
+        if i % 25 == 0 and i > 0:
+            inputs.append(prev + ":1")
+        if i % 100 == 0 and i > 0:
+            inputs.append("^" + prev)
+        nodes.append(_SyntheticNode(scope + "op", "Conv2D" if i % 2 else "Relu6", inputs))
+        prev = scope + "op"
+    return _SyntheticGraph(nodes)
+
+
+# Builds GraphDef nodes from per-op templates, so that the attributes shared by all nodes of a kind are only
+# constructed once
+class _GraphBuilder:
+
+    def __init__(self):
+        self.graph_def = graph_proto.GraphDef()
+        self._templates = {}
+
+    def node(self, name, op, inputs=(), template=None):
+        node = self.graph_def.node.add()
+        if template is not None:
+            node.CopyFrom(self._templates[template])
+        node.name = name
+        node.op = op
+        node.input.extend(inputs)
+        return node
+
+    def template(self, key, op, attrs):
+        node = graph_proto.NodeDef(op=op)
+        for name, value in attrs.items():
+            node.attr[name].CopyFrom(value)
+        self._templates[key] = node
+
+    def const(self, name, shape, dtype=graph_proto.DT_FLOAT, values=None):
+        node = self.node(name, "Const")
+        node.attr['dtype'].type = dtype
+        tensor = node.attr['value'].tensor
+        tensor.dtype = dtype
+        for size in shape:
+            tensor.tensor_shape.dim.add(size=size)
+        if values is not None:
+            tensor.int_val.extend(values)
+        return node
+
+
+def _type_attr(dtype):
+    return graph_proto.AttrValue(type=dtype)
+
+
+def _conv_attrs(stride):
+    strides = graph_proto.AttrValue()
+    strides.list.i.extend([1, stride, stride, 1])
+    return {'T': _type_attr(graph_proto.DT_FLOAT), 'strides': strides, 'padding': graph_proto.AttrValue(s=b"SAME"),
+            'data_format': graph_proto.AttrValue(s=b"NHWC")}
+
+
+# Builds a synthetic frozen SSD detection graph of roughly num_nodes nodes, laid out like the graphs exported by the
+# object detection API: a Preprocessor that resizes the image, a FeatureExtractor chain of Conv2D/BiasAdd/Relu6 layers
+# whose length scales with num_nodes, one BoxPredictor per feature map, a MultipleGridAnchorGenerator and a
+# Postprocessor ending in non-max suppression. Only needs protobuf. Returns the GraphDef
+def build_ssd_graph(num_nodes, num_classes=91):
+    builder = _GraphBuilder()
+    builder.template('conv', "Conv2D", _conv_attrs(1))
+    builder.template('conv_stride', "Conv2D", _conv_attrs(2))
+    builder.template('float', "BiasAdd", {'T': _type_attr(graph_proto.DT_FLOAT)})
+
+    # Preprocessor
+    image = builder.node("image_tensor", "Placeholder")
+    image.attr['dtype'].type = graph_proto.DT_UINT8
+    for size in (-1, -1, -1, 3):
+        image.attr['shape'].shape.dim.add(size=size)
+    builder.node("Preprocessor/ToFloat", "Cast", ["image_tensor"], template='float')
+    builder.const("Preprocessor/ResizeImage/size", [2], graph_proto.DT_INT32, [SSD_IMAGE_SIZE, SSD_IMAGE_SIZE])
+    builder.node("Preprocessor/ResizeImage/ResizeBilinear", "ResizeBilinear",
+                 ["Preprocessor/ToFloat", "Preprocessor/ResizeImage/size"], template='float')
+    builder.const("Preprocessor/mul/x", [])
+    builder.node("Preprocessor/mul", "Mul", ["Preprocessor/mul/x", "Preprocessor/ResizeImage/ResizeBilinear"],
+                 template='float')
+    builder.const("Preprocessor/sub/y", [])
+    builder.node("Preprocessor/sub", "Sub", ["Preprocessor/mul", "Preprocessor/sub/y"], template='float')
+
+    # FeatureExtractor: the layers are split into SSD_DOWNSAMPLINGS + 1 stages, each after the first starting with a
+    # stride-2 convolution. The last layers of the final SSD_FEATURE_MAPS stages are the feature maps
+    num_stages = SSD_DOWNSAMPLINGS + 1
+    num_layers = max(num_stages, (num_nodes - SSD_FIXED_NODES) // NODES_PER_LAYER)
+    stage_ends = [(stage + 1) * num_layers // num_stages for stage in range(num_stages)]
+    feature_maps = []
+    prev = "Preprocessor/sub"
+    size = SSD_IMAGE_SIZE
+    stage = 0
+    for layer in range(num_layers):
+        strided = stage > 0 and layer == stage_ends[stage - 1]
+        if strided:
+            size = (size + 1) // 2
+        scope = "FeatureExtractor/MobilenetV2/layer_{}/".format(layer)
+        builder.const(scope + "weights", [1, 1, SSD_CHANNELS, SSD_CHANNELS])
+        builder.node(scope + "Conv2D", "Conv2D", [prev, scope + "weights"],
+                     template='conv_stride' if strided else 'conv')
+        builder.const(scope + "biases", [SSD_CHANNELS])
+        builder.node(scope + "BiasAdd", "BiasAdd", [scope + "Conv2D", scope + "biases"], template='float')
+        builder.node(scope + "Relu6", "Relu6", [scope + "BiasAdd"], template='float')
+        prev = scope + "Relu6"
+        if layer + 1 == stage_ends[stage]:
+            if stage >= num_stages - SSD_FEATURE_MAPS:
+                feature_maps.append((prev, size))
+            stage += 1
+
+    # BoxPredictors and anchors
+    box_encodings = []
+    class_predictions = []
+    anchors = []
+    for idx, (feature_map, size) in enumerate(feature_maps):
+        num_anchors = 3 if idx == 0 else 6
+        scope = "BoxPredictor_{}/".format(idx)
+        for predictor, reshape, depth in [("BoxEncodingPredictor", "Reshape", 4),
+                                          ("ClassPredictor", "Reshape_1", num_classes)]:
+            builder.const(scope + predictor + "/weights", [1, 1, SSD_CHANNELS, num_anchors * depth])
+            builder.node(scope + predictor + "/Conv2D", "Conv2D", [feature_map, scope + predictor + "/weights"],
+                         template='conv')
+            builder.const(scope + predictor + "/biases", [num_anchors * depth])
+            builder.node(scope + predictor + "/BiasAdd", "BiasAdd",
+                         [scope + predictor + "/Conv2D", scope + predictor + "/biases"], template='float')
+            shape = [1, -1, 1, 4] if depth == 4 else [1, -1, num_classes]
+            builder.const(scope + reshape + "/shape", [len(shape)], graph_proto.DT_INT32, shape)
+            builder.node(scope + reshape, "Reshape", [scope + predictor + "/BiasAdd", scope + reshape + "/shape"],
+                         template='float')
+        box_encodings.append(scope + "Reshape")
+        class_predictions.append(scope + "Reshape_1")
+
+        anchor_scope = "MultipleGridAnchorGenerator/GridAnchor{}/".format("_{}".format(idx) if idx else "")
+        builder.const(anchor_scope + "anchors", [size * size * num_anchors, 4])
+        anchors.append(anchor_scope + "anchors")
+
+    builder.const("MultipleGridAnchorGenerator/Concatenate/axis", [], graph_proto.DT_INT32, [0])
+    builder.node("MultipleGridAnchorGenerator/Concatenate/concat", "ConcatV2",
+                 anchors + ["MultipleGridAnchorGenerator/Concatenate/axis"], template='float')
+    for name, predictions in [("concat", box_encodings), ("concat_1", class_predictions)]:
+        builder.const(name + "/axis", [], graph_proto.DT_INT32, [1])
+        builder.node(name, "ConcatV2", predictions + [name + "/axis"], template='float')
+
+    # Postprocessor
+    squeeze = builder.node("Postprocessor/Squeeze", "Squeeze", ["concat"], template='float')
+    squeeze.attr['squeeze_dims'].list.i.append(2)
+    builder.node("Postprocessor/Decode/add", "AddV2",
+                 ["Postprocessor/Squeeze", "MultipleGridAnchorGenerator/Concatenate/concat"], template='float')
+    builder.const("Postprocessor/ExpandDims/dim", [], graph_proto.DT_INT32, [2])
+    builder.node("Postprocessor/ExpandDims", "ExpandDims",
+                 ["Postprocessor/Decode/add", "Postprocessor/ExpandDims/dim"], template='float')
+    builder.const("Postprocessor/scale_logits/y", [])
+    builder.node("Postprocessor/scale_logits", "RealDiv", ["concat_1", "Postprocessor/scale_logits/y"],
+                 template='float')
+    builder.node("Postprocessor/convert_scores", "Sigmoid", ["Postprocessor/scale_logits"], template='float')
+    nms_scope = "Postprocessor/BatchMultiClassNonMaxSuppression/"
+    nms_inputs = ["Postprocessor/ExpandDims", "Postprocessor/convert_scores"]
+    for name in ("max_output_size_per_class", "max_total_size", "iou_threshold", "score_threshold"):
+        builder.const(nms_scope + name, [], graph_proto.DT_INT32, [100])
+        nms_inputs.append(nms_scope + name)
+    builder.node(nms_scope + "CombinedNonMaxSuppression", "CombinedNonMaxSuppression", nms_inputs)
+    for port, output in enumerate(["detection_boxes", "detection_scores", "detection_classes", "num_detections"]):
+        builder.node(output, "Identity", [nms_scope + "CombinedNonMaxSuppression" + (":{}".format(port) if port else "")],
+                     template='float')
+
+    return builder.graph_def
+
+
+# The dict/list index GraphCharacteristics used to build, kept for comparison
+def _legacy_index(graph_def):
+    nodes_by_name = {}
+    node_outputs_by_name = {}
+
+    for node in graph_def.node:
+        nodes_by_name[node.name] = node
+        node_outputs_by_name[node.name] = []
+
+    for node in graph_def.node:
+        for input_node_name in node.input:
+            input_node_proper = input_node_name.split(':')[0].lstrip('^')
+            node_outputs_by_name[input_node_proper].append(node)
+
+    output_node_names = [node for node in node_outputs_by_name.keys() if node_outputs_by_name[node] == []]
+    return nodes_by_name, node_outputs_by_name, output_node_names
+
+
+# Builds the GraphIndex along with the input and output lookups GraphCharacteristics performs on top of it. The forward
+# edges, which GraphIndex only builds on first use, are built too, since the legacy index builds its consumer lists
+# and the converters end up walking them
+def _graph_index(graph_def):
+    index = converter_util.GraphIndex(graph_def)
+    index.output_ids
+    input_ids = index.find_by_op('Placeholder')
+    output_ids = index.sink_ids()
+    return index, input_ids, output_ids
+
+
+# Returns the best wall time over repeats and the peak traced memory of a single call of fn. If setup is given, fn is
+# called with a fresh setup() result each time, and setup is neither timed nor traced
+def measure(fn, repeats, setup=None):
+    args = lambda: () if setup is None else (setup(),)
+
+    best = float('inf')
+    for _ in range(repeats):
+        fn_args = args()
+        start = time.perf_counter()
+        result = fn(*fn_args)
+        best = min(best, time.perf_counter() - start)
+        del result
+
+    fn_args = args()
+    tracemalloc.start()
+    result = fn(*fn_args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return best, peak
+
+
+def benchmark_index(sizes, repeats):
+    print("{:>10} {:>12} {:>12} {:>14} {:>14}".format("nodes", "legacy (s)", "index (s)", "legacy (MiB)",
+                                                      "index (MiB)"))
+    for size in sizes:
+        graph = build_synthetic_graph(size)
+        legacy_time, legacy_mem = measure(lambda: _legacy_index(graph), repeats)
+        index_time, index_mem = measure(lambda: _graph_index(graph), repeats)
+        print("{:>10} {:>12.4f} {:>12.4f} {:>14.2f} {:>14.2f}".format(size, legacy_time, index_time,
+                                                                      legacy_mem / 2 ** 20, index_mem / 2 ** 20))
+
+
+def _quiet_graph_characteristics(graph_def):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return converter_util.GraphCharacteristics(graph_def)
+
+
+# Returns the benchmarked analyses of an SSD graph as (name, fn, setup) tuples, in the form measure() takes them. The
+# searches memoized on a GraphCharacteristics get a fresh one for every call
+def ssd_analyses(graph_def):
+    graph_chars = _quiet_graph_characteristics(graph_def)
+    output_node = graph_chars.nodes_by_name["detection_boxes"]
+    fresh = lambda: _quiet_graph_characteristics(graph_def)
+    return [
+        ('GraphCharacteristics', lambda: _quiet_graph_characteristics(graph_def), None),
+        ('get_subgraph_inputs', lambda: graph_chars.get_subgraph_inputs("Postprocessor"), None),
+        ('BFS', lambda: converter_util.BFS(graph_def, output_node, "image_tensor", graph_chars=graph_chars), None),
+        ('get_NMS_input_order', lambda chars: converter_util.get_NMS_input_order(graph_def, "Postprocessor",
+                                                                                 graph_chars=chars), fresh),
+        ('get_num_classes', lambda chars: converter_util.get_num_classes(graph_def, graph_chars=chars), fresh),
+    ]
+
+
+# Checks that the analyses find what build_ssd_graph put into the graph, so that the benchmark times the intended code
+# paths (and not, say, an early exit or Tensorflow's shape inference fallback)
+def check_ssd_analyses(graph_def, num_classes=91):
+    graph_chars = _quiet_graph_characteristics(graph_def)
+    order = converter_util.get_NMS_input_order(graph_def, "Postprocessor", graph_chars=graph_chars)
+    if order != [0, 2, 1]:
+        raise ValueError("Unexpected NMS input order {}".format(order))
+    found_classes = converter_util.get_num_classes(graph_def, graph_chars=graph_chars)
+    if found_classes != num_classes:
+        raise ValueError("Unexpected number of classes {}".format(found_classes))
+    if converter_util.BFS(graph_def, graph_chars.nodes_by_name["detection_boxes"], "image_tensor",
+                          graph_chars=graph_chars) is None:
+        raise ValueError("BFS did not reach the input")
+
+
+# Times every SSD analysis on synthetic graphs of the given sizes. Returns a dictionary that maps each size (as a
+# string) to a dictionary that maps analysis names to {'seconds': best wall time, 'peak_bytes': peak traced memory}
+def benchmark_ssd(sizes, repeats):
+    results = {}
+    print("{:>10} {:<22} {:>12} {:>12}".format("nodes", "analysis", "time (s)", "peak (MiB)"))
+    for size in sizes:
+        graph_def = build_ssd_graph(size)
+        check_ssd_analyses(graph_def)
+        results[str(size)] = size_results = {}
+        for name, fn, setup in ssd_analyses(graph_def):
+            seconds, peak = measure(fn, repeats, setup=setup)
+            size_results[name] = {'seconds': seconds, 'peak_bytes': peak}
+            print("{:>10} {:<22} {:>12.4f} {:>12.2f}".format(len(graph_def.node), name, seconds, peak / 2 ** 20))
+    return results
+
+
+# Returns descriptions of the results that are worse than baseline by more than threshold (a fraction). Times whose
+# baseline is under min_seconds are too noisy to compare and are skipped
+def find_regressions(results, baseline, threshold, min_seconds=0.0):
+    regressions = []
+    for size, size_results in results.items():
+        for name, result in size_results.items():
+            base = baseline.get(size, {}).get(name)
+            if base is None:
+                continue
+            for metric, floor in (('seconds', min_seconds), ('peak_bytes', 0)):
+                if base[metric] < floor or base[metric] <= 0:
+                    continue
+                ratio = result[metric] / base[metric]
+                if ratio > 1 + threshold:
+                    regressions.append("{} nodes, {}: {} {:.4g} vs baseline {:.4g} ({:+.0%})".format(
+                        size, name, metric, result[metric], base[metric], ratio - 1))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--suite", help="ssd: time the SSD graph analyses on synthetic SSD graphs. index: compare the "
+                                        "graph index against the legacy dict/list index", choices=["ssd", "index"],
+                        default="ssd")
+    parser.add_argument("--sizes", "-s", help="Graph sizes (in nodes) to benchmark", type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument("--repeats", "-r", help="Number of timed repeats per size", type=int, default=3)
+    parser.add_argument("--baseline", "-b", help="JSON file of earlier results to compare against (ssd suite)")
+    parser.add_argument("--save_baseline", help="Write the results to this JSON file (ssd suite)")
+    parser.add_argument("--threshold", help="Fail if a time or peak memory exceeds its baseline by more than this "
+                                            "fraction", type=float, default=0.25)
+    parser.add_argument("--min_seconds", help="Do not compare times whose baseline is below this", type=float,
+                        default=0.005)
+    args = parser.parse_args()
+
+    if args.suite == "index":
+        benchmark_index(args.sizes, args.repeats)
+        exit(0)
+
+    results = benchmark_ssd(args.sizes, args.repeats)
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as f:
+            json.dump({'results': results}, f, indent=2, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = find_regressions(results, baseline, args.threshold, args.min_seconds)
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        if regressions:
+            exit(1)
+        print("No regressions against {} (threshold {:.0%})".format(args.baseline, args.threshold))
@@ -0,0 +1,298 @@
+import argparse
+import glob
+import hashlib
+import os
+
+import converter_util
+import graph_surgery
+import model_loader
+import shape_inference
+import stage_trace
+
+# Ops that pass their input through unchanged at inference time
+FORWARDED_OPS = {'Identity', 'Snapshot', 'StopGradient', 'CheckNumerics'}
+
+# Ops that are never inference outputs, even when nothing consumes them: checks, training, checkpointing and summaries
+NON_OUTPUT_OPS = {
+    'Assert', 'NoOp', 'Print', 'PrintV2', 'Const', 'SaveV2', 'Save', 'SaveSlices', 'RestoreV2', 'Restore',
+    'RestoreSlice', 'MergeV2Checkpoints', 'ShardedFilename', 'Assign', 'AssignAdd', 'AssignSub', 'AssignVariableOp',
+    'ApplyGradientDescent', 'ApplyMomentum', 'ApplyAdam', 'ApplyRMSProp', 'ScalarSummary', 'HistogramSummary',
+    'ImageSummary', 'AudioSummary', 'AudioSummaryV2', 'TensorSummary', 'TensorSummaryV2', 'MergeSummary',
+    'WriteSummary', 'WriteScalarSummary', 'WriteHistogramSummary',
+}
+
+# Top-level namespaces of training and checkpointing subgraphs
+NON_OUTPUT_NAMESPACES = {'save', 'gradients', 'train', 'summaries'}
+
+
+def add_optimizer_args(parser):
+    parser.add_argument("--optimize", help="Prune and constant-fold the graph before conversion, and convert the "
+                                           "result, written to <output_dir>.pb", action='store_true')
+
+
+# Returns the names of the likely inference outputs of a SurgeryGraph: its nodes without consumers, minus checks,
+# training, checkpointing and summary nodes
+def detect_outputs(graph):
+    return [node.name for node in graph.graph_outputs
+            if node.op not in NON_OUTPUT_OPS and node.op != 'Placeholder'
+            and node.name.split('/', 1)[0] not in NON_OUTPUT_NAMESPACES]
+
+
+# Returns the dtype of the first output of node, if it can be read from its attributes
+def _output_dtype(node):
+    if node.op in ('Shape', 'Size'):
+        out_type = shape_inference._attr(node, 'out_type')
+        return shape_inference.DT_INT32 if out_type is None else out_type.type
+    if node.op == 'Rank':
+        return shape_inference.DT_INT32
+    attr = shape_inference._attr(node, 'DstT' if node.op == 'Cast' else 'T')
+    return None if attr is None else attr.type
+
+
+# Returns a Const NodeDef of the same class and name as node, holding values with the given shape and dtype. Control
+# inputs of node are kept
+def _const_node(node, values, shape, dtype):
+    const = type(node)()
+    const.name = node.name
+    const.op = 'Const'
+    const.input.extend(input_name for input_name in node.input if input_name.startswith('^'))
+    const.attr['dtype'].type = dtype
+    tensor = const.attr['value'].tensor
+    tensor.dtype = dtype
+    for size in shape:
+        tensor.tensor_shape.dim.add(size=size)
+    if dtype == shape_inference.DT_INT32:
+        tensor.int_val.extend(values)
+    else:
+        tensor.int64_val.extend(values)
+    return const
+
+
+# Returns a dictionary that maps the names of the nodes inside while-loop frames to their frame, as a tuple of the
+# names of the frames enclosing them, outermost first. Nodes missing from it are outside loops. As in Tensorflow, a node
+# is in the frame of its inputs, an Enter node opens a child frame of its input's frame, and the consumers of an Exit
+# node are in the parent frame of the Exit node
+def _frames(index):
+    frames = [None] * len(index)
+    stack = []
+    for node_id in range(len(index)):
+        if not len(index.inputs(node_id)):
+            frames[node_id] = ()
+            stack.append(node_id)
+    while stack:
+        node_id = stack.pop()
+        frame = frames[node_id]
+        if index.ops[node_id] == 'Exit':
+            frame = frame[:-1]
+        for consumer in index.outputs(node_id):
+            if frames[consumer] is not None:
+                continue
+            if index.ops[consumer] == 'Enter':
+                frame_name = shape_inference._attr(index.nodes[consumer], 'frame_name')
+                frames[consumer] = frame + (b'' if frame_name is None else frame_name.s,)
+            else:
+                frames[consumer] = frame
+            stack.append(consumer)
+    return {name: frame for name, frame in zip(index.names, frames) if frame}
+
+
+# Returns whether the Identity-like node can be bypassed. Like grappler, nodes reading from a Switch are kept, since
+# they are the pivots of while loops and conditionals that control dependencies hang on, as are nodes inside a frame
+# that are control inputs of other nodes, and nodes whose input is in another frame (the consumers of an Exit node)
+def _forwardable(graph, node, frames):
+    data_inputs = [input_name for input_name in node.input if not input_name.startswith('^')]
+    if len(data_inputs) != 1:
+        return False
+    producer = converter_util.input_node_name(data_inputs[0])
+    if producer in graph and graph.node_map[producer].op == 'Switch':
+        return False
+    frame = frames.get(node.name, ())
+    if frames.get(producer, ()) != frame:
+        return False
+    control_input = '^' + node.name
+    return not frame or all(control_input not in consumer.input for consumer in graph.consumers(node.name))
+
+
+# Returns Const replacements for the nodes whose (integer) output is statically known, which is the shape arithmetic
+# feeding Reshapes, Slices and the like. Nodes inside while-loop frames (see _frames) are left as they are, since a
+# Const in a frame needs a control input from the frame's pivot
+def _folded_constants(graph_chars, input_shapes, frames):
+    inference = shape_inference.ShapeInference(graph_chars, input_shapes=input_shapes)
+    constants = []
+    for name, values in inference.values.items():
+        node = graph_chars.nodes_by_name[name]
+        if node.op == 'Const' or len(inference.shapes[name]) != 1 or name in frames:
+            continue
+        dtype = _output_dtype(node)
+        shape = inference.shapes[name][0]
+        if dtype not in (shape_inference.DT_INT32, shape_inference.DT_INT64) or shape is None or len(shape) > 1:
+            continue
+        if shape_inference._num_elements(shape) != len(values):
+            continue
+        constants.append(_const_node(node, values, shape, dtype))
+    return constants
+
+
+# Returns a digest of the dtype and value of a Const node
+def _const_digest(node):
+    hasher = hashlib.sha1()
+    hasher.update(node.attr['dtype'].SerializeToString(deterministic=True))
+    hasher.update(node.attr['value'].SerializeToString(deterministic=True))
+    return hasher.digest()
+
+
+# Removes the nodes the outputs do not depend on. Placeholders are kept, since they are the graph's interface
+def _eliminate_dead_nodes(graph, outputs):
+    live = set()
+    stack = [name for name in outputs if name in graph]
+    stack.extend(node.name for node in graph.find_nodes_by_op('Placeholder'))
+    while stack:
+        name = stack.pop()
+        if name in live or name not in graph:
+            continue
+        live.add(name)
+        stack.extend(converter_util.input_node_name(input_name) for input_name in graph.node_map[name].input)
+    dead = [name for name in graph.node_map if name not in live]
+    graph.remove(dead)
+    return len(dead)
+
+
+# Backend-neutral optimization of a frozen graph, without Tensorflow:
+# 1. Shape arithmetic outside while loops whose result is statically known (given input_shapes) is folded into Consts
+# 2. Assert nodes are removed, along with the nodes only feeding them
+# 3. Identity-like nodes are bypassed, except graph outputs and the ones while loops and conditionals rely on
+# 4. Identical Consts are merged
+# 5. Nodes the outputs do not depend on are removed
+# graph_def: The GraphDef to optimize. It is not modified
+# graph_chars: GraphCharacteristics of graph_def, if already computed
+# input_shapes: Dictionary that maps placeholder names to the shapes the graph will be converted with. The placeholders'
+#   shape attributes are set to them, since folding may depend on them
+# outputs: Names of the output nodes. Defaults to the nodes without consumers that are not training, checkpointing or
+#   summary nodes
+# Returns the optimized GraphDef and a dictionary reporting the node counts and sizes before and after, and what each
+# step did
+def optimize_graph(graph_def, graph_chars=None, input_shapes=None, outputs=None):
+    if graph_chars is None:
+        graph_chars = converter_util.GraphCharacteristics(graph_def)
+    input_shapes = input_shapes or {}
+
+    copy = type(graph_def)()
+    copy.CopyFrom(graph_def)
+    graph = graph_surgery.SurgeryGraph(copy, index=graph_chars.index)
+    if outputs is None:
+        outputs = detect_outputs(graph)
+
+    report = {'nodes_before': len(graph_def.node), 'bytes_before': graph_def.ByteSize(), 'outputs': list(outputs)}
+
+    frames = _frames(graph_chars.index)
+    with stage_trace.stage("optimize/fold"):
+        constants = _folded_constants(graph_chars, input_shapes, frames)
+        for const in constants:
+            graph.replace_node(const)
+        for name, shape in input_shapes.items():
+            placeholder = graph.node_map.get(name)
+            if placeholder is not None:
+                del placeholder.attr['shape'].shape.dim[:]
+                for size in shape:
+                    placeholder.attr['shape'].shape.dim.add(size=int(size))
+    report['folded'] = len(constants)
+
+    with stage_trace.stage("optimize/prune"):
+        nodes = len(graph)
+        graph.remove(graph.find_nodes_by_op('Assert'), remove_exclusive_dependencies=True)
+        report['asserts_removed'] = nodes - len(graph)
+
+        nodes = len(graph)
+        output_names = set(outputs)
+        for op in FORWARDED_OPS:
+            # Checked as the nodes are forwarded, since forwarding a node moves its control consumers to its inputs
+            for node in graph.find_nodes_by_op(op):
+                if node.name not in output_names and _forwardable(graph, node, frames):
+                    graph.forward_inputs([node])
+        report['identities_forwarded'] = nodes - len(graph)
+
+    with stage_trace.stage("optimize/dedup"):
+        canonical = {}
+        duplicates = []
+        for node in graph.find_nodes_by_op('Const'):
+            if node.input or node.name in output_names:
+                continue
+            digest = _const_digest(node)
+            if digest in canonical:
+                graph.replace_uses(node.name, canonical[digest])
+                duplicates.append(node.name)
+            else:
+                canonical[digest] = node.name
+        graph.remove(duplicates)
+        report['constants_deduplicated'] = len(duplicates)
+
+    with stage_trace.stage("optimize/dead_nodes"):
+        report['dead_removed'] = _eliminate_dead_nodes(graph, outputs)
+
+    optimized = graph.as_graph_def()
+    report['nodes_after'] = len(optimized.node)
+    report['bytes_after'] = optimized.ByteSize()
+    return optimized, report
+
+
+def report_message(report):
+    return ("Optimized graph: {} -> {} nodes, {} -> {} bytes ({} folded, {} removed with Asserts, {} identities "
+            "bypassed, {} duplicate constants merged, {} dead nodes removed)"
+            .format(report['nodes_before'], report['nodes_after'], report['bytes_before'], report['bytes_after'],
+                    report['folded'], report['asserts_removed'], report['identities_forwarded'],
+                    report['constants_deduplicated'], report['dead_removed']))
+
+
+# Runs optimize_graph on the model selected in args, when --optimize is given, writes the result to
+# <output_dir>.pb and points args.input at it, so every backend converts the optimized graph. Returns the LoadedModel
+# and GraphCharacteristics to convert
+def optimize_model(args, model, graph_chars, input_dims):
+    if not getattr(args, 'optimize', False):
+        return model, graph_chars
+
+    with stage_trace.stage("optimize"):
+        input_shapes = {graph_chars.input_node_names[0]: list(input_dims)}
+        optimized, report = optimize_graph(model.graph_def, graph_chars=graph_chars, input_shapes=input_shapes)
+
+        path = args.output_dir + ".pb"
+        if os.path.abspath(path) == os.path.abspath(args.input):
+            path = args.output_dir + "_optimized.pb"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Batch jobs of the same model may write the graph concurrently, so each writes a private file and moves it
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path, "wb") as f:
+            f.write(optimized.SerializeToString())
+        os.replace(temp_path, path)
+        stage_trace.event("optimized", report_message(report) + ", written to {}".format(path), path=path, **report)
+
+        # The OpenVINO converter looks for the pipeline config next to its input, so pin it to the original one
+        if hasattr(args, 'pipeline_config') and args.pipeline_config is None:
+            pipelines = glob.glob(os.path.join(os.path.dirname(args.input) or '.', '*.config'))
+            if len(pipelines) == 1:
+                args.pipeline_config = pipelines[0]
+        args.input = path
+
+        model = model_loader.load_model(path)
+        return model, model.graph_chars
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", "-i", help="Path to input file", required=True, type=str)
+    parser.add_argument("--output", "-o", help="Path of the optimized graph", required=True)
+    parser.add_argument("--input_dims", "-id", help="Dimensions of input tensor. Unknown dimensions are left unknown "
+                                                    "when omitted", type=int, nargs='+')
+    parser.add_argument("--outputs", help="Output node names. Defaults to the detected outputs", nargs='+')
+    args = parser.parse_args()
+
+    model = model_loader.load_model(args.input)
+    graph_chars = model.graph_chars
+    input_shapes = {graph_chars.input_node_names[0]: args.input_dims} if args.input_dims else None
+
+    optimized, report = optimize_graph(model.graph_def, graph_chars=graph_chars, input_shapes=input_shapes,
+                                       outputs=args.outputs)
+    with open(args.output, "wb") as f:
+        f.write(optimized.SerializeToString())
+    print(report_message(report))
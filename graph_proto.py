@@ -0,0 +1,135 @@
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+# Protobuf-only definitions of the Tensorflow GraphDef messages, for reading, writing and generating frozen graphs
+# without importing Tensorflow. Only the fields this project touches are declared, with the field numbers of
+# tensorflow/core/framework/*.proto, so the messages are wire-compatible with Tensorflow's own: a graph serialized by
+# one parses with the other, and fields not declared here (e.g. GraphDef.library) are kept as unknown fields and
+# written back unchanged.
+
+# Tensorflow DataType enum values (tensorflow/core/framework/types.proto)
+DATA_TYPES = [
+    ('DT_INVALID', 0), ('DT_FLOAT', 1), ('DT_DOUBLE', 2), ('DT_INT32', 3), ('DT_UINT8', 4), ('DT_INT16', 5),
+    ('DT_INT8', 6), ('DT_STRING', 7), ('DT_COMPLEX64', 8), ('DT_INT64', 9), ('DT_BOOL', 10), ('DT_QINT8', 11),
+    ('DT_QUINT8', 12), ('DT_QINT32', 13), ('DT_BFLOAT16', 14), ('DT_HALF', 19),
+]
+
+_FIELD = descriptor_pb2.FieldDescriptorProto
+_OPTIONAL = _FIELD.LABEL_OPTIONAL
+_REPEATED = _FIELD.LABEL_REPEATED
+
+# Message name -> list of (field name, number, type, label, message or enum type name)
+_MESSAGES = [
+    ('TensorShapeProto', [
+        ('dim', 2, _FIELD.TYPE_MESSAGE, _REPEATED, '.tensorflow.TensorShapeProto.Dim'),
+        ('unknown_rank', 3, _FIELD.TYPE_BOOL, _OPTIONAL, None),
+    ]),
+    ('TensorShapeProto.Dim', [
+        ('size', 1, _FIELD.TYPE_INT64, _OPTIONAL, None),
+        ('name', 2, _FIELD.TYPE_STRING, _OPTIONAL, None),
+    ]),
+    ('TensorProto', [
+        ('dtype', 1, _FIELD.TYPE_ENUM, _OPTIONAL, '.tensorflow.DataType'),
+        ('tensor_shape', 2, _FIELD.TYPE_MESSAGE, _OPTIONAL, '.tensorflow.TensorShapeProto'),
+        ('version_number', 3, _FIELD.TYPE_INT32, _OPTIONAL, None),
+        ('tensor_content', 4, _FIELD.TYPE_BYTES, _OPTIONAL, None),
+        ('float_val', 5, _FIELD.TYPE_FLOAT, _REPEATED, None),
+        ('double_val', 6, _FIELD.TYPE_DOUBLE, _REPEATED, None),
+        ('int_val', 7, _FIELD.TYPE_INT32, _REPEATED, None),
+        ('string_val', 8, _FIELD.TYPE_BYTES, _REPEATED, None),
+        ('int64_val', 10, _FIELD.TYPE_INT64, _REPEATED, None),
+        ('bool_val', 11, _FIELD.TYPE_BOOL, _REPEATED, None),
+        ('half_val', 13, _FIELD.TYPE_INT32, _REPEATED, None),
+    ]),
+    ('AttrValue', [
+        ('list', 1, _FIELD.TYPE_MESSAGE, _OPTIONAL, '.tensorflow.AttrValue.ListValue'),
+        ('s', 2, _FIELD.TYPE_BYTES, _OPTIONAL, None),
+        ('i', 3, _FIELD.TYPE_INT64, _OPTIONAL, None),
+        ('f', 4, _FIELD.TYPE_FLOAT, _OPTIONAL, None),
+        ('b', 5, _FIELD.TYPE_BOOL, _OPTIONAL, None),
+        ('type', 6, _FIELD.TYPE_ENUM, _OPTIONAL, '.tensorflow.DataType'),
+        ('shape', 7, _FIELD.TYPE_MESSAGE, _OPTIONAL, '.tensorflow.TensorShapeProto'),
+        ('tensor', 8, _FIELD.TYPE_MESSAGE, _OPTIONAL, '.tensorflow.TensorProto'),
+        ('placeholder', 9, _FIELD.TYPE_STRING, _OPTIONAL, None),
+    ]),
+    ('AttrValue.ListValue', [
+        ('s', 2, _FIELD.TYPE_BYTES, _REPEATED, None),
+        ('i', 3, _FIELD.TYPE_INT64, _REPEATED, None),
+        ('f', 4, _FIELD.TYPE_FLOAT, _REPEATED, None),
+        ('b', 5, _FIELD.TYPE_BOOL, _REPEATED, None),
+        ('type', 6, _FIELD.TYPE_ENUM, _REPEATED, '.tensorflow.DataType'),
+        ('shape', 7, _FIELD.TYPE_MESSAGE, _REPEATED, '.tensorflow.TensorShapeProto'),
+        ('tensor', 8, _FIELD.TYPE_MESSAGE, _REPEATED, '.tensorflow.TensorProto'),
+    ]),
+    ('NodeDef', [
+        ('name', 1, _FIELD.TYPE_STRING, _OPTIONAL, None),
+        ('op', 2, _FIELD.TYPE_STRING, _OPTIONAL, None),
+        ('input', 3, _FIELD.TYPE_STRING, _REPEATED, None),
+        ('device', 4, _FIELD.TYPE_STRING, _OPTIONAL, None),
+        ('attr', 5, _FIELD.TYPE_MESSAGE, _REPEATED, '.tensorflow.NodeDef.AttrEntry'),
+    ]),
+    ('NodeDef.AttrEntry', [
+        ('key', 1, _FIELD.TYPE_STRING, _OPTIONAL, None),
+        ('value', 2, _FIELD.TYPE_MESSAGE, _OPTIONAL, '.tensorflow.AttrValue'),
+    ]),
+    ('VersionDef', [
+        ('producer', 1, _FIELD.TYPE_INT32, _OPTIONAL, None),
+        ('min_consumer', 2, _FIELD.TYPE_INT32, _OPTIONAL, None),
+        ('bad_consumers', 3, _FIELD.TYPE_INT32, _REPEATED, None),
+    ]),
+    ('GraphDef', [
+        ('node', 1, _FIELD.TYPE_MESSAGE, _REPEATED, '.tensorflow.NodeDef'),
+        ('version', 3, _FIELD.TYPE_INT32, _OPTIONAL, None),
+        ('versions', 4, _FIELD.TYPE_MESSAGE, _OPTIONAL, '.tensorflow.VersionDef'),
+    ]),
+]
+
+
+def _build_file_descriptor():
+    file_proto = descriptor_pb2.FileDescriptorProto(name='edge_model_converter/graph.proto', package='tensorflow',
+                                                    syntax='proto3')
+    data_type = file_proto.enum_type.add(name='DataType')
+    for name, number in DATA_TYPES:
+        data_type.value.add(name=name, number=number)
+
+    messages = {}
+    for full_name, fields in _MESSAGES:
+        parent, _, name = full_name.rpartition('.')
+        message = (messages[parent].nested_type if parent else file_proto.message_type).add(name=name)
+        for field_name, number, field_type, label, type_name in fields:
+            field = message.field.add(name=field_name, number=number, type=field_type, label=label)
+            if type_name is not None:
+                field.type_name = type_name
+        messages[full_name] = message
+
+    # AttrValue holds exactly one of its values
+    attr_value = messages['AttrValue']
+    attr_value.oneof_decl.add(name='value')
+    for field in attr_value.field:
+        field.oneof_index = 0
+    messages['NodeDef.AttrEntry'].options.map_entry = True
+
+    return file_proto
+
+
+# The messages live in a private descriptor pool, so they do not clash with Tensorflow's when both are imported
+_POOL = descriptor_pool.DescriptorPool()
+_POOL.Add(_build_file_descriptor())
+
+
+def _message_class(name):
+    descriptor = _POOL.FindMessageTypeByName('tensorflow.' + name)
+    try:
+        return message_factory.GetMessageClass(descriptor)
+    except AttributeError:
+        # protobuf < 4.21
+        return message_factory.MessageFactory(_POOL).GetPrototype(descriptor)
+
+
+GraphDef = _message_class('GraphDef')
+NodeDef = _message_class('NodeDef')
+AttrValue = _message_class('AttrValue')
+TensorProto = _message_class('TensorProto')
+TensorShapeProto = _message_class('TensorShapeProto')
+
+# DT_FLOAT, DT_INT32, ... as module constants
+globals().update(DATA_TYPES)
@@ -0,0 +1,300 @@
+import converter_util
+
+
+# Returns the names of the nodes a NodeDef reads from, data and control inputs alike
+def _producers(node):
+    return {converter_util.input_node_name(input_name) for input_name in node.input}
+
+
+def _node_name(node):
+    return node if type(node) is str else node.name
+
+
+# A mutable graph for graph surgery, supporting the graphsurgeon DynamicGraph operations the converters use (remove,
+# forward_inputs, collapse_namespaces, find_nodes_by_name, find_nodes_by_op, graph_outputs). Unlike DynamicGraph, which
+# re-analyzes the whole graph after every operation and scans it on every lookup, name, op and consumer indexes are
+# updated incrementally as nodes are removed, forwarded and collapsed, so lookups take constant time and each operation
+# only touches the nodes it affects.
+# graph_def: The GraphDef to operate on. Its nodes are modified in place, so pass a copy of a shared graph
+# index: GraphIndex of graph_def (or of a graph with the same nodes in the same order), if already built, whose consumer
+#   lists are used instead of re-parsing every input. The consumers of a node are only copied out of the index when
+#   an operation first touches them
+# node_map: Dictionary that maps node names to NodeDefs, in graph order
+class SurgeryGraph:
+
+    def __init__(self, graph_def, index=None):
+        self._graph_def_class = type(graph_def)
+        self._source = graph_def
+        self.node_map = {}
+        self._by_op = {}
+        # Node name -> ordered set (dict) of consumer names. Names missing here fall back to the index
+        self._consumers = {}
+        self._index = None
+        # Names of the nodes of the index no longer in the graph, and NamespaceTrie of the nodes not from the index
+        # (every node, without an index, in which case it is only built once namespaces are first queried)
+        self._dropped = set()
+        self._namespaces = None
+
+        if index is not None and len(index) == len(graph_def.node):
+            names = index.names
+            self._index = index
+            self._namespaces = converter_util.NamespaceTrie()
+            self.node_map = dict(zip(names, graph_def.node))
+            self._by_op = {op: dict.fromkeys(names[node_id] for node_id in ids)
+                           for op, ids in index.ops_by_type.items()}
+        else:
+            for node in graph_def.node:
+                self._add(node)
+
+    def __len__(self):
+        return len(self.node_map)
+
+    def __contains__(self, name):
+        return name in self.node_map
+
+    # Returns the mutable set of consumer names of the node called name. Once a name has an entry, the index is no
+    # longer consulted for it, so entries are kept (if empty) when nodes are removed
+    def _consumer_set(self, name):
+        consumers = self._consumers.get(name)
+        if consumers is None:
+            node_id = self._index.ids.get(name) if self._index is not None else None
+            if node_id is None:
+                consumers = {}
+            else:
+                names = self._index.names
+                consumers = dict.fromkeys(names[dst] for dst in self._index.outputs(node_id))
+            self._consumers[name] = consumers
+        return consumers
+
+    def _has_consumers(self, name):
+        consumers = self._consumers.get(name)
+        if consumers is None and self._index is not None and name in self._index.ids:
+            return self._index.out_degree(self._index.ids[name]) > 0
+        return bool(consumers)
+
+    def _add(self, node):
+        name = node.name
+        self.node_map[name] = node
+        self._by_op.setdefault(node.op, {})[name] = None
+        self._consumer_set(name)
+        for producer in _producers(node):
+            self._consumer_set(producer)[name] = None
+        if self._namespaces is not None:
+            self._namespaces.add(name)
+
+    def _drop(self, name):
+        # Consumers still referencing the node stay tracked, in case a node of the same name is added back
+        self._consumer_set(name)
+        node = self.node_map.pop(name)
+        nodes_of_op = self._by_op[node.op]
+        del nodes_of_op[name]
+        if not nodes_of_op:
+            del self._by_op[node.op]
+        for producer in _producers(node):
+            self._consumer_set(producer).pop(name, None)
+        if self._namespaces is not None:
+            self._namespaces.remove(name)
+        if self._index is not None and name in self._index.ids:
+            self._dropped.add(name)
+        return node
+
+    # Returns a list holding the node called name, or an empty list
+    def find_nodes_by_name(self, name):
+        node = self.node_map.get(name)
+        return [] if node is None else [node]
+
+    # Returns the nodes with the given op, in graph order, except that nodes given the op by replace_node come last
+    def find_nodes_by_op(self, op):
+        return [self.node_map[name] for name in self._by_op.get(op, ())]
+
+    # Returns the nodes reading from the node called name
+    def consumers(self, name):
+        return [self.node_map[consumer] for consumer in self._consumer_set(name) if consumer in self.node_map]
+
+    # Nodes without consumers, in graph order
+    @property
+    def graph_outputs(self):
+        return [node for name, node in self.node_map.items() if not self._has_consumers(name)]
+
+    # Replaces the inputs of node, keeping the consumer index up to date. Nodes must not be rewired by modifying
+    # node.input directly
+    def set_inputs(self, node, inputs):
+        inputs = list(inputs)
+        old_producers = _producers(node)
+        del node.input[:]
+        node.input.extend(inputs)
+        new_producers = _producers(node)
+        for producer in old_producers - new_producers:
+            self._consumer_set(producer).pop(node.name, None)
+        for producer in new_producers - old_producers:
+            self._consumer_set(producer)[node.name] = None
+
+    # Removes every input of node that is one of input_names, as written (port and control marker included)
+    def remove_inputs(self, node, input_names):
+        if any(input_name in input_names for input_name in node.input):
+            self.set_inputs(node, [input_name for input_name in node.input if input_name not in input_names])
+
+    # Adds node, which must not share its name with a node of the graph
+    def append(self, node):
+        if node.name in self.node_map:
+            raise ValueError("Node {} already exists".format(node.name))
+        self._add(node)
+
+    # Removes nodes (NodeDefs or node names) from the graph, along with the references other nodes hold to them. With
+    # remove_exclusive_dependencies, nodes only feeding removed nodes are removed as well, recursively
+    def remove(self, nodes, remove_exclusive_dependencies=False):
+        removed = {_node_name(node) for node in nodes} & self.node_map.keys()
+
+        if remove_exclusive_dependencies:
+            stack = list(removed)
+            while stack:
+                name = stack.pop()
+                for producer in _producers(self.node_map[name]):
+                    if producer in removed or producer not in self.node_map:
+                        continue
+                    if all(consumer in removed for consumer in self._consumer_set(producer)):
+                        removed.add(producer)
+                        stack.append(producer)
+
+        affected = set()
+        for name in removed:
+            affected.update(consumer for consumer in self._consumer_set(name) if consumer not in removed)
+        for name in removed:
+            self._drop(name)
+        for name in affected:
+            node = self.node_map[name]
+            self.set_inputs(node, [input_name for input_name in node.input
+                                   if converter_util.input_node_name(input_name) not in removed])
+
+    # Removes nodes (NodeDefs or node names), connecting their inputs directly to their consumers: A -> B -> C becomes
+    # A -> C when B is forwarded. Control inputs are kept after the data inputs, as Tensorflow requires. Nodes without
+    # consumers are graph outputs, and are kept
+    def forward_inputs(self, nodes):
+        for name in [_node_name(node) for node in nodes]:
+            node = self.node_map.get(name)
+            if node is None or not self._has_consumers(name):
+                continue
+            data_inputs = [input_name for input_name in node.input if not input_name.startswith('^')]
+            control_inputs = [input_name for input_name in node.input if input_name.startswith('^')]
+            for consumer in self.consumers(name):
+                inputs = []
+                controls = []
+                for input_name in consumer.input:
+                    if converter_util.input_node_name(input_name) != name:
+                        (controls if input_name.startswith('^') else inputs).append(input_name)
+                    elif input_name.startswith('^'):
+                        controls.extend('^' + converter_util.input_node_name(x) for x in node.input)
+                    else:
+                        inputs.extend(data_inputs)
+                        controls.extend(control_inputs)
+                self.set_inputs(consumer, inputs + list(dict.fromkeys(controls)))
+            self._drop(name)
+
+    # Makes every consumer of the node called name read from the node called replacement instead, keeping ports and
+    # control markers
+    def replace_uses(self, name, replacement):
+        for consumer in self.consumers(name):
+            inputs = []
+            for input_name in consumer.input:
+                if converter_util.input_node_name(input_name) == name:
+                    input_name = input_name.replace(name, replacement, 1)
+                inputs.append(input_name)
+            self.set_inputs(consumer, inputs)
+
+    # Replaces the node of the same name as node with node, at the same position in the graph. Consumers are left as
+    # they are
+    def replace_node(self, node):
+        name = node.name
+        old = self.node_map[name]
+        nodes_of_op = self._by_op[old.op]
+        del nodes_of_op[name]
+        if not nodes_of_op:
+            del self._by_op[old.op]
+        self._by_op.setdefault(node.op, {})[name] = None
+        old_producers = _producers(old)
+        new_producers = _producers(node)
+        for producer in old_producers - new_producers:
+            self._consumer_set(producer).pop(name, None)
+        for producer in new_producers - old_producers:
+            self._consumer_set(producer)[name] = None
+        # Assigning an existing key keeps its position
+        self.node_map[name] = node
+
+    # Returns the names of the nodes in namespaces (a namespace name, or a collection of them, see
+    # converter_util.NamespaceTrie), in graph order
+    def namespace_members(self, namespaces):
+        if self._index is None:
+            if self._namespaces is None:
+                self._namespaces = converter_util.NamespaceTrie(self.node_map)
+            return self._namespaces.members(namespaces)
+        # Nodes of the index keep their position, and nodes added since come after them
+        members = self._index.namespaces.members(namespaces)
+        if self._dropped:
+            members = [name for name in members if name not in self._dropped]
+        return members + self._namespaces.members(namespaces)
+
+    # Replaces the nodes of every namespace in namespace_map with the node it maps to (typically a plugin node). A node
+    # belongs to its most specific namespace in namespace_map, matching whole name components ("concat" holds "concat"
+    # and "concat/axis", not "concat_1"). The new node reads the inputs the namespace reads from outside, and nodes
+    # reading from the namespace read from the new node instead. With unique_inputs, each input is only added to a new
+    # node once
+    def collapse_namespaces(self, namespace_map, unique_inputs=True):
+        collapsed = {name: namespace_map[converter_util.namespace_owner(name, namespace_map)]
+                     for name in self.namespace_members(namespace_map)}
+        if not collapsed:
+            return
+
+        def replacement(input_name):
+            producer = converter_util.input_node_name(input_name)
+            target = collapsed.get(producer)
+            if target is None:
+                return input_name
+            return '^' + target.name if input_name.startswith('^') else target.name
+
+        # Inputs of the new nodes, from the inputs the namespaces read from outside, in graph order
+        new_nodes = {}
+        new_inputs = {}
+        for name, target in collapsed.items():
+            if target.name not in new_nodes:
+                if target.name in self.node_map and target.name not in collapsed:
+                    raise ValueError("Node {} already exists".format(target.name))
+                new_nodes[target.name] = target
+                new_inputs[target.name] = dict.fromkeys(target.input) if unique_inputs else list(target.input)
+            inputs = new_inputs[target.name]
+            for input_name in self.node_map[name].input:
+                input_name = replacement(input_name)
+                if converter_util.input_node_name(input_name) == target.name:
+                    continue
+                if unique_inputs:
+                    inputs[input_name] = None
+                else:
+                    inputs.append(input_name)
+
+        # Nodes outside the namespaces that read from them
+        rewired = {}
+        for name in collapsed:
+            for consumer in self._consumer_set(name):
+                if consumer not in collapsed and consumer in self.node_map and consumer not in rewired:
+                    rewired[consumer] = [replacement(input_name) for input_name in self.node_map[consumer].input]
+
+        for name in collapsed:
+            self._drop(name)
+        for name, target in new_nodes.items():
+            del target.input[:]
+            target.input.extend(new_inputs[name])
+            self._add(target)
+        for name, inputs in rewired.items():
+            self.set_inputs(self.node_map[name], inputs)
+
+    # Returns the graph as a new GraphDef, with the other fields (versions, library) of the original GraphDef
+    def as_graph_def(self):
+        graph_def = self._graph_def_class()
+        graph_def.node.extend(self.node_map.values())
+        for field, value in self._source.ListFields():
+            if field.name == 'node':
+                continue
+            if field.message_type is not None:
+                getattr(graph_def, field.name).CopyFrom(value)
+            else:
+                setattr(graph_def, field.name, value)
+        return graph_def
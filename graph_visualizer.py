@@ -1,13 +1,495 @@
-import tensorflow as tf
 import argparse
+import html
+import json
+import os
 import subprocess
+from collections import Counter
+
+import converter_util
+import model_loader
+import shape_inference
+
+# Namespaces deeper than this are merged into their ancestor at this depth, which bounds the size of the view
+DEFAULT_MAX_DEPTH = 4
+
+# Kinds of view items
+NODE = 0
+NAMESPACE = 1
+MERGED = 2
+
+# Role flags of view items, shared with the namespaces containing them
+ROLE_INPUT = 1
+ROLE_OUTPUT = 2
+ROLE_NMS = 4
+
+# Number of op types listed in the description of a namespace
+TOP_OPS = 5
+
+# Fill colors of the roles in the rendered views, by priority
+ROLE_COLORS = [(ROLE_NMS, "#f4b942"), (ROLE_INPUT, "#7cc47f"), (ROLE_OUTPUT, "#e57373")]
+NAMESPACE_COLOR = "#cfe0f5"
+NODE_COLOR = "#ffffff"
+
+
+def setup_args(parser):
+    parser.add_argument("--input", "-i", help="Path to input file", required=True, type=str)
+    parser.add_argument("--input_dims", "-id", help="Dimensions of input tensor, for the shape annotations", type=int,
+                        nargs='+')
+    parser.add_argument("--format", "-f", help="html: interactive page expanding namespaces on click. dot: Graphviz "
+                                               "graph of the namespaces up to --depth. tensorboard: import the graph "
+                                               "with Tensorflow and launch TensorBoard",
+                        choices=["html", "dot", "tensorboard"], default="html")
+    parser.add_argument("--output", "-o", help="Output file. Defaults to the input path with the format's extension")
+    parser.add_argument("--depth", help="Namespace depth shown expanded (html) or drawn (dot)", type=int, default=1)
+    parser.add_argument("--max_depth", help="Namespaces deeper than this are merged into their ancestor", type=int,
+                        default=DEFAULT_MAX_DEPTH)
+    parser.add_argument("--shapes", help="Annotate nodes with their statically inferred output shapes",
+                        action='store_true')
+    parser.add_argument("--annotations", help="JSON file mapping node names to dictionaries of annotations, e.g. "
+                                              "estimated costs. Numeric values are summed over namespaces")
+    parser.add_argument("--port", "-p", help="Port to use (tensorboard)", default=6006, type=str)
+    parser.add_argument("--out_dir", "-d", help="Export directory (tensorboard)", default="./graphs")
+
+
+# Returns the nodes feeding the NMS of an SSD graph: the inputs of its Postprocessor namespace that are reached from the
+# box encodings, class predictions or anchors, as a dictionary that maps node names to those roles
+def nms_inputs(graph_chars):
+    input_nodes = graph_chars.get_subgraph_inputs("Postprocessor")
+    if not input_nodes:
+        return {}
+    search = graph_chars.ancestor_search(converter_util.SSD_TARGETS)
+    search.search(input_nodes)
+    roles = {}
+    for node in input_nodes:
+        for key in ('loc', 'conf', 'priorbox'):
+            if search.reaches(node, key):
+                roles[node.name] = key
+                break
+    return roles
+
+
+# Namespace hierarchy of a graph, the model behind the views. Every node is an item, under one item per namespace of
+# its name; below max_depth, nodes are merged into their namespace at that depth. Properties:
+# items: List of [path, parent, kind, count, roles, ops] lists, parents before their children. count is the number of
+#   graph nodes under the item, and ops the op type of a node or the most common ones of a namespace
+# edges: Dictionary that maps (source item, destination item) pairs of leaf items (nodes and merged namespaces) to the
+#   number of graph edges between them. Control edges are left out
+# annotations: Dictionary that maps item ids to annotation dictionaries, with numeric values summed over namespaces
+# nms_roles: Dictionary that maps the NMS input node names to their roles (see nms_inputs)
+class NamespaceTree:
+
+    def __init__(self, graph_chars, max_depth=DEFAULT_MAX_DEPTH, annotations=None):
+        index = graph_chars.index
+        self.items = []
+        self.ids = {}
+        self.nms_roles = nms_inputs(graph_chars)
+
+        # Namespaces, up to max_depth - 1 deep, and the namespaces at max_depth whose nodes are merged. Nodes named
+        # like a namespace (a node "a" beside a node "a/b") become items of their own, with a trailing "/", inside it
+        namespaces = set()
+        merged = set()
+        seen = set()
+        for name in index.names:
+            namespace = name.rpartition('/')[0]
+            while namespace and namespace not in seen:
+                seen.add(namespace)
+                depth = namespace.count('/') + 1
+                if depth < max_depth:
+                    namespaces.add(namespace)
+                elif depth == max_depth:
+                    merged.add(namespace)
+                namespace = namespace.rpartition('/')[0]
+
+        # Op counts of the namespaces and merged items
+        op_counts = {}
+        leaf_ids = []
+        for node_id, name in enumerate(index.names):
+            parts = name.split('/', max_depth)
+            if len(parts) > max_depth or name in merged:
+                path = '/'.join(parts[:max_depth])
+                kind = MERGED
+            else:
+                path = name + '/' if name in namespaces else name
+                kind = NODE
+            item = self.ids.get(path)
+            if item is None:
+                item = self._add_item(path, self._namespace_item(name.rpartition('/')[0] if kind == NODE
+                                                                 else path.rpartition('/')[0]), kind)
+            fields = self.items[item]
+            fields[3] += 1
+            op = index.ops[node_id]
+            if kind == NODE:
+                fields[5] = op
+            counts = op_counts.setdefault(fields[1] if kind == NODE else item, {})
+            counts[op] = counts.get(op, 0) + 1
+            leaf_ids.append(item)
+
+        # Roll the op counts up the namespaces, children first
+        for item in range(len(self.items) - 1, -1, -1):
+            fields = self.items[item]
+            if fields[2] == NODE:
+                continue
+            counts = op_counts.get(item, {})
+            if fields[2] == NAMESPACE:
+                fields[3] = sum(counts.values())
+            fields[5] = ', '.join("{} {}".format(op, count) for op, count in Counter(counts).most_common(TOP_OPS))
+            if fields[1] >= 0:
+                parent_counts = op_counts.setdefault(fields[1], {})
+                for op, count in counts.items():
+                    parent_counts[op] = parent_counts.get(op, 0) + count
+
+        roles = [0] * len(index)
+        for node_id in graph_chars.input_ids:
+            roles[node_id] |= ROLE_INPUT
+        for node_id in graph_chars.output_ids:
+            roles[node_id] |= ROLE_OUTPUT
+        for name in self.nms_roles:
+            roles[index.ids[name]] |= ROLE_NMS
+        for node_id, role in enumerate(roles):
+            item = leaf_ids[node_id]
+            while role and item >= 0:
+                self.items[item][4] |= role
+                item = self.items[item][1]
+
+        self.edges = Counter()
+        for node_id, node in enumerate(index.nodes):
+            dst = leaf_ids[node_id]
+            for input_name in node.input:
+                parsed = shape_inference.parse_input(input_name)
+                if parsed is None or parsed[0] not in index.ids:
+                    continue
+                src = leaf_ids[index.ids[parsed[0]]]
+                if src != dst:
+                    self.edges[(src, dst)] += 1
+
+        self.annotations = {}
+        for name, values in (annotations or {}).items():
+            if name not in index.ids:
+                continue
+            item = leaf_ids[index.ids[name]]
+            self.annotations.setdefault(item, {}).update(values)
+            parent = self.items[item][1]
+            while parent >= 0:
+                totals = self.annotations.setdefault(parent, {})
+                for key, value in values.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        totals[key] = totals.get(key, 0) + value
+                parent = self.items[parent][1]
+
+    def _add_item(self, path, parent, kind):
+        item = self.ids[path] = len(self.items)
+        self.items.append([path, parent, kind, 0, 0, ''])
+        return item
+
+    # Returns the item of a namespace path, creating it and its ancestors as needed. The empty path is the root, -1
+    def _namespace_item(self, path):
+        if not path:
+            return -1
+        item = self.ids.get(path)
+        if item is None:
+            item = self._add_item(path, self._namespace_item(path.rpartition('/')[0]), NAMESPACE)
+        return item
+
+    def depth(self, item):
+        depth = 0
+        while item >= 0:
+            item = self.items[item][1]
+            depth += 1
+        return depth
+
+    # Returns the item standing for a leaf item when namespaces deeper than depth are collapsed
+    def visible_item(self, item, depth):
+        chain = []
+        while item >= 0:
+            chain.append(item)
+            item = self.items[item][1]
+        return chain[-min(depth, len(chain))]
+
+    # Returns the items and the (source, destination) -> edge count dictionary of the graph with the namespaces deeper
+    # than depth collapsed
+    def collapsed(self, depth):
+        visible = {}
+        edges = Counter()
+        for (src, dst), count in self.edges.items():
+            src = visible.setdefault(src, self.visible_item(src, depth))
+            dst = visible.setdefault(dst, self.visible_item(dst, depth))
+            if src != dst:
+                edges[(src, dst)] += count
+        items = sorted({self.visible_item(item, depth) for item, fields in enumerate(self.items)
+                        if fields[2] != NAMESPACE})
+        return items, edges
+
+    # Returns the label of an item: the last component of its path, and the node count of a namespace
+    def label(self, item):
+        path, _, kind, count, _, _ = self.items[item]
+        name = path.rstrip('/').rsplit('/', 1)[-1]
+        return name if kind == NODE else "{} ({})".format(name, count)
+
+    # Returns the multi-line description of an item shown on hover
+    def description(self, item):
+        path, _, kind, count, roles, ops = self.items[item]
+        lines = [path.rstrip('/')]
+        lines.append(ops if kind == NODE else "{} nodes: {}".format(count, ops))
+        if roles & ROLE_INPUT:
+            lines.append("Graph input" if kind == NODE else "Contains graph inputs")
+        if roles & ROLE_OUTPUT:
+            lines.append("Graph output" if kind == NODE else "Contains graph outputs")
+        if roles & ROLE_NMS:
+            if kind == NODE:
+                lines.append("NMS input ({})".format(self.nms_roles.get(path.rstrip('/'))))
+            else:
+                lines.append("Contains NMS inputs")
+        for key, value in sorted(self.annotations.get(item, {}).items()):
+            lines.append("{}: {}".format(key, value))
+        return '\n'.join(lines)
+
+
+# Returns the fill color of an item with the given kind and role flags
+def item_color(kind, roles):
+    for role, color in ROLE_COLORS:
+        if roles & role:
+            return color
+    return NODE_COLOR if kind == NODE else NAMESPACE_COLOR
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--input", "-i", help="Path to input file", type=str)
-    parser.add_argument("--port", "-p", help="Port to use", default=6006, type=str)
-    parser.add_argument("--out_dir", "-d", help="Export directory", default="./graphs")
-    args = parser.parse_args()
+
+def _dot_string(text):
+    return '"{}"'.format(text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+
+
+# Writes a Graphviz view of the tree with the namespaces deeper than depth collapsed. Edges carry the number of graph
+# edges they stand for
+def write_dot(tree, path, depth):
+    items, edges = tree.collapsed(depth)
+    with open(path, "w") as f:
+        f.write("digraph G {\n  rankdir=LR;\n  node [style=filled, fontname=\"Helvetica\"];\n")
+        for item in items:
+            kind, roles = tree.items[item][2], tree.items[item][4]
+            f.write("  n{} [label={}, tooltip={}, shape={}, fillcolor=\"{}\"];\n".format(
+                item, _dot_string(tree.label(item)), _dot_string(tree.description(item)),
+                "ellipse" if kind == NODE else "box", item_color(kind, roles)))
+        for (src, dst), count in sorted(edges.items()):
+            f.write("  n{} -> n{}{};\n".format(src, dst, " [label=\"{}\"]".format(count) if count > 1 else ""))
+        f.write("}\n")
+
+
+_HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: Helvetica, Arial, sans-serif; margin: 0; }}
+#bar {{ padding: 8px; background: #f2f2f2; border-bottom: 1px solid #ccc; position: sticky; top: 0; }}
+#bar span {{ margin-right: 16px; }}
+.swatch {{ display: inline-block; width: 12px; height: 12px; border: 1px solid #888; vertical-align: middle; }}
+svg text {{ font-size: 11px; pointer-events: none; }}
+svg rect {{ stroke: #555; cursor: pointer; }}
+svg path {{ fill: none; stroke: #999; }}
+</style>
+</head>
+<body>
+<div id="bar">
+<b>{title}</b> &mdash; {nodes} nodes.
+Click a namespace to expand it, shift-click to collapse the namespace around it.
+<button onclick="setDepth(1)">Collapse all</button>
+<button onclick="setDepth(DATA.depth)">Reset</button>
+<span></span>{legend}
+</div>
+<svg id="view"></svg>
+<script type="application/json" id="data">{data}</script>
+<script>
+const DATA = JSON.parse(document.getElementById('data').textContent);
+const ITEMS = DATA.items, N = ITEMS.length, W = 200, H = 28, GAP_X = 80, GAP_Y = 10;
+const depth = new Int32Array(N), children = ITEMS.map(() => []);
+ITEMS.forEach((item, i) => {{
+  if (item[1] >= 0) {{ depth[i] = depth[item[1]] + 1; children[item[1]].push(i); }} else depth[i] = 1;
+}});
+const expanded = new Uint8Array(N);
+
+function setDepth(d) {{
+  ITEMS.forEach((item, i) => {{ expanded[i] = item[2] === 1 && depth[i] < d ? 1 : 0; }});
+  render();
+}}
+
+function visibleOf(i) {{
+  let v = i;
+  for (let p = ITEMS[i][1]; p >= 0; p = ITEMS[p][1]) if (!expanded[p]) v = p;
+  return v;
+}}
+
+function trimmed(path) {{
+  return path.endsWith('/') ? path.slice(0, -1) : path;
+}}
+
+function label(i) {{
+  const item = ITEMS[i], name = trimmed(item[0]).split('/').pop();
+  return item[2] === 0 ? name : `${{name}} (${{item[3]}})`;
+}}
+
+function description(i) {{
+  const [path, , kind, count, roles, ops] = ITEMS[i], node = kind === 0;
+  const lines = [trimmed(path), node ? ops : `${{count}} nodes: ${{ops}}`];
+  if (roles & 1) lines.push(node ? 'Graph input' : 'Contains graph inputs');
+  if (roles & 2) lines.push(node ? 'Graph output' : 'Contains graph outputs');
+  if (roles & 4) lines.push(node ? `NMS input (${{DATA.nms[i]}})` : 'Contains NMS inputs');
+  const notes = DATA.annotations[i] || {{}};
+  for (const key of Object.keys(notes).sort()) lines.push(`${{key}}: ${{notes[key]}}`);
+  return lines.join('\\n');
+}}
+
+function color(item) {{
+  for (const [role, c] of DATA.roleColors) if (item[4] & role) return c;
+  return item[2] === 0 ? DATA.nodeColor : DATA.namespaceColor;
+}}
+
+function render() {{
+  const units = [], isUnit = new Uint8Array(N);
+  ITEMS.forEach((item, i) => {{
+    if (item[2] === 1 && expanded[i]) return;
+    const v = visibleOf(i);
+    if (v === i) {{ units.push(i); isUnit[i] = 1; }}
+  }});
+  const edgeCounts = new Map();
+  for (const [s, d, c] of DATA.edges) {{
+    const vs = visibleOf(s), vd = visibleOf(d);
+    if (vs === vd) continue;
+    const key = vs * N + vd;
+    edgeCounts.set(key, (edgeCounts.get(key) || 0) + c);
+  }}
+  const out = new Map(), inc = new Map();
+  units.forEach(u => {{ out.set(u, []); inc.set(u, []); }});
+  edgeCounts.forEach((c, key) => {{
+    const s = Math.floor(key / N), d = key % N;
+    out.get(s).push(d); inc.get(d).push(s);
+  }});
+
+  // Topological order by depth-first search, ignoring the back edges collapsed namespaces can form
+  const state = new Map(), order = [];
+  for (const root of units) {{
+    if (state.has(root)) continue;
+    const stack = [[root, 0]];
+    state.set(root, 1);
+    while (stack.length) {{
+      const frame = stack[stack.length - 1], succ = out.get(frame[0]);
+      if (frame[1] < succ.length) {{
+        const next = succ[frame[1]++];
+        if (!state.has(next)) {{ state.set(next, 1); stack.push([next, 0]); }}
+        continue;
+      }}
+      state.set(frame[0], 2);
+      order.push(frame[0]);
+      stack.pop();
+    }}
+  }}
+  order.reverse();
+  const rank = new Map(order.map((u, i) => [u, i])), layer = new Map();
+  for (const u of order) {{
+    let l = 0;
+    for (const p of inc.get(u)) if (rank.get(p) < rank.get(u)) l = Math.max(l, layer.get(p) + 1);
+    layer.set(u, l);
+  }}
+
+  // Order each layer by the mean position of its predecessors
+  const layers = [];
+  for (const u of order) (layers[layer.get(u)] = layers[layer.get(u)] || []).push(u);
+  const pos = new Map();
+  layers.forEach(nodes => {{
+    const key = u => {{
+      const ps = inc.get(u).filter(p => pos.has(p));
+      return ps.length ? ps.reduce((a, p) => a + pos.get(p), 0) / ps.length : u;
+    }};
+    nodes.sort((a, b) => key(a) - key(b));
+    nodes.forEach((u, i) => pos.set(u, i));
+  }});
+
+  const svg = document.getElementById('view'), ns = 'http://www.w3.org/2000/svg';
+  const height = layers.reduce((most, l) => Math.max(most, l.length), 0) * (H + GAP_Y) + GAP_Y;
+  svg.setAttribute('width', layers.length * (W + GAP_X) + GAP_X);
+  svg.setAttribute('height', height);
+  svg.innerHTML = '';
+  const x = u => GAP_X / 2 + layer.get(u) * (W + GAP_X), y = u => GAP_Y + pos.get(u) * (H + GAP_Y);
+  edgeCounts.forEach((c, key) => {{
+    const s = Math.floor(key / N), d = key % N, path = document.createElementNS(ns, 'path');
+    const x1 = x(s) + W, y1 = y(s) + H / 2, x2 = x(d), y2 = y(d) + H / 2, mid = (x1 + x2) / 2;
+    path.setAttribute('d', `M${{x1}},${{y1}} C${{mid}},${{y1}} ${{mid}},${{y2}} ${{x2}},${{y2}}`);
+    path.setAttribute('stroke-width', 1 + Math.log2(c));
+    if (layer.get(d) <= layer.get(s)) path.setAttribute('stroke-dasharray', '4 3');
+    const title = document.createElementNS(ns, 'title');
+    title.textContent = c + (c > 1 ? ' edges' : ' edge');
+    path.appendChild(title);
+    svg.appendChild(path);
+  }});
+  for (const u of units) {{
+    const item = ITEMS[u], g = document.createElementNS(ns, 'g');
+    const rect = document.createElementNS(ns, 'rect'), text = document.createElementNS(ns, 'text');
+    const title = document.createElementNS(ns, 'title');
+    rect.setAttribute('x', x(u)); rect.setAttribute('y', y(u));
+    rect.setAttribute('width', W); rect.setAttribute('height', H);
+    rect.setAttribute('rx', item[2] === 0 ? 12 : 2);
+    rect.setAttribute('fill', color(item));
+    text.setAttribute('x', x(u) + 6); text.setAttribute('y', y(u) + H / 2 + 4);
+    const textLabel = label(u);
+    text.textContent = textLabel.length > 30 ? textLabel.slice(0, 29) + '\\u2026' : textLabel;
+    title.textContent = description(u);
+    g.appendChild(rect); g.appendChild(text); g.appendChild(title);
+    g.addEventListener('click', event => {{
+      if (event.shiftKey) {{
+        if (item[1] >= 0) {{ expanded[item[1]] = 0; render(); }}
+      }} else if (item[2] === 1) {{
+        expanded[u] = 1; render();
+      }}
+    }});
+    svg.appendChild(g);
+  }}
+}}
+
+setDepth(DATA.depth);
+</script>
+</body>
+</html>
+"""
+
+
+# Writes a self-contained HTML view of the tree, which lays out the graph in the browser and expands or collapses
+# namespaces on click. Namespaces up to depth start expanded
+def write_html(tree, path, depth, title):
+    legend = ''.join('<span><span class="swatch" style="background: {}"></span> {}</span>'.format(color, name)
+                     for (_, color), name in zip(ROLE_COLORS, ["NMS input", "Graph input", "Graph output"]))
+    data = {
+        'items': tree.items,
+        'edges': [[src, dst, count] for (src, dst), count in tree.edges.items()],
+        'annotations': tree.annotations,
+        'nms': {tree.ids[name]: role for name, role in tree.nms_roles.items()},
+        'depth': depth,
+        'roleColors': ROLE_COLORS,
+        'nodeColor': NODE_COLOR,
+        'namespaceColor': NAMESPACE_COLOR,
+    }
+    nodes = sum(item[3] for item in tree.items if item[1] < 0)
+    # "</" is escaped so that no name can close the script element
+    payload = json.dumps(data, separators=(',', ':')).replace('</', '<\\/')
+    with open(path, "w") as f:
+        f.write(_HTML_TEMPLATE.format(title=html.escape(title), nodes=nodes, legend=legend, data=payload))
+
+
+# Returns shape annotations of the nodes whose output shapes are statically known, inferred with the given input
+# dimensions, or else the input nodes' own shapes
+def shape_annotations(graph_chars, input_dims=None):
+    input_shapes = None
+    if input_dims is not None:
+        input_shapes = {graph_chars.input_node_names[0]: list(input_dims)}
+    inference = shape_inference.ShapeInference(graph_chars, input_shapes=input_shapes)
+    annotations = {}
+    for name, shapes in inference.shapes.items():
+        known = [shape for shape in shapes if shape is not None]
+        if known:
+            annotations[name] = {'shape': ', '.join(str(shape) for shape in shapes)}
+    return annotations
+
+
+# Imports the graph into Tensorflow, writes it as a TensorBoard event file and launches TensorBoard
+def launch_tensorboard(args):
+    import tensorflow as tf
 
     with tf.compat.v1.gfile.GFile(args.input, "rb") as f:
         graph_def = tf.compat.v1.GraphDef()
@@ -18,3 +500,32 @@ if __name__ == '__main__':
         writer = tf.compat.v1.summary.FileWriter(args.out_dir, sess.graph)
 
     subprocess.run(["tensorboard", "--logdir", str(args.out_dir), "--port", str(args.port)])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    setup_args(parser)
+    args = parser.parse_args()
+
+    if args.format == "tensorboard":
+        launch_tensorboard(args)
+        exit(0)
+
+    model = model_loader.load_model(args.input, structure_only=True)
+    graph_chars = model.graph_chars
+
+    annotations = {}
+    if args.shapes:
+        annotations = shape_annotations(graph_chars, args.input_dims)
+    if args.annotations:
+        with open(args.annotations) as f:
+            for name, values in json.load(f).items():
+                annotations.setdefault(name, {}).update(values)
+
+    tree = NamespaceTree(graph_chars, max_depth=args.max_depth, annotations=annotations)
+    output = args.output or os.path.splitext(args.input)[0] + "." + args.format
+    if args.format == "dot":
+        write_dot(tree, output, args.depth)
+    else:
+        write_html(tree, output, args.depth, os.path.basename(args.input))
+    print("Wrote {} ({} items, {} edges)".format(output, len(tree.items), len(tree.edges)))
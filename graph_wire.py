@@ -0,0 +1,217 @@
+# Scanning of serialized GraphDefs at the protobuf wire-format level, to read the structure of a graph (node names, ops,
+# inputs and attributes) without decoding its weights. Large tensor payloads are skipped over and located by offset in
+# the serialized buffer, from which they can be read back when needed.
+
+# Tensor payloads of at least this many bytes are left out of the structure. Small integer tensors, which static
+# shape inference reads (shape_inference.MAX_CONST_ELEMENTS), and scalars are always kept
+LAZY_PAYLOAD_BYTES = 1024
+
+_WIRE_VARINT = 0
+_WIRE_FIXED64 = 1
+_WIRE_LENGTH = 2
+_WIRE_FIXED32 = 5
+
+# Field numbers of tensorflow/core/framework/*.proto
+_GRAPH_NODE = 1
+_NODE_NAME = 1
+_NODE_ATTR = 5
+_ENTRY_KEY = 1
+_ENTRY_VALUE = 2
+_ATTR_TENSOR = 8
+TENSOR_CONTENT = 4
+
+# TensorProto fields holding values: every field but dtype, tensor_shape and version_number
+_TENSOR_SHAPE_FIELDS = {1, 2, 3}
+
+
+def _read_varint(buffer, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _encode_varint(value):
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+# Returns the encoding of a length-delimited field
+def _length_field(number, payload):
+    return _encode_varint((number << 3) | _WIRE_LENGTH) + _encode_varint(len(payload)) + payload
+
+
+# Decodes the field starting at buffer[pos], within a message ending at end, as a (number, wire type, field start, value
+# start, value end) tuple. The value of a length-delimited field is its payload, without the length prefix
+def _next_field(buffer, pos, end):
+    field_start = pos
+    key, pos = _read_varint(buffer, pos)
+    number, wire_type = key >> 3, key & 7
+    value_start = pos
+    if wire_type == _WIRE_LENGTH:
+        length, value_start = _read_varint(buffer, pos)
+        pos = value_start + length
+    elif wire_type == _WIRE_VARINT:
+        _, pos = _read_varint(buffer, pos)
+    elif wire_type == _WIRE_FIXED64:
+        pos += 8
+    elif wire_type == _WIRE_FIXED32:
+        pos += 4
+    else:
+        raise ValueError("Unsupported wire type {} at offset {}".format(wire_type, field_start))
+    if pos > end:
+        raise ValueError("Truncated field {} at offset {}".format(number, field_start))
+    return number, wire_type, field_start, value_start, pos
+
+
+# Yields the fields of the message serialized in buffer[start:end] (see _next_field)
+def _fields(buffer, start, end):
+    pos = start
+    while pos < end:
+        field = _next_field(buffer, pos, end)
+        pos = field[4]
+        yield field
+
+
+# The structure of a serialized GraphDef
+# data: The serialized GraphDef with the large tensor payloads left out. Their tensors keep their dtype and shape
+# payloads: Dictionary that maps node names to dictionaries that map attribute names to dictionaries that map the
+#   TensorProto field numbers left out to the (offset, length) of their payload in the original buffer
+# node_spans: Dictionary that maps the names of the nodes with payloads left out to the (offset, length) of their
+#   serialized NodeDef in the original buffer
+class GraphStructure:
+
+    def __init__(self, data, payloads, node_spans):
+        self.data = data
+        self.payloads = payloads
+        self.node_spans = node_spans
+
+    # Bytes of the payloads left out
+    @property
+    def lazy_bytes(self):
+        return sum(length for attrs in self.payloads.values() for fields in attrs.values()
+                   for _, length in fields.values())
+
+
+# Scans a serialized GraphDef, held in any object supporting indexing and slicing by bytes (bytes, mmap, memoryview),
+# and returns its GraphStructure. Only NodeDefs of at least min_payload bytes are decoded; runs of the others are copied
+# whole
+def scan_graph_def(buffer, min_payload=LAZY_PAYLOAD_BYTES):
+    pieces = []
+    payloads = {}
+    node_spans = {}
+    node_key = (_GRAPH_NODE << 3) | _WIRE_LENGTH
+    # Start of the run of fields copied unchanged
+    kept = 0
+    pos = 0
+    end = len(buffer)
+    while pos < end:
+        field_start = pos
+        if buffer[pos] != node_key:
+            # Other GraphDef fields (versions, library) are copied
+            pos = _next_field(buffer, pos, end)[4]
+            continue
+        # Inlined _read_varint of the node length, which is most of the scan for graphs without large tensors
+        length = 0
+        shift = 0
+        pos += 1
+        while True:
+            byte = buffer[pos]
+            pos += 1
+            length |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        value_start = pos
+        pos += length
+        if length < min_payload:
+            continue
+        name, node, node_payloads = _strip_node(buffer, value_start, pos, min_payload)
+        if node_payloads:
+            payloads[name] = node_payloads
+            node_spans[name] = (value_start, length)
+            pieces.append(buffer[kept:field_start])
+            pieces.append(_length_field(_GRAPH_NODE, node))
+            kept = pos
+    if pos > end:
+        raise ValueError("Truncated GraphDef")
+    pieces.append(buffer[kept:end])
+    return GraphStructure(b''.join(pieces), payloads, node_spans)
+
+
+# Returns the name of the NodeDef in buffer[start:end], its serialization without the large payloads of its tensor
+# attributes, and the payloads left out, by attribute name
+def _strip_node(buffer, start, end, min_payload):
+    name = None
+    pieces = []
+    payloads = {}
+    for number, wire_type, field_start, value_start, value_end in _fields(buffer, start, end):
+        if number == _NODE_NAME and wire_type == _WIRE_LENGTH:
+            name = bytes(buffer[value_start:value_end]).decode('utf-8')
+        elif number == _NODE_ATTR and wire_type == _WIRE_LENGTH and value_end - value_start >= min_payload:
+            key, entry, fields = _strip_attr_entry(buffer, value_start, value_end, min_payload)
+            if fields:
+                payloads[key] = fields
+                pieces.append(_length_field(_NODE_ATTR, entry))
+                continue
+        pieces.append(buffer[field_start:value_end])
+    return name, b''.join(pieces), payloads
+
+
+# Returns the key of the NodeDef.AttrEntry in buffer[start:end], its serialization without the large payloads of its
+# tensor, and the payloads left out, by TensorProto field number
+def _strip_attr_entry(buffer, start, end, min_payload):
+    key = None
+    pieces = []
+    fields = {}
+    for number, wire_type, field_start, value_start, value_end in _fields(buffer, start, end):
+        if number == _ENTRY_KEY and wire_type == _WIRE_LENGTH:
+            key = bytes(buffer[value_start:value_end]).decode('utf-8')
+        elif number == _ENTRY_VALUE and wire_type == _WIRE_LENGTH:
+            value, fields = _strip_attr_value(buffer, value_start, value_end, min_payload)
+            if fields:
+                pieces.append(_length_field(_ENTRY_VALUE, value))
+                continue
+        pieces.append(buffer[field_start:value_end])
+    return key, b''.join(pieces), fields
+
+
+def _strip_attr_value(buffer, start, end, min_payload):
+    pieces = []
+    fields = {}
+    for number, wire_type, field_start, value_start, value_end in _fields(buffer, start, end):
+        if number == _ATTR_TENSOR and wire_type == _WIRE_LENGTH:
+            tensor, fields = _strip_tensor(buffer, value_start, value_end, min_payload)
+            if fields:
+                pieces.append(_length_field(_ATTR_TENSOR, tensor))
+                continue
+        pieces.append(buffer[field_start:value_end])
+    return b''.join(pieces), fields
+
+
+def _strip_tensor(buffer, start, end, min_payload):
+    pieces = []
+    fields = {}
+    for number, wire_type, field_start, value_start, value_end in _fields(buffer, start, end):
+        if (number not in _TENSOR_SHAPE_FIELDS and wire_type == _WIRE_LENGTH
+                and value_end - value_start >= min_payload):
+            fields[number] = (value_start, value_end - value_start)
+        else:
+            pieces.append(buffer[field_start:value_end])
+    return b''.join(pieces), fields
+
+
+# Returns a serialized GraphDef holding only the NodeDef serialized in buffer[offset:offset + length], to parse a single
+# node of a larger graph
+def single_node_graph_def(buffer, span):
+    offset, length = span
+    return _length_field(_GRAPH_NODE, bytes(buffer[offset:offset + length]))
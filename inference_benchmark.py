@@ -0,0 +1,340 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import calibration_data
+import converter_util
+import model_loader
+import stage_trace
+
+# Latency percentiles reported for every artifact
+PERCENTILES = (50, 95, 99)
+
+# Seconds a runtime may take to load and benchmark an artifact before it is terminated
+DEFAULT_BENCHMARK_TIMEOUT = 600
+
+
+def setup_args(parser):
+    parser.add_argument("--input", "-i", help="Path to the frozen graph the artifacts were converted from. It is "
+                                              "benchmarked as the baseline, and determines the input dimensions",
+                        required=True, type=str)
+    parser.add_argument("--input_dims", "-id", help="Dimensions of input tensor", type=int, nargs='+')
+    parser.add_argument("--output_dir", "-o", help="Output dir and filename the artifacts were converted to. The "
+                                                   "artifacts found there are benchmarked", default="./converted_model")
+    parser.add_argument("--tflite", help="Path of the .tflite model. Defaults to <output_dir>.tflite")
+    parser.add_argument("--openvino_xml", help="Path of the OpenVINO IR .xml file. Defaults to the IR the OpenVINO "
+                                               "converter writes for the input")
+    parser.add_argument("--openvino_dir", "-ovdir", help="Directory of openvino installation, to import the inference "
+                                                         "engine from when it is not importable already")
+    parser.add_argument("--no_baseline", help="Do not benchmark the frozen graph", action='store_true')
+    parser.add_argument("--threads", help="Number of CPU threads of every runtime", type=int, default=1)
+    parser.add_argument("--warmup", help="Number of untimed warm-up inferences", type=int, default=10)
+    parser.add_argument("--iterations", help="Number of timed inferences", type=int, default=100)
+    add_timeout_args(parser)
+    parser.add_argument("--input_data", help="Directory of images (or .npy arrays) to run inference on. Defaults to "
+                                             "random images")
+    parser.add_argument("--json", help="Write the results to this JSON file, rather than printing them")
+
+
+def add_timeout_args(parser):
+    parser.add_argument("--benchmark_timeout", help="Seconds a runtime may take to load and benchmark an artifact "
+                                                    "before it is terminated", type=float,
+                        default=DEFAULT_BENCHMARK_TIMEOUT)
+
+
+# Returns the artifacts to benchmark, as (name, runtime, path) tuples, in the order they run in
+def find_artifacts(args):
+    artifacts = []
+    if not args.no_baseline:
+        artifacts.append(('baseline', 'tensorflow', args.input))
+
+    tflite = args.tflite or args.output_dir + ".tflite"
+    if args.tflite or os.path.isfile(tflite):
+        artifacts.append(('tflite', 'tflite', tflite))
+
+    # The OpenVINO converter names the IR after the input model, in the output directory
+    xml = args.openvino_xml or os.path.join(os.path.dirname(args.output_dir),
+                                            os.path.splitext(os.path.basename(args.input))[0] + ".xml")
+    if args.openvino_xml or os.path.isfile(xml):
+        artifacts.append(('openvino', 'openvino', xml))
+    return artifacts
+
+
+# Returns input arrays shaped like dims, of the numpy type dtype: the samples in input_data (at most count of them),
+# or a random image
+def make_inputs(dims, dtype, input_data=None, count=16):
+    import numpy as np
+
+    if input_data is None:
+        image = np.random.RandomState(0).randint(0, 256, size=dims)
+        return [image.astype(dtype)]
+
+    paths = calibration_data.list_samples(input_data, count)
+    if not paths:
+        raise ValueError("No input samples found in {}".format(input_data))
+    batch, height, width, channels = dims
+    spec = calibration_data.SampleSpec(height, width, channels,
+                                       calibration_data.DT_UINT8 if dtype == np.uint8 else calibration_data.DT_FLOAT,
+                                       0.0, 1.0)
+    samples = []
+    for path in paths:
+        try:
+            samples.append(calibration_data.load_sample(path, spec))
+        except Exception as e:
+            stage_trace.event("input_skipped", "Skipping input sample {}: {}".format(path, e), path=path)
+    if not samples:
+        raise ValueError("No usable input samples in {}".format(input_data))
+    return [np.stack([samples[(idx + offset) % len(samples)] for offset in range(batch)]).astype(dtype)
+            for idx in range(len(samples))]
+
+
+# Runs a model on the frozen graph with Tensorflow, as the baseline
+class TensorflowRunner:
+
+    def __init__(self, path, dims, threads, input_data, input_count=16):
+        import tensorflow as tf
+
+        model = model_loader.load_model(path)
+        graph_chars = model.graph_chars
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.compat.v1.import_graph_def(model.graph_def, name='')
+        config = tf.compat.v1.ConfigProto(intra_op_parallelism_threads=threads, inter_op_parallelism_threads=threads)
+        self.session = tf.compat.v1.Session(graph=self.graph, config=config)
+
+        input_name = graph_chars.input_node_names[0]
+        self.input_tensor = self.graph.get_tensor_by_name(input_name + ":0")
+        self.output_names = graph_chars.output_node_names
+        self.output_tensors = [self.graph.get_tensor_by_name(name + ":0") for name in self.output_names]
+        self.inputs = make_inputs(dims, self.input_tensor.dtype.as_numpy_dtype, input_data, input_count)
+
+    def run(self, data):
+        return self.session.run(self.output_tensors, feed_dict={self.input_tensor: data})
+
+    # Object detection API outputs, with 1-based classes
+    def detections(self, outputs):
+        outputs = dict(zip(self.output_names, outputs))
+        count = int(outputs['num_detections'][0])
+        return {'boxes': outputs['detection_boxes'][0][:count], 'scores': outputs['detection_scores'][0][:count],
+                'classes': outputs['detection_classes'][0][:count]}
+
+
+# Runs a .tflite model with the TFLite interpreter, from tflite_runtime if it is installed, or from Tensorflow
+class TFLiteRunner:
+
+    def __init__(self, path, dims, threads, input_data, input_count=16):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+
+        try:
+            self.interpreter = Interpreter(model_path=path, num_threads=threads)
+        except TypeError:
+            # Interpreters predating the num_threads argument
+            self.interpreter = Interpreter(model_path=path)
+            if hasattr(self.interpreter, 'set_num_threads'):
+                self.interpreter.set_num_threads(threads)
+            else:
+                stage_trace.event("threads_ignored", "This TFLite interpreter does not support setting the number "
+                                  "of threads")
+
+        details = self.interpreter.get_input_details()[0]
+        self.input_index = details['index']
+        if list(details['shape']) != list(dims):
+            self.interpreter.resize_tensor_input(self.input_index, list(dims))
+        self.interpreter.allocate_tensors()
+        self.output_details = self.interpreter.get_output_details()
+        self.inputs = make_inputs(dims, details['dtype'], input_data, input_count)
+
+    def run(self, data):
+        self.interpreter.set_tensor(self.input_index, data)
+        self.interpreter.invoke()
+        return [self.interpreter.get_tensor(output['index']) for output in self.output_details]
+
+    # TFLite_Detection_PostProcess outputs boxes, classes, scores and the number of detections, with 0-based classes
+    def detections(self, outputs):
+        import numpy as np
+
+        dequantized = []
+        for details, output in zip(self.output_details, outputs):
+            scale, zero_point = details.get('quantization', (0.0, 0))
+            if scale:
+                output = (output.astype(np.float32) - zero_point) * scale
+            dequantized.append(output)
+        boxes, classes, scores, count = dequantized[:4]
+        count = int(count.reshape(-1)[0])
+        return {'boxes': boxes[0][:count], 'scores': scores[0][:count], 'classes': classes[0][:count] + 1}
+
+
+# Runs an OpenVINO IR model with the inference engine on the CPU
+class OpenVINORunner:
+
+    def __init__(self, path, dims, threads, input_data, input_count=16, openvino_dir=None):
+        try:
+            from openvino.inference_engine import IECore
+        except ImportError:
+            openvino_dir = openvino_dir or os.getenv("INTEL_OPENVINO_DIR") or "/opt/intel/openvino"
+            sys.path.insert(1, os.path.join(openvino_dir, "python",
+                                            "python{}.{}".format(sys.version_info[0], sys.version_info[1])))
+            from openvino.inference_engine import IECore
+
+        core = IECore()
+        network = core.read_network(model=path, weights=os.path.splitext(path)[0] + ".bin")
+        inputs = network.input_info if hasattr(network, 'input_info') else network.inputs
+        self.input_name = next(iter(inputs))
+        self.network = core.load_network(network=network, device_name='CPU',
+                                         config={'CPU_THREADS_NUM': str(threads)})
+
+        # IR inputs are NCHW; inputs are generated in the NHWC order of the input dimensions and transposed
+        import numpy as np
+
+        inputs = make_inputs(dims, np.float32, input_data, input_count)
+        self.inputs = [data.transpose(0, 3, 1, 2).copy() for data in inputs]
+
+    def run(self, data):
+        return list(self.network.infer({self.input_name: data}).values())
+
+    # DetectionOutput rows of [image_id, label, confidence, xmin, ymin, xmax, ymax], ended by an image_id of -1
+    def detections(self, outputs):
+        rows = next(output for output in outputs if output.shape[-1] == 7).reshape(-1, 7)
+        rows = rows[:(rows[:, 0] < 0).argmax()] if (rows[:, 0] < 0).any() else rows
+        return {'boxes': rows[:, [4, 3, 6, 5]], 'scores': rows[:, 2], 'classes': rows[:, 1]}
+
+
+# Returns the runner of an artifact. Runners hold the input arrays to run on in inputs, and have run(data), returning
+# the list of outputs, and detections(outputs), returning the SSD detections in outputs as a dictionary of boxes
+# (N x 4 ymin, xmin, ymax, xmax, normalized), scores and 1-based classes
+# input_data: Directory of input samples, of which at most input_count are used, or None for a random image
+def create_runner(runtime, path, dims, threads, input_data, input_count=16, openvino_dir=None):
+    if runtime == 'tensorflow':
+        return TensorflowRunner(path, dims, threads, input_data, input_count)
+    if runtime == 'tflite':
+        return TFLiteRunner(path, dims, threads, input_data, input_count)
+    if runtime == 'openvino':
+        return OpenVINORunner(path, dims, threads, input_data, input_count, openvino_dir=openvino_dir)
+    raise ValueError("Unknown runtime {}".format(runtime))
+
+
+# Returns the p-th percentile of the sorted values, by the nearest-rank method
+def percentile(values, p):
+    rank = max(1, -(-len(values) * p // 100))
+    return values[min(rank, len(values)) - 1]
+
+
+# Runs warmup untimed and iterations timed inferences with runner, cycling through its inputs. Returns the latency
+# statistics in milliseconds and the throughput in inferences (images) per second
+def measure(runner, warmup, iterations, batch_size):
+    inputs = runner.inputs
+    for idx in range(warmup):
+        runner.run(inputs[idx % len(inputs)])
+
+    latencies = []
+    start = time.perf_counter()
+    for idx in range(iterations):
+        iteration_start = time.perf_counter()
+        runner.run(inputs[idx % len(inputs)])
+        latencies.append(time.perf_counter() - iteration_start)
+    total = time.perf_counter() - start
+
+    latencies = sorted(latency * 1000 for latency in latencies)
+    result = {'latency_ms': {'mean': sum(latencies) / len(latencies), 'min': latencies[0], 'max': latencies[-1]},
+              'throughput': batch_size * iterations / total}
+    for value in PERCENTILES:
+        result['latency_ms']['p{}'.format(value)] = percentile(latencies, value)
+    return result
+
+
+# Benchmarks one artifact. Runs in its own process, so that runtimes do not interfere and the peak RSS is the
+# artifact's own
+def benchmark_artifact(runtime, path, dims, args):
+    start = time.perf_counter()
+    runner = create_runner(runtime, path, dims, args.threads, args.input_data, openvino_dir=args.openvino_dir)
+    result = {'runtime': runtime, 'path': path, 'load_seconds': time.perf_counter() - start}
+    result.update(measure(runner, args.warmup, args.iterations, dims[0]))
+    result['peak_rss_bytes'] = stage_trace.peak_rss()
+    return result
+
+
+def _isolated_worker(connection, function, function_args):
+    try:
+        result = (function(*function_args), None)
+    except Exception as e:
+        result = (None, "{}: {}".format(type(e).__name__, e))
+    connection.send(result)
+    connection.close()
+
+
+# Runs function(*function_args) in a fresh process and returns its result. Raises a RuntimeError if it fails, or if it
+# has not returned after timeout seconds, in which case the process is terminated. The process is spawned rather than
+# forked, so no runtime state is inherited between runs
+def run_isolated(function, *function_args, timeout=None):
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_isolated_worker, args=(sender, function, function_args))
+    process.start()
+    sender.close()
+    try:
+        if receiver.poll(timeout):
+            result, error = receiver.recv()
+        else:
+            process.terminate()
+            result, error = None, "Timed out after {:g}s".format(timeout)
+    except EOFError:
+        process.join()
+        result, error = None, "Process exited with status {}".format(process.exitcode)
+    process.join()
+    receiver.close()
+    if error is not None:
+        raise RuntimeError(error)
+    return result
+
+
+# Benchmarks each artifact in a fresh process. Returns a dictionary that maps artifact names to their results
+def run_benchmarks(artifacts, dims, args):
+    results = {}
+    for name, runtime, path in artifacts:
+        with stage_trace.stage("benchmark/" + name):
+            try:
+                results[name] = run_isolated(benchmark_artifact, runtime, path, dims, args,
+                                             timeout=args.benchmark_timeout)
+            except RuntimeError as e:
+                results[name] = {'runtime': runtime, 'path': path, 'error': str(e)}
+        if 'error' in results[name]:
+            stage_trace.event("benchmark_failed", "{}: {}".format(name, results[name]['error']), artifact=name)
+        else:
+            latency = results[name]['latency_ms']
+            stage_trace.event("benchmarked", "{}: p50 {:.2f} ms, p95 {:.2f} ms, p99 {:.2f} ms, {:.1f} inferences/s"
+                              .format(name, latency['p50'], latency['p95'], latency['p99'],
+                                      results[name]['throughput']), artifact=name)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    setup_args(parser)
+    args = parser.parse_args()
+
+    model = model_loader.load_model(args.input)
+    graph_chars = model.graph_chars
+    input_dims = converter_util.get_input_dims(args, graph_chars.input_nodes[0], graph_chars=graph_chars)
+    dims = [int(dim) for dim in input_dims]
+    model.close()
+
+    artifacts = find_artifacts(args)
+    if not artifacts:
+        stage_trace.event("error", "Error: No artifacts to benchmark")
+        exit(1)
+
+    results = {'input_dims': dims, 'threads': args.threads, 'warmup': args.warmup, 'iterations': args.iterations,
+               'input_data': args.input_data, 'artifacts': run_benchmarks(artifacts, dims, args)}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if any('error' in result for result in results['artifacts'].values()):
+        exit(1)
@@ -0,0 +1,225 @@
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import sys
+import threading
+import traceback
+
+import stage_trace
+
+# Number of conversions a Model Optimizer process runs before it is replaced, to bound its memory growth
+DEFAULT_MAX_JOBS = 20
+
+
+# Returns the Model Optimizer directory of an OpenVINO installation
+def model_optimizer_dir(openvino_dir):
+    return os.path.join(openvino_dir, "deployment_tools", "model_optimizer")
+
+
+# Body of a Model Optimizer process: imports mo once, then runs each argument list received on connection as a
+# conversion, and answers with its (exit code, error) pair. sys.argv is only rewritten in this process
+def _worker_main(connection, openvino_dir):
+    try:
+        sys.path.insert(1, model_optimizer_dir(openvino_dir))
+        from mo.main import main
+        from mo.utils.cli_parser import get_tf_cli_parser
+    except Exception:
+        connection.send(('error', traceback.format_exc()))
+        return
+    connection.send(('ready', None))
+
+    while True:
+        try:
+            argv = connection.recv()
+        except EOFError:
+            break
+        if argv is None:
+            break
+        sys.argv = [''] + list(argv)
+        try:
+            code, error = main(get_tf_cli_parser(), 'tf'), None
+        except SystemExit as e:
+            code, error = e.code, None
+        except Exception:
+            code, error = 1, traceback.format_exc()
+        connection.send((code or 0, error))
+
+
+# A long-lived Model Optimizer process, taking conversions over a pipe so that mo is only imported once. The process is
+# started by start() or on the first conversion, and replaced after max_jobs conversions
+class ModelOptimizerWorker:
+
+    def __init__(self, openvino_dir, max_jobs=DEFAULT_MAX_JOBS):
+        self.openvino_dir = openvino_dir
+        self.max_jobs = max_jobs
+        self.jobs = 0
+        # Process the worker belongs to. Forked children inherit the object, but must not use its pipe
+        self.owner_pid = os.getpid()
+        self._process = None
+        self._connection = None
+
+    def _start(self):
+        # Spawned rather than forked, so the worker does not inherit Tensorflow or other frameworks of the caller
+        context = multiprocessing.get_context('spawn')
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(target=_worker_main, args=(child_connection, self.openvino_dir),
+                                        name="model-optimizer", daemon=True)
+        with stage_trace.stage("openvino/model_optimizer_start"):
+            self._process.start()
+            child_connection.close()
+            status, error = self._receive()
+        if status != 'ready':
+            self.close()
+            raise RuntimeError("Could not import the Model Optimizer from {}:\n{}"
+                               .format(model_optimizer_dir(self.openvino_dir), error))
+        self.jobs = 0
+
+    def _receive(self):
+        try:
+            return self._connection.recv()
+        except EOFError:
+            self._process.join(5)
+            exitcode = self._process.exitcode
+            self._connection.close()
+            self._process = None
+            self._connection = None
+            raise RuntimeError("Model Optimizer process exited with status {}".format(exitcode))
+
+    # Starts the process, importing mo, unless it is already running. Raises RuntimeError if mo cannot be imported
+    def start(self):
+        if self._process is None or not self._process.is_alive():
+            self._start()
+
+    # Runs the Model Optimizer with the command line arguments argv, and returns its (exit code, error) pair
+    def run(self, argv):
+        if self._process is not None and self.jobs >= self.max_jobs:
+            self.close()
+        self.start()
+        self.jobs += 1
+        self._connection.send(list(argv))
+        return self._receive()
+
+    def close(self):
+        if self._process is not None:
+            try:
+                self._connection.send(None)
+            except (OSError, ValueError):
+                pass
+            self._process.join(5)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join()
+            self._connection.close()
+        self._process = None
+        self._connection = None
+
+
+# Model Optimizer workers shared by the processes of a batch over a local socket. The service is started in the parent
+# process before conversion workers are forked; the workers inherit its address and send their conversions to it.
+# Each connection carries one conversion, which runs on the next idle ModelOptimizerWorker. The workers are started in
+# parallel before the service returns, so no conversion waits for mo to be imported
+# openvino_dir: OpenVINO installation the workers import mo from
+# workers: Number of ModelOptimizerWorkers, i.e. of conversions that run concurrently
+class ModelOptimizerService:
+
+    def __init__(self, openvino_dir, workers=1, max_jobs=DEFAULT_MAX_JOBS):
+        self.openvino_dir = openvino_dir
+        self._idle = queue.Queue()
+        # Joined before returning, since conversion workers are forked from this process next
+        workers = [ModelOptimizerWorker(openvino_dir, max_jobs=max_jobs) for _ in range(max(1, workers))]
+        threads = [threading.Thread(target=self._prestart, args=(worker,), name="model-optimizer-start")
+                   for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._authkey = os.urandom(16)
+        self._listener = multiprocessing.connection.Listener(authkey=self._authkey)
+        self.address = self._listener.address
+        self._thread = threading.Thread(target=self._accept, name="model-optimizer-service", daemon=True)
+        self._thread.start()
+
+    # Starts worker, then makes it idle. A worker that cannot import mo is made idle anyway, and reports the error to
+    # the conversion it is given
+    def _prestart(self, worker):
+        try:
+            worker.start()
+        except RuntimeError:
+            pass
+        self._idle.put(worker)
+
+    # Serves the connections of the listener until close() closes it. The listener is held here, since close() unsets
+    # it first
+    def _accept(self):
+        listener = self._listener
+        while True:
+            try:
+                connection = listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                if self._listener is None:
+                    return
+                continue
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        with connection:
+            try:
+                argv = connection.recv()
+            except EOFError:
+                return
+            worker = self._idle.get()
+            try:
+                result = worker.run(argv)
+            except Exception as e:
+                result = (1, str(e))
+            finally:
+                self._idle.put(worker)
+            connection.send(result)
+
+    # Makes the conversions of this process, and of the processes it forks from now on, use the service
+    def install(self):
+        global _SERVICE
+        _SERVICE = (self.address, self._authkey, self.openvino_dir)
+
+    def close(self):
+        global _SERVICE
+        if _SERVICE is not None and _SERVICE[0] == self.address:
+            _SERVICE = None
+        listener, self._listener = self._listener, None
+        listener.close()
+        while not self._idle.empty():
+            self._idle.get().close()
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# (address, authkey, openvino_dir) of the installed ModelOptimizerService, if any
+_SERVICE = None
+
+# ModelOptimizerWorker of this process, used when no service is installed
+_WORKER = None
+
+
+# Runs the Model Optimizer with the command line arguments argv, on the installed service if it serves openvino_dir,
+# or else on a worker of this process kept for later conversions. Returns the (exit code, error) pair of the conversion
+def run_model_optimizer(openvino_dir, argv, max_jobs=DEFAULT_MAX_JOBS):
+    global _WORKER
+
+    if _SERVICE is not None and _SERVICE[2] == openvino_dir:
+        address, authkey, _ = _SERVICE
+        with multiprocessing.connection.Client(address, authkey=authkey) as connection:
+            connection.send(list(argv))
+            return connection.recv()
+
+    if _WORKER is None or _WORKER.owner_pid != os.getpid() or _WORKER.openvino_dir != openvino_dir:
+        if _WORKER is not None and _WORKER.owner_pid == os.getpid():
+            _WORKER.close()
+        _WORKER = ModelOptimizerWorker(openvino_dir, max_jobs=max_jobs)
+    _WORKER.max_jobs = max_jobs
+    return _WORKER.run(argv)
@@ -0,0 +1,192 @@
+import hashlib
+import mmap
+
+import converter_util
+import graph_wire
+
+
+# Returns the GraphDef message class: Tensorflow's if it is installed, otherwise the wire-compatible protobuf-only one
+def graph_def_class():
+    try:
+        from tensorflow.core.framework.graph_pb2 import GraphDef
+    except ImportError:
+        from graph_proto import GraphDef
+    return GraphDef
+
+
+# Parses a serialized GraphDef from any bytes-like object, without copying it where the protobuf runtime allows
+def parse_graph_def(buffer):
+    graph_def = graph_def_class()()
+    try:
+        graph_def.ParseFromString(memoryview(buffer))
+    except TypeError:
+        # Older protobuf runtimes only accept bytes
+        graph_def.ParseFromString(bytes(buffer))
+    return graph_def
+
+
+# Dtypes of the tensors LoadedModel.array can view, as numpy dtype strings (tensorflow/core/framework/types.proto)
+NUMPY_DTYPES = {1: '<f4', 2: '<f8', 3: '<i4', 4: 'u1', 5: '<i2', 6: 'i1', 9: '<i8', 10: '?', 17: '<u2', 19: '<f2'}
+
+# Dtypes of Consts that hold model parameters (weights, biases, batch norm statistics), rather than shape arithmetic:
+# float, double, uint8, int8 and half
+PARAMETER_DTYPES = {1, 2, 4, 6, 19}
+
+# TensorProto field holding the values of each dtype, when they are not in tensor_content
+_VALUE_FIELDS = {1: 'float_val', 2: 'double_val', 3: 'int_val', 4: 'int_val', 5: 'int_val', 6: 'int_val',
+                 9: 'int64_val', 10: 'bool_val', 17: 'int_val', 19: 'half_val'}
+
+
+# A frozen graph loaded once and shared by every backend of a conversion run. The file is memory-mapped rather than
+# read, so the serialized bytes are backed by the page cache instead of a private copy. Properties:
+# path: Path of the frozen graph
+# buffer: Read-only memory map of the file
+# graph_def: The parsed GraphDef. Backends must not modify it; use copy_graph_def() to get a private copy
+# structure: The GraphDef analyses run on: graph_def itself, or with structure_only, a GraphDef decoded from the wire
+#   format without the large tensor payloads (see graph_wire), whose tensors keep their dtype and shape. It takes a
+#   small fraction of the memory of graph_def, which is then only parsed if something reads it
+# graph_chars: GraphCharacteristics of structure, computed on first use
+# fingerprint: Hex digest of the structure of the graph (see structure_fingerprint), computed on first use
+# Weights are read through tensor(), tensor_content() and array(), from the memory map when they were left out.
+class LoadedModel:
+
+    def __init__(self, path, structure_only=False):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            self.buffer = b''
+        self._payloads = {}
+        self._node_spans = {}
+        if structure_only:
+            if hasattr(self.buffer, 'madvise'):
+                # The scan jumps over the payloads; reading ahead of every node would page most of them in anyway
+                self.buffer.madvise(mmap.MADV_RANDOM)
+            structure = graph_wire.scan_graph_def(self.buffer)
+            self.structure = parse_graph_def(structure.data)
+            self._payloads = structure.payloads
+            self._node_spans = structure.node_spans
+            self._graph_def = None
+        else:
+            self._graph_def = self.structure = parse_graph_def(self.buffer)
+        self._graph_chars = None
+        self._fingerprint = None
+
+    @property
+    def graph_def(self):
+        if self._graph_def is None:
+            self._graph_def = parse_graph_def(self.buffer)
+        return self._graph_def
+
+    @property
+    def graph_chars(self):
+        if self._graph_chars is None:
+            self._graph_chars = converter_util.GraphCharacteristics(self.structure)
+        return self._graph_chars
+
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = structure_fingerprint(self)
+        return self._fingerprint
+
+    # Whether the tensor attribute attr of node name holds model parameters, whose values the fingerprint leaves out
+    def is_parameter(self, name, attr='value'):
+        node = self.graph_chars.nodes_by_name.get(name)
+        return (node is not None and node.op == 'Const' and attr == 'value'
+                and node.attr[attr].tensor.dtype in PARAMETER_DTYPES)
+
+    # Returns a private copy of the GraphDef, for backends that rewrite the graph in place
+    def copy_graph_def(self):
+        graph_def = graph_def_class()()
+        graph_def.CopyFrom(self.graph_def)
+        return graph_def
+
+    # Returns the complete TensorProto of the tensor attribute attr of node name, decoding only that node
+    def tensor(self, name, attr='value'):
+        span = self._node_spans.get(name)
+        if span is None:
+            node = self.graph_chars.nodes_by_name[name]
+        else:
+            node = parse_graph_def(graph_wire.single_node_graph_def(self.buffer, span)).node[0]
+        return node.attr[attr].tensor
+
+    # Returns the tensor_content of the tensor attribute attr of node name as a read-only memoryview of the file where
+    # it was left out of the structure, without copying it, or else as bytes. Views must be released before close()
+    def tensor_content(self, name, attr='value'):
+        fields = self._payloads.get(name, {}).get(attr, {})
+        if graph_wire.TENSOR_CONTENT in fields:
+            offset, length = fields[graph_wire.TENSOR_CONTENT]
+            return memoryview(self.buffer)[offset:offset + length]
+        return self.tensor(name, attr).tensor_content
+
+    # Returns the value of the tensor attribute attr of node name as a numpy array, which is a read-only view of the
+    # file when its tensor_content was left out of the structure
+    def array(self, name, attr='value'):
+        import numpy as np
+
+        structure_tensor = self.graph_chars.nodes_by_name[name].attr[attr].tensor
+        if structure_tensor.dtype not in NUMPY_DTYPES:
+            raise ValueError("Cannot view {} tensors of dtype {} as arrays".format(name, structure_tensor.dtype))
+        dtype = np.dtype(NUMPY_DTYPES[structure_tensor.dtype])
+        shape = [dim.size for dim in structure_tensor.tensor_shape.dim]
+
+        content = self.tensor_content(name, attr)
+        if len(content):
+            return np.frombuffer(content, dtype=dtype).reshape(shape)
+        tensor = self.tensor(name, attr)
+        values = getattr(tensor, _VALUE_FIELDS[tensor.dtype])
+        if tensor.dtype == 19:
+            values = np.array(values, dtype=np.uint16).view(dtype)
+        values = np.array(values, dtype=dtype)
+        count = int(np.prod(shape))
+        if values.size == count:
+            return values.reshape(shape)
+        # Tensors repeating their last value are serialized with the value once
+        return np.concatenate([values, np.full(count - values.size, values[-1] if values.size else 0, dtype=dtype)]
+                              ).reshape(shape)
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Returns a hex digest of the structure of the graph of model: node names, ops, inputs, devices and attributes, with the
+# values of parameter Consts left out (their dtype and shape are kept). Retrained versions of a graph, whose weights
+# differ, share it. Other tensors left out of a structure-only model are read back, so the digest does not depend on how
+# the model was loaded
+def structure_fingerprint(model):
+    hasher = hashlib.sha256()
+    for node in model.structure.node:
+        payloads = model._payloads.get(node.name)
+        if node.op == 'Const' and node.attr['value'].tensor.dtype in PARAMETER_DTYPES:
+            tensor = node.attr['value'].tensor
+            hasher.update('\0'.join([node.name, node.op, node.device] + list(node.input)).encode('utf-8'))
+            hasher.update(b'%d\1' % tensor.dtype + tensor.tensor_shape.SerializeToString(deterministic=True))
+            for key in sorted(node.attr):
+                if key != 'value':
+                    hasher.update(key.encode('utf-8') + b'\2' + node.attr[key].SerializeToString(deterministic=True))
+        elif payloads:
+            complete = type(node)()
+            complete.CopyFrom(node)
+            for key in payloads:
+                complete.attr[key].tensor.CopyFrom(model.tensor(node.name, key))
+            hasher.update(complete.SerializeToString(deterministic=True))
+        else:
+            hasher.update(node.SerializeToString(deterministic=True))
+        hasher.update(b'\3')
+    return hasher.hexdigest()
+
+
+# Loads the frozen graph at path. With structure_only, analyses skip the weights (see LoadedModel.structure)
+def load_model(path, structure_only=False):
+    return LoadedModel(path, structure_only=structure_only)
@@ -0,0 +1,433 @@
+import argparse
+import json
+import math
+import struct
+
+import graph_optimizer
+import model_loader
+import shape_inference
+import stage_trace
+
+# Tensorflow DataType enum values (tensorflow/core/framework/types.proto)
+DT_FLOAT = 1
+DT_DOUBLE = 2
+DT_UINT8 = 4
+DT_INT8 = 6
+DT_HALF = 19
+
+# Bytes per element of the dtypes of interface tensors and parameters
+DTYPE_SIZES = {DT_FLOAT: 4, DT_DOUBLE: 8, shape_inference.DT_INT32: 4, DT_UINT8: 1, 5: 2, DT_INT8: 1,
+               shape_inference.DT_INT64: 8, DT_HALF: 2}
+
+# Dtypes of Consts that hold model parameters (weights, biases, batch norm statistics), rather than shape arithmetic
+PARAMETER_DTYPES = model_loader.PARAMETER_DTYPES
+
+# On-chip memory an Edge TPU can cache parameters in, in MiB
+DEFAULT_SEGMENT_MEMORY = 6.5
+
+# Largest number of segments, i.e. of Edge TPUs a model is pipelined over
+MAX_SEGMENTS = 8
+
+# Fraction of a segment's parameter bytes a cut may move away from its balanced position to find a narrower interface
+CUT_TOLERANCE = 0.25
+
+FAKE_QUANT_OPS = {'FakeQuantWithMinMaxVars', 'FakeQuantWithMinMaxArgs'}
+
+
+# argparse type of --num_segments: a segment count, or "auto"
+def segment_count(value):
+    if value == 'auto':
+        return value
+    try:
+        count = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a number of segments or auto, got {}".format(value))
+    if not 1 <= count <= MAX_SEGMENTS:
+        raise argparse.ArgumentTypeError("the number of segments must be between 1 and {}".format(MAX_SEGMENTS))
+    return count
+
+
+def add_segment_args(parser):
+    parser.add_argument("--num_segments", help="Split the model into this many segments, compiled separately and "
+                                               "pipelined over as many Edge TPUs, or auto to use the fewest segments "
+                                               "whose parameters fit in --segment_memory", type=segment_count,
+                        default=1)
+    parser.add_argument("--segment_memory", help="On-chip parameter memory of an Edge TPU in MiB, used with "
+                                                 "--num_segments auto", type=float, default=DEFAULT_SEGMENT_MEMORY)
+
+
+# Returns the number of elements of a Const's tensor
+def _const_elements(node):
+    tensor = node.attr['value'].tensor
+    count = 1
+    for dim in tensor.tensor_shape.dim:
+        count *= dim.size
+    return count
+
+
+# Returns the estimated Edge TPU memory of the parameters held by a Const node: one byte per element, since the Edge
+# TPU stores weights as 8-bit integers. Consts of other dtypes hold shape arithmetic and take none
+def parameter_bytes(node):
+    dtype = shape_inference._attr(node, 'dtype')
+    if node.op != 'Const' or dtype is None or dtype.type not in PARAMETER_DTYPES:
+        return 0
+    return _const_elements(node)
+
+
+# Returns the scalar value of a float Const, or None if it is not one
+def _const_scalar(node):
+    if node.op != 'Const':
+        return None
+    tensor = node.attr['value'].tensor
+    if tensor.dtype != DT_FLOAT or _const_elements(node) != 1:
+        return None
+    if tensor.tensor_content:
+        return struct.unpack('<f', tensor.tensor_content[:4])[0]
+    return tensor.float_val[0] if tensor.float_val else 0.0
+
+
+# Returns the quantization (mean, std) of a float tensor, read from the FakeQuant node producing it, or None if it is
+# not produced by one. They are the quantized_input_stats a TFLite model taking the tensor as input is converted with
+def quantization_stats(graph_chars, tensor_name):
+    nodes = graph_chars.nodes_by_name
+    name, port = shape_inference.parse_input(tensor_name)
+    node = nodes.get(name)
+    while node is not None and port == 0 and node.op in graph_optimizer.FORWARDED_OPS and node.input:
+        name, port = shape_inference.parse_input(node.input[0])
+        node = nodes.get(name)
+    if node is None or port != 0 or node.op not in FAKE_QUANT_OPS:
+        return None
+
+    if node.op == 'FakeQuantWithMinMaxArgs':
+        minimum, maximum = node.attr['min'].f, node.attr['max'].f
+    else:
+        bounds = []
+        for input_name in node.input[1:3]:
+            bound = nodes.get(shape_inference.parse_input(input_name)[0])
+            while bound is not None and bound.op in graph_optimizer.FORWARDED_OPS and bound.input:
+                bound = nodes.get(shape_inference.parse_input(bound.input[0])[0])
+            bounds.append(None if bound is None else _const_scalar(bound))
+        if len(bounds) != 2 or None in bounds:
+            return None
+        minimum, maximum = bounds
+    if maximum <= minimum:
+        return None
+
+    num_bits = shape_inference._attr_i(node, 'num_bits') or 8
+    std = (2 ** num_bits - 1) / (maximum - minimum)
+    return -minimum * std, std
+
+
+# Returns the dtype of output port of node, if it can be read from its attributes
+def _tensor_dtype(node, port):
+    output_types = shape_inference._attr(node, '_output_types')
+    if output_types is not None and port < len(output_types.list.type):
+        return output_types.list.type[port]
+    if node.op == 'Placeholder':
+        return node.attr['dtype'].type
+    if port == 0:
+        return graph_optimizer._output_dtype(node)
+    return None
+
+
+# Returns the ids of the nodes the roots depend on, producers before consumers
+def _topological_order(index, roots):
+    input_offsets = index.input_offsets
+    input_ids = index.input_ids
+    state = bytearray(len(index))
+    order = []
+    for root in roots:
+        if state[root]:
+            continue
+        state[root] = 1
+        work = [[root, input_offsets[root]]]
+        while work:
+            frame = work[-1]
+            node_id, pos = frame
+            if pos < input_offsets[node_id + 1]:
+                frame[1] = pos + 1
+                src = input_ids[pos]
+                if not state[src]:
+                    state[src] = 1
+                    work.append([src, input_offsets[src]])
+                continue
+            work.pop()
+            order.append(node_id)
+    return order
+
+
+# One segment of a model, as planned by plan_segments
+# index: Position of the segment in the pipeline
+# node_names: Names of the segment's ops, in execution order
+# constant_names: Names of the Consts (and identities of Consts) the ops use. Consts used by several segments are copied
+#   into each of them
+# inputs: List of {tensor, placeholder, shape, dtype} dictionaries, one per tensor the segment takes from the model
+#   input or from earlier segments. Each becomes a Placeholder of the segment, named placeholder
+# outputs: Names of the tensors the segment produces for later segments or as model outputs
+# parameter_bytes: Estimated Edge TPU memory of the segment's parameters
+class Segment:
+
+    def __init__(self, index, node_names, constant_names, inputs, outputs, parameter_bytes):
+        self.index = index
+        self.node_names = node_names
+        self.constant_names = constant_names
+        self.inputs = inputs
+        self.outputs = outputs
+        self.parameter_bytes = parameter_bytes
+
+    def to_json(self):
+        return {'index': self.index, 'nodes': len(self.node_names), 'constants': len(self.constant_names),
+                'inputs': self.inputs, 'outputs': self.outputs, 'parameter_bytes': self.parameter_bytes}
+
+
+# Returns the name of the Placeholder that stands in for tensor_name in a segment
+def placeholder_name(tensor_name):
+    name, port = shape_inference.parse_input(tensor_name)
+    return name if port == 0 else "{}_{}".format(name, port)
+
+
+# Splits the part of a frozen graph that computes outputs into a pipeline of segments, cut along its execution order so
+# that the segments' parameters are balanced. Within CUT_TOLERANCE of each balanced position, the cut crossed by the
+# fewest tensors is taken, since they are copied between Edge TPUs on every inference. Cuts are only made where every
+# crossing tensor has a static shape and a known dtype and, with require_ranges, a quantization range
+# graph_chars: GraphCharacteristics of the graph
+# outputs: Names of the output tensors, with optional ":port" suffixes
+# num_segments: Number of segments, or "auto" for the fewest whose parameters fit in segment_memory MiB each
+# input_shapes: Dictionary that maps placeholder names to the shapes the model is converted with
+# require_ranges: Only cut across tensors with a FakeQuant range (see quantization_stats), which quantized models need
+# Returns the list of Segments. Raises ValueError if the graph cannot be cut into num_segments segments
+def plan_segments(graph_chars, outputs, num_segments, input_shapes=None, segment_memory=DEFAULT_SEGMENT_MEMORY,
+                  require_ranges=False):
+    index = graph_chars.index
+    nodes = index.nodes
+    roots = []
+    for output in outputs:
+        name = shape_inference.parse_input(output)[0]
+        if name not in index.ids:
+            raise ValueError("Output {} is not in the graph".format(output))
+        roots.append(index.ids[name])
+    order = _topological_order(index, roots)
+    rank = {node_id: i for i, node_id in enumerate(order)}
+
+    # Consts, and identities of Consts, travel with the ops using them instead of taking a place in the pipeline
+    constant = bytearray(len(index))
+    for node_id in order:
+        node = nodes[node_id]
+        if node.op == 'Const' or (node.op in graph_optimizer.FORWARDED_OPS and len(index.inputs(node_id)) > 0
+                                  and all(constant[src] for src in index.inputs(node_id))):
+            constant[node_id] = 1
+    # Placeholders are fed to every segment using them, as if produced before the first
+    ops = [node_id for node_id in order if not constant[node_id] and nodes[node_id].op != 'Placeholder']
+    position = {node_id: pos for pos, node_id in enumerate(ops)}
+    position.update((node_id, -1) for node_id in order if nodes[node_id].op == 'Placeholder')
+
+    # Parameter bytes of the ops, each Const counted at its first user
+    op_bytes = [0] * len(ops)
+    counted = set()
+    for pos, node_id in enumerate(ops):
+        stack = [src for src in index.inputs(node_id) if constant[src]]
+        while stack:
+            src = stack.pop()
+            if src in counted:
+                continue
+            counted.add(src)
+            op_bytes[pos] += parameter_bytes(nodes[src])
+            stack.extend(input_id for input_id in index.inputs(src) if constant[input_id])
+    total_bytes = sum(op_bytes)
+
+    if num_segments == 'auto':
+        num_segments = max(1, math.ceil(total_bytes / (segment_memory * 2 ** 20)))
+        if num_segments > MAX_SEGMENTS:
+            stage_trace.event("segments", "The parameters ({} bytes) need {} segments; using {}"
+                              .format(total_bytes, num_segments, MAX_SEGMENTS), needed=num_segments)
+            num_segments = MAX_SEGMENTS
+    num_segments = min(num_segments, len(ops))
+
+    # Data tensors produced by ops, with the position of their last user
+    last_use = {}
+    for pos, node_id in enumerate(ops):
+        for input_name in nodes[node_id].input:
+            parsed = shape_inference.parse_input(input_name)
+            if parsed is None or parsed[0] not in index.ids or constant[index.ids[parsed[0]]]:
+                continue
+            last_use[parsed] = max(last_use.get(parsed, pos), pos)
+
+    # Tensors crossing each boundary: the cut before position c is crossed by the tensors produced before c and used
+    # at or after c
+    inference = shape_inference.ShapeInference(graph_chars, input_shapes=input_shapes)
+    crossing = [0] * (len(ops) + 2)
+    invalid = [0] * (len(ops) + 2)
+    for (name, port), last in last_use.items():
+        start = position[index.ids[name]] + 1
+        crossing[start] += 1
+        crossing[last + 1] -= 1
+        if not _interface_tensor(graph_chars, inference, name, port, require_ranges):
+            invalid[start] += 1
+            invalid[last + 1] -= 1
+    for pos in range(1, len(ops) + 1):
+        crossing[pos] += crossing[pos - 1]
+        invalid[pos] += invalid[pos - 1]
+
+    # Place the cuts
+    cumulative = [0]
+    for size in op_bytes:
+        cumulative.append(cumulative[-1] + size)
+    cuts = [0]
+    for i in range(1, num_segments):
+        target = total_bytes * i / num_segments
+        tolerance = max(total_bytes / num_segments * CUT_TOLERANCE, 1)
+        remaining = num_segments - i
+        candidates = [pos for pos in range(cuts[-1] + 1, len(ops) - remaining + 1)
+                      if not invalid[pos] and abs(cumulative[pos] - target) <= tolerance]
+        if not candidates:
+            candidates = [pos for pos in range(cuts[-1] + 1, len(ops) - remaining + 1) if not invalid[pos]]
+        if not candidates:
+            raise ValueError("Cannot cut the graph into {} segments: no cut after {} has static, {}interface tensors"
+                             .format(num_segments, index.names[ops[cuts[-1]]],
+                                     "quantized " if require_ranges else ""))
+        cuts.append(min(candidates, key=lambda pos: (crossing[pos], abs(cumulative[pos] - target))))
+    cuts.append(len(ops))
+
+    segments = []
+    for i in range(num_segments):
+        start, end = cuts[i], cuts[i + 1]
+        node_ids = ops[start:end]
+        members = set(node_ids)
+
+        constants = []
+        seen = set()
+        stack = [src for node_id in node_ids for src in index.inputs(node_id) if constant[src]]
+        while stack:
+            src = stack.pop()
+            if src in seen:
+                continue
+            seen.add(src)
+            constants.append(src)
+            stack.extend(input_id for input_id in index.inputs(src) if constant[input_id])
+        constants.sort(key=rank.get)
+
+        inputs = []
+        segment_outputs = []
+        for (name, port), last in last_use.items():
+            producer = position[index.ids[name]]
+            tensor_name = name if port == 0 else "{}:{}".format(name, port)
+            if producer < start <= last:
+                if any(_uses(nodes[node_id], name, port) for node_id in node_ids):
+                    inputs.append(tensor_name)
+            elif start <= producer < end and last >= end:
+                segment_outputs.append(tensor_name)
+        for output in outputs:
+            name, port = shape_inference.parse_input(output)
+            tensor_name = name if port == 0 else "{}:{}".format(name, port)
+            if index.ids[name] in members and tensor_name not in segment_outputs:
+                segment_outputs.append(tensor_name)
+
+        input_specs = []
+        for tensor_name in sorted(inputs, key=lambda tensor: position[index.ids[tensor.split(':')[0]]]):
+            name, port = shape_inference.parse_input(tensor_name)
+            input_specs.append({'tensor': tensor_name, 'placeholder': placeholder_name(tensor_name),
+                                'shape': inference.shape(tensor_name),
+                                'dtype': _tensor_dtype(nodes[index.ids[name]], port)})
+        segments.append(Segment(i, [index.names[node_id] for node_id in node_ids],
+                                [index.names[node_id] for node_id in constants], input_specs,
+                                _ordered_outputs(segment_outputs, outputs, position, index),
+                                sum(parameter_bytes(nodes[node_id]) for node_id in constants)))
+    return segments
+
+
+# Orders the outputs of a segment: model outputs in their given order, then the tensors for later segments in
+# execution order
+def _ordered_outputs(segment_outputs, outputs, position, index):
+    model_outputs = [output for output in outputs if output in segment_outputs]
+    interface = sorted((tensor for tensor in segment_outputs if tensor not in model_outputs),
+                       key=lambda tensor: position[index.ids[tensor.split(':')[0]]])
+    return interface + model_outputs
+
+
+def _uses(node, name, port):
+    for input_name in node.input:
+        parsed = shape_inference.parse_input(input_name)
+        if parsed is not None and parsed == (name, port):
+            return True
+    return False
+
+
+# Whether the tensor can cross a cut: a static shape, a dtype TFLite inputs can have and, with require_ranges, a
+# quantization range. The ranges of the model inputs are given by the user instead
+def _interface_tensor(graph_chars, inference, name, port, require_ranges):
+    shape = inference.shape("{}:{}".format(name, port))
+    if shape is None or any(dim < 0 for dim in shape):
+        return False
+    node = graph_chars.nodes_by_name[name]
+    if _tensor_dtype(node, port) not in DTYPE_SIZES:
+        return False
+    if not require_ranges or node.op == 'Placeholder':
+        return True
+    return quantization_stats(graph_chars, "{}:{}".format(name, port)) is not None
+
+
+# Returns the GraphDef of a segment: its ops and Consts, copied from graph_def, with a Placeholder in place of each
+# input tensor. graph_def may be a Tensorflow or graph_proto GraphDef; the result is of the same class
+def segment_graph_def(graph_def, graph_chars, segment):
+    segment_def = type(graph_def)()
+    segment_def.versions.CopyFrom(graph_def.versions)
+    placeholders = {}
+    for spec in segment.inputs:
+        placeholder = segment_def.node.add()
+        placeholder.name = spec['placeholder']
+        placeholder.op = 'Placeholder'
+        placeholder.attr['dtype'].type = spec['dtype']
+        for size in spec['shape']:
+            placeholder.attr['shape'].shape.dim.add(size=size)
+        placeholders[shape_inference.parse_input(spec['tensor'])] = spec['placeholder']
+
+    members = set(segment.node_names) | set(segment.constant_names)
+    for name in segment.constant_names + segment.node_names:
+        node = segment_def.node.add()
+        node.CopyFrom(graph_chars.nodes_by_name[name])
+        inputs = []
+        for input_name in node.input:
+            parsed = shape_inference.parse_input(input_name)
+            if parsed is None:
+                # Control dependencies on other segments are dropped, since frozen inference graphs do not need them
+                if input_name[1:] in members:
+                    inputs.append(input_name)
+            elif parsed in placeholders:
+                inputs.append(placeholders[parsed])
+            else:
+                inputs.append(input_name)
+        del node.input[:]
+        node.input.extend(inputs)
+    return segment_def
+
+
+# Returns the model outputs as tensor names, from the output nodes or tensor names the converters use
+def output_tensor_names(outputs):
+    return [output if type(output) is str else output.name for output in outputs]
+
+
+# Writes the manifest of a segmented model, which the pipelined runner loads. segment_paths and compiled_paths are the
+# .tflite files of the segments, before and after compilation, and reports their parsed compiler reports
+def write_manifest(path, segments, outputs, segment_paths, compiled_paths, reports=None):
+    manifest = {'outputs': list(outputs), 'segments': []}
+    for segment, segment_path, compiled_path in zip(segments, segment_paths, compiled_paths):
+        entry = segment.to_json()
+        entry.update({'tflite': segment_path, 'edgetpu_tflite': compiled_path})
+        if reports is not None:
+            entry['compile_report'] = reports[segment.index]
+        manifest['segments'].append(entry)
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+# Returns a one-line summary of a segment's estimated and compiled parameter footprint
+def segment_message(entry):
+    message = "Segment {}: {} ops, {:.2f} MiB of parameters (estimated), {} input(s), {} output(s)".format(
+        entry['index'], entry['nodes'], entry['parameter_bytes'] / 2 ** 20, len(entry['inputs']),
+        len(entry['outputs']))
+    report = entry.get('compile_report')
+    if report and report.get('on_chip_memory') is not None:
+        message += "; compiled: {:.2f} MiB on-chip, {:.2f} MiB off-chip".format(
+            report['on_chip_memory'] / 2 ** 20, (report.get('off_chip_memory') or 0) / 2 ** 20)
+    return message
@@ -1,11 +1,11 @@
 import argparse
-import sys
 import glob
 import os
 
-import tensorflow as tf
-
 import converter_util
+import model_loader
+import mo_worker
+import stage_trace
 
 
 def setup_args(parser):
@@ -19,38 +19,40 @@ def add_openvino_args(parser):
     parser.add_argument("--transformations_config", "-tc", help="Directory of openvino config")
     parser.add_argument("--pipeline_config", "-pc", help="Tensorflow pipeline config")
     parser.add_argument("--channel_order", "-co", help="Order of input channels", choices=["RGB", "BRG"], default="RGB")
-
-
-def convert_to_openvino(args, input_dims, graph_chars):
+    parser.add_argument("--data_type", help="Data type of the IR weights and activations", choices=["FP32", "FP16"],
+                        default="FP32")
+    parser.add_argument("--mo_max_jobs", help="Number of conversions a Model Optimizer worker process runs before it "
+                                              "is replaced", type=int, default=mo_worker.DEFAULT_MAX_JOBS)
+
+
+# Returns the OpenVINO installation directory selected in args, or in the environment
+def openvino_install_dir(args):
+    if args.openvino_dir is not None:
+        return args.openvino_dir
+    openvino_dir = os.getenv("INTEL_OPENVINO_DIR")
+    if openvino_dir is None:
+        stage_trace.event("openvino_dir", "Could not find an OpenVINO installation. Assuming location in "
+                          "/opt/intel/openvino, but check that OpenVINO is installed")
+        openvino_dir = "/opt/intel/openvino"
+    return openvino_dir
+
+
+# model: LoadedModel of args.input, if it has already been loaded. The Model Optimizer only accepts a path and reads
+#   the file itself, so only the graph analysis is shared with the other backends
+def convert_to_openvino(args, input_dims, graph_chars=None, model=None):
     if args.transformations_config is None:
-        print("Error:--transformations_config args are required for openvino conversion")
+        stage_trace.event("error", "Error:--transformations_config args are required for openvino conversion")
         return
 
-    if args.openvino_dir is None:
-        openvino_dir = os.getenv("INTEL_OPENVINO_DIR")
-        if openvino_dir is None:
-            print("Could not find an OpenVINO installation. Assuming location in /opt/intel/openvino, but check that"
-                  "OpenVINO is installed")
-            openvino_dir = "/opt/intel/openvino"
-    else:
-        openvino_dir = args.openvino_dir
-
-    sys.path.insert(1, openvino_dir + "/deployment_tools/model_optimizer")
-    from mo.main import main
-    from mo.utils.cli_parser import get_tf_cli_parser
+    openvino_dir = openvino_install_dir(args)
 
-    sys.argv = ['']
+    if graph_chars is None:
+        if model is None:
+            model = model_loader.load_model(args.input)
+        graph_chars = model.graph_chars
 
-    # Set input model
-    sys.argv.append("--input_model")
-    sys.argv.append(args.input)
-
-    # Set transformation config
-    sys.argv.append("--transformations_config")
-    sys.argv.append(args.transformations_config)
-
-    # Set pipeline
-    if args.pipeline_config is None:
+    pipeline_config = args.pipeline_config
+    if pipeline_config is None:
         sp = args.input.rsplit('/', 1)
         if len(sp) == 1:
             localdir = './'
@@ -58,29 +60,47 @@ def convert_to_openvino(args, input_dims, graph_chars):
             localdir = sp[0] + '/'
         pipelines = glob.glob(localdir + '*.config')
         if len(pipelines) != 1:
-            print("Error: No clear pipeline file")
+            stage_trace.event("error", "Error: No clear pipeline file", candidates=pipelines)
             exit(1)
-        args.pipeline_config = pipelines[0]
-    sys.argv.append("--tensorflow_object_detection_api_pipeline_config")
-    sys.argv.append(args.pipeline_config)
+        pipeline_config = pipelines[0]
+
+    argv = model_optimizer_argv(args, input_dims, graph_chars, pipeline_config)
+
+    # The Model Optimizer runs in a persistent worker process, which imports it once for all conversions
+    with stage_trace.stage("openvino/model_optimizer"):
+        code, error = mo_worker.run_model_optimizer(openvino_dir, argv, max_jobs=args.mo_max_jobs)
+    if code != 0:
+        stage_trace.event("error", "Error: Model Optimizer failed with status {}{}"
+                          .format(code, ":\n" + error if error else ""), status=code)
+        exit(1)
+
+
+# Returns the Model Optimizer command line arguments of a conversion. Paths are absolute, since the Model Optimizer
+# runs in a long-lived process whose working directory is not the one of the conversion
+def model_optimizer_argv(args, input_dims, graph_chars, pipeline_config):
+    # Set input model and transformation config
+    argv = ["--input_model", os.path.abspath(args.input),
+            "--transformations_config", os.path.abspath(args.transformations_config)]
+
+    # Set pipeline
+    argv += ["--tensorflow_object_detection_api_pipeline_config", os.path.abspath(pipeline_config)]
 
     # Set input dimensions
-    sys.argv.append("--input_shape")
-    sys.argv.append(str(input_dims))
+    argv += ["--input_shape", str(input_dims)]
 
     # Check reversal
     if args.channel_order == "RGB":
-        sys.argv.append("--reverse_input_channels")
+        argv.append("--reverse_input_channels")
+
+    # Set precision
+    argv += ["--data_type", args.data_type]
 
     # Set output dir
-    sys.argv.append("--output_dir")
-    sys.argv.append(args.output_dir.rsplit('/', 1)[0] + '/')
+    argv += ["--output_dir", os.path.join(os.path.dirname(os.path.abspath(args.output_dir)), '')]
 
     # Set output nodes
-    sys.argv.append("--output")
-    sys.argv.append(','.join([node.name for node in graph_chars.output_nodes]))
-
-    main(get_tf_cli_parser(), 'tf')
+    argv += ["--output", ','.join([node.name for node in graph_chars.output_nodes])]
+    return argv
 
 
 if __name__ == '__main__':
@@ -89,14 +109,12 @@ if __name__ == '__main__':
     add_openvino_args(parser)
     args = parser.parse_args()
 
-    with tf.compat.v1.gfile.GFile(args.input, "rb") as f:
-        graph_def = tf.compat.v1.GraphDef()
-        graph_def.ParseFromString(f.read())
+    model = model_loader.load_model(args.input)
 
     # Get graph data
-    graph_chars = converter_util.GraphCharacteristics(graph_def)
+    graph_chars = model.graph_chars
 
     # Set input dimensions
-    input_dims = converter_util.get_input_dims(args, graph_chars.input_nodes[0])
+    input_dims = converter_util.get_input_dims(args, graph_chars.input_nodes[0], graph_chars=graph_chars)
 
-    convert_to_openvino(args, input_dims, graph_chars=graph_chars)
+    convert_to_openvino(args, input_dims, graph_chars=graph_chars, model=model)
@@ -0,0 +1,257 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+import inference_benchmark
+
+# Item a pipeline stage passes on when it is closed
+_CLOSE = None
+
+
+# Returns a TFLite interpreter of path, from tflite_runtime if it is installed, or from Tensorflow. With a device, the
+# model runs on that Edge TPU (e.g. ":0" or "usb:1") through the Edge TPU delegate
+def make_interpreter(path, device=None, threads=1):
+    try:
+        from tflite_runtime.interpreter import Interpreter, load_delegate
+    except ImportError:
+        from tensorflow.lite import Interpreter
+        from tensorflow.lite.experimental import load_delegate
+
+    if device is None:
+        try:
+            return Interpreter(model_path=path, num_threads=threads)
+        except TypeError:
+            # Interpreters predating the num_threads argument
+            return Interpreter(model_path=path)
+    delegate = load_delegate('libedgetpu.so.1', {'device': device})
+    return Interpreter(model_path=path, experimental_delegates=[delegate])
+
+
+# Converts value, quantized with the (scale, zero point) pair source, or float if its scale is 0, to the quantization
+# of the tensor details target
+def requantize(value, source, target):
+    import numpy as np
+
+    source_scale, source_zero_point = source
+    target_scale, target_zero_point = target.get('quantization', (0.0, 0))
+    if (source_scale, source_zero_point) == (target_scale, target_zero_point) and value.dtype == target['dtype']:
+        return value
+    if source_scale:
+        value = (value.astype(np.float32) - source_zero_point) * source_scale
+    if target_scale:
+        value = np.round(value / target_scale + target_zero_point)
+        info = np.iinfo(target['dtype'])
+        value = np.clip(value, info.min, info.max)
+    return value.astype(target['dtype'])
+
+
+# One segment of a pipelined model, run by its own interpreter
+# entry: The segment's manifest entry
+# path: Path of its .tflite model
+class PipelineStage:
+
+    def __init__(self, entry, path, device=None, threads=1):
+        self.entry = entry
+        self.interpreter = make_interpreter(path, device=device, threads=threads)
+        self.interpreter.allocate_tensors()
+
+        # Match the interpreter's tensors to the segment's by name, or else by position
+        input_details = self.interpreter.get_input_details()
+        by_name = {details['name']: details for details in input_details}
+        self.inputs = []
+        for position, spec in enumerate(entry['inputs']):
+            details = by_name.get(spec['placeholder'], input_details[position])
+            self.inputs.append((spec['tensor'], details))
+        self.outputs = list(zip(entry['outputs'], self.interpreter.get_output_details()))
+        self.busy_seconds = 0.0
+
+    # Runs the segment on the tensors it takes from tensors, a dictionary that maps tensor names to (value,
+    # quantization) pairs, and adds the tensors it produces
+    def run(self, tensors):
+        start = time.perf_counter()
+        for tensor, details in self.inputs:
+            value, quantization = tensors[tensor]
+            self.interpreter.set_tensor(details['index'], requantize(value, quantization, details))
+        self.interpreter.invoke()
+        for tensor, details in self.outputs:
+            tensors[tensor] = (self.interpreter.get_tensor(details['index']),
+                               tuple(details.get('quantization', (0.0, 0))))
+        self.busy_seconds += time.perf_counter() - start
+        return tensors
+
+
+# Runs a segmented model as a pipeline: one thread per segment, each driving its own interpreter (and Edge TPU), with
+# bounded queues between them, so that while one segment runs an input the previous one runs the next input. Inputs are
+# pushed, and outputs popped, in order
+# manifest_path: The <output_dir>_segments.json written by edgetpu_converter with --num_segments
+# devices: Edge TPU of each segment, e.g. [":0", ":1"]. Without devices, the uncompiled segments run on the CPU, which
+#   tests the split without any Edge TPU attached
+# queue_size: Maximum number of inputs waiting before each segment
+class PipelinedRunner:
+
+    def __init__(self, manifest_path, devices=None, queue_size=2, threads=1):
+        with open(manifest_path) as f:
+            self.manifest = json.load(f)
+        directory = os.path.dirname(manifest_path)
+        entries = self.manifest['segments']
+        if devices is not None and len(devices) < len(entries):
+            raise ValueError("{} segments need as many Edge TPUs, got {}".format(len(entries), len(devices)))
+
+        self.stages = []
+        for entry in entries:
+            if devices is None:
+                path, device = entry['tflite'], None
+            else:
+                path, device = entry['edgetpu_tflite'], devices[entry['index']]
+            self.stages.append(PipelineStage(entry, os.path.join(directory, path), device=device, threads=threads))
+        self.outputs = self.manifest['outputs']
+
+        # Inputs are pushed in the format of the first segment taking them
+        self._input_quantization = {}
+        for stage in reversed(self.stages):
+            for tensor, details in stage.inputs:
+                self._input_quantization[tensor] = tuple(details.get('quantization', (0.0, 0)))
+
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(len(self.stages) + 1)]
+        self._threads = [threading.Thread(target=self._run_stage, args=(i,), name="segment-{}".format(i), daemon=True)
+                         for i in range(len(self.stages))]
+        for thread in self._threads:
+            thread.start()
+
+    def _run_stage(self, i):
+        stage = self.stages[i]
+        source, target = self._queues[i], self._queues[i + 1]
+        while True:
+            item = source.get()
+            if item is _CLOSE:
+                target.put(_CLOSE)
+                return
+            tensors, error = item
+            if error is None:
+                try:
+                    tensors = stage.run(tensors)
+                except Exception as e:
+                    error = e
+            target.put((tensors, error))
+
+    # Queues an input. inputs maps the model input names to arrays, or is the array of the only input. Blocks while
+    # the first segment's queue is full
+    def push(self, inputs):
+        if not isinstance(inputs, dict):
+            inputs = {self.stages[0].inputs[0][0]: inputs}
+        self._queues[0].put(({name: (value, self._input_quantization.get(name, (0.0, 0)))
+                              for name, value in inputs.items()}, None))
+
+    # Returns the outputs of the oldest pushed input, in the order of the model outputs, as the last segment producing
+    # each returns them. Raises the error of the segment that failed on it, if any
+    def pop(self):
+        item = self._queues[-1].get()
+        if item is _CLOSE:
+            raise RuntimeError("The pipeline is closed")
+        tensors, error = item
+        if error is not None:
+            raise error
+        return [tensors[name][0] for name in self.outputs]
+
+    # Runs a single input through the whole pipeline
+    def run(self, inputs):
+        self.push(inputs)
+        return self.pop()
+
+    # Stops the stage threads. Outputs not popped yet are dropped
+    def close(self):
+        self._queues[0].put(_CLOSE)
+        while True:
+            item = self._queues[-1].get()
+            if item is _CLOSE:
+                break
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Feeds iterations inputs through runner, keeping the pipeline full, and returns the throughput and the share of the
+# time each segment was busy
+def measure_pipeline(runner, inputs, iterations):
+    for stage in runner.stages:
+        stage.busy_seconds = 0.0
+    start = time.perf_counter()
+    pending = 0
+    for i in range(iterations):
+        runner.push(inputs[i % len(inputs)])
+        pending += 1
+        # Keep at most one input per segment in flight, plus the one being queued
+        if pending > len(runner.stages):
+            runner.pop()
+            pending -= 1
+    for _ in range(pending):
+        runner.pop()
+    elapsed = time.perf_counter() - start
+    return {'throughput': iterations / elapsed, 'elapsed': elapsed,
+            'segment_utilization': [stage.busy_seconds / elapsed for stage in runner.stages]}
+
+
+# Returns the largest absolute difference between the outputs of the pipeline and of the whole model, dequantized,
+# on each of inputs
+def compare_outputs(runner, model_path, inputs, threads=1):
+    import numpy as np
+
+    interpreter = make_interpreter(model_path, threads=threads)
+    interpreter.allocate_tensors()
+    input_index = interpreter.get_input_details()[0]['index']
+    output_details = interpreter.get_output_details()
+    last_stage = {}
+    for stage in runner.stages:
+        for tensor, details in stage.outputs:
+            last_stage[tensor] = details
+
+    difference = 0.0
+    for data in inputs:
+        interpreter.set_tensor(input_index, data)
+        interpreter.invoke()
+        expected = [interpreter.get_tensor(details['index']) for details in output_details]
+        actual = runner.run(data)
+        for name, value, reference, details in zip(runner.outputs, actual, expected, output_details):
+            value = requantize(value, last_stage[name].get('quantization', (0.0, 0)), {'dtype': np.float32})
+            reference = requantize(reference, details.get('quantization', (0.0, 0)), {'dtype': np.float32})
+            difference = max(difference, float(np.max(np.abs(value - reference))) if value.size else 0.0)
+    return difference
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--manifest", "-m", help="Segment manifest written by edgetpu_converter (<output_dir>"
+                                                 "_segments.json)", required=True)
+    parser.add_argument("--devices", help="Edge TPU of each segment, e.g. :0 :1. Without it, the uncompiled segments "
+                                          "run on the CPU", nargs='+')
+    parser.add_argument("--queue_size", help="Maximum number of inputs waiting before each segment", type=int,
+                        default=2)
+    parser.add_argument("--threads", help="Interpreter threads of each segment on the CPU", type=int, default=1)
+    parser.add_argument("--iterations", help="Number of inputs to run", type=int, default=100)
+    parser.add_argument("--input_data", help="Directory of images or .npy arrays to run. Defaults to random inputs")
+    parser.add_argument("--compare", help="Also run this unsegmented .tflite model on the CPU, and report the largest "
+                                          "difference between its outputs and the pipeline's")
+    args = parser.parse_args()
+
+    with PipelinedRunner(args.manifest, devices=args.devices, queue_size=args.queue_size,
+                         threads=args.threads) as runner:
+        first = runner.stages[0].inputs[0][1]
+        inputs = inference_benchmark.make_inputs(list(first['shape']), first['dtype'], args.input_data)
+        for entry in runner.manifest['segments']:
+            print("Segment {}: {:.2f} MiB of parameters (estimated)".format(entry['index'],
+                                                                            entry['parameter_bytes'] / 2 ** 20))
+        results = measure_pipeline(runner, inputs, args.iterations)
+        print("Throughput: {:.2f} inferences/s".format(results['throughput']))
+        for i, utilization in enumerate(results['segment_utilization']):
+            print("Segment {} busy {:.0%} of the time".format(i, utilization))
+        if args.compare:
+            print("Largest output difference: {}".format(compare_outputs(runner, args.compare, inputs,
+                                                                        threads=args.threads)))
@@ -0,0 +1,547 @@
+import sys
+from array import array
+
+# Tensorflow DataType enum values (tensorflow/core/framework/types.proto)
+DT_INT32 = 3
+DT_INT64 = 9
+
+# Integer Const tensors larger than this are not decoded; shape arithmetic only ever needs small vectors
+MAX_CONST_ELEMENTS = 64
+
+# Ops whose (first) output has the same shape as their first input
+UNARY_OPS = {
+    'Identity', 'StopGradient', 'Snapshot', 'BiasAdd', 'Relu', 'Relu6', 'Elu', 'Selu', 'Softplus', 'Sigmoid', 'Tanh',
+    'Softmax', 'LogSoftmax', 'Cast', 'ToFloat', 'Neg', 'Abs', 'Exp', 'Log', 'Sqrt', 'Rsqrt', 'Square', 'Floor',
+    'Round', 'Reciprocal', 'FusedBatchNorm', 'FusedBatchNormV2', 'FusedBatchNormV3', 'LRN', 'FakeQuantWithMinMaxVars',
+    'FakeQuantWithMinMaxArgs', 'Dequantize', 'ZerosLike', 'OnesLike', 'CheckNumerics', 'PlaceholderWithDefault',
+}
+
+# Ops whose first input shallow inference does not follow: the output of a Reshape is mostly set by its target shape,
+# and Shape ops only feed shape arithmetic
+SHALLOW_OPS = {'Reshape', 'Shape', 'Size', 'Rank'}
+
+# Element-wise ops with numpy-style broadcasting between their two inputs
+BINARY_OPS = {
+    'Add', 'AddV2', 'Sub', 'Mul', 'RealDiv', 'Div', 'FloorDiv', 'Maximum', 'Minimum', 'SquaredDifference', 'Pow',
+    'Greater', 'GreaterEqual', 'Less', 'LessEqual', 'Equal', 'NotEqual', 'LogicalAnd', 'LogicalOr',
+}
+
+
+# Splits a NodeDef input string into its producing node name and output port. Returns None for control inputs
+def parse_input(input_name):
+    if input_name.startswith('^'):
+        return None
+    name, _, port = input_name.partition(':')
+    return name, int(port) if port else 0
+
+
+# Returns the attribute value of a node, or None if it is absent. Avoids indexing the attr map directly, which would
+# insert an empty attribute into the NodeDef
+def _attr(node, name):
+    if name in node.attr:
+        return node.attr[name]
+    return None
+
+
+# Converts a TensorShapeProto to a list of dimensions, with -1 marking unknown dimensions, or None if the rank is
+# unknown
+def shape_from_proto(shape_proto):
+    if shape_proto.unknown_rank:
+        return None
+    return [dim.size for dim in shape_proto.dim]
+
+
+# Decodes a small integer TensorProto into a flat list of ints, or returns None if it is not one
+def const_value(tensor):
+    if tensor.dtype not in (DT_INT32, DT_INT64):
+        return None
+
+    count = 1
+    for dim in tensor.tensor_shape.dim:
+        count *= dim.size
+    if count > MAX_CONST_ELEMENTS:
+        return None
+
+    if tensor.tensor_content:
+        values = array('i' if tensor.dtype == DT_INT32 else 'q', tensor.tensor_content)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return list(values)
+
+    values = list(tensor.int_val if tensor.dtype == DT_INT32 else tensor.int64_val)
+    if not values:
+        return [0] * count
+    # Tensorflow repeats the last value to fill the tensor
+    return values + [values[-1]] * (count - len(values))
+
+
+def _attr_i(node, name):
+    attr = _attr(node, name)
+    return 0 if attr is None else attr.i
+
+
+def _attr_b(node, name):
+    attr = _attr(node, name)
+    return False if attr is None else attr.b
+
+
+def _attr_s(node, name, default=b''):
+    attr = _attr(node, name)
+    return default if attr is None else attr.s
+
+
+def _attr_ints(node, name):
+    attr = _attr(node, name)
+    return [] if attr is None else list(attr.list.i)
+
+
+def _num_elements(shape):
+    if shape is None or any(dim < 0 for dim in shape):
+        return -1
+    count = 1
+    for dim in shape:
+        count *= dim
+    return count
+
+
+def _broadcast(shape_a, shape_b):
+    if shape_a is None or shape_b is None:
+        return None
+    result = []
+    for idx in range(max(len(shape_a), len(shape_b))):
+        dim_a = shape_a[len(shape_a) - 1 - idx] if idx < len(shape_a) else 1
+        dim_b = shape_b[len(shape_b) - 1 - idx] if idx < len(shape_b) else 1
+        if dim_a == 1:
+            result.append(dim_b)
+        elif dim_b == 1 or dim_a == dim_b:
+            result.append(dim_a)
+        elif dim_a == -1 or dim_b == -1:
+            result.append(max(dim_a, dim_b))
+        else:
+            return None
+    return result[::-1]
+
+
+def _window_output(size, kernel, stride, dilation, padding):
+    if size < 0 or kernel < 0:
+        return -1
+    if padding == b'SAME':
+        return -(-size // stride)
+    effective = (kernel - 1) * dilation + 1
+    return (size - effective) // stride + 1
+
+
+# Static shape propagation over a GraphDef, without Tensorflow. Shapes are lists of dimensions with -1 marking
+# unknown dimensions, and None marking an unknown rank. Properties:
+# shapes: Dictionary that maps node names to a list of output shapes, one per output port
+# values: Dictionary that maps node names to the flattened value of small integer tensors that could be evaluated
+#   statically (Const and shape arithmetic), used to resolve Reshape, ConcatV2 axes and similar
+# Nodes produced by unsupported ops fall back to their _output_shapes attribute, if present, and are otherwise unknown.
+# graph_chars: GraphCharacteristics object
+# input_shapes: Optional dictionary that maps placeholder names to shapes, overriding the placeholder's shape attr
+# targets: Optional list of node names. If given, only these nodes and their ancestors are inferred, and the shapes of
+#   all other nodes are unknown
+# shallow: If true, the data inputs of ops in SHALLOW_OPS are not followed, leaving them unknown unless reached
+#   otherwise. Much cheaper for targets whose dimensions are set by constant reshape targets (e.g. SSD class counts)
+class ShapeInference:
+
+    def __init__(self, graph_chars, input_shapes=None, targets=None, shallow=False):
+        self.index = graph_chars.index
+        self.input_shapes = input_shapes or {}
+        self.shapes = {}
+        self.values = {}
+
+        roots = range(len(self.index)) if targets is None else [self.index.ids[name] for name in targets]
+        for node_id in self._topological_order(roots, shallow):
+            node = self.index.nodes[node_id]
+            try:
+                shapes = self._infer(node)
+            except (IndexError, KeyError, ValueError, TypeError, ZeroDivisionError):
+                shapes = None
+            if shapes is None or all(shape is None for shape in shapes):
+                shapes = self._recorded_shapes(node) or shapes or [None]
+            self.shapes[node.name] = shapes
+
+    # Returns the shape of a tensor given as a node name, with an optional ":port" suffix
+    def shape(self, tensor_name):
+        name, port = parse_input(tensor_name)
+        shapes = self.shapes.get(name)
+        if shapes is None or port >= len(shapes):
+            return None
+        return shapes[port]
+
+    # Depth-first post-order over the reverse graph from the given root ids, so producers come before consumers. Back
+    # edges of cycles are ignored, leaving their targets unknown. When shallow, the first input of SHALLOW_OPS is
+    # skipped
+    def _topological_order(self, roots, shallow=False):
+        index = self.index
+        input_offsets = index.input_offsets
+        input_ids = index.input_ids
+        ops = index.ops
+
+        def first_input(node_id):
+            if shallow and ops[node_id] in SHALLOW_OPS:
+                return input_offsets[node_id] + 1
+            return input_offsets[node_id]
+
+        state = bytearray(len(index))
+        order = []
+        for root in roots:
+            if state[root]:
+                continue
+            state[root] = 1
+            work = [[root, first_input(root)]]
+            while work:
+                frame = work[-1]
+                node_id, pos = frame
+                if pos < input_offsets[node_id + 1]:
+                    frame[1] = pos + 1
+                    src = input_ids[pos]
+                    if not state[src]:
+                        state[src] = 1
+                        work.append([src, first_input(src)])
+                    continue
+                work.pop()
+                order.append(node_id)
+        return order
+
+    def _recorded_shapes(self, node):
+        recorded = _attr(node, '_output_shapes')
+        if recorded is None or not recorded.list.shape:
+            return None
+        return [shape_from_proto(shape) for shape in recorded.list.shape]
+
+    # Returns the (shape, value) pairs of the data inputs of node
+    def _inputs(self, node):
+        inputs = []
+        for input_name in node.input:
+            parsed = parse_input(input_name)
+            if parsed is None:
+                continue
+            name, port = parsed
+            shapes = self.shapes.get(name)
+            shape = shapes[port] if shapes is not None and port < len(shapes) else None
+            inputs.append((shape, self.values.get(name) if port == 0 else None))
+        return inputs
+
+    def _infer(self, node):
+        op = node.op
+        inputs = self._inputs(node)
+
+        if op in ('Placeholder', 'PlaceholderV2'):
+            if node.name in self.input_shapes:
+                return [list(self.input_shapes[node.name])]
+            shape = _attr(node, 'shape')
+            return [shape_from_proto(shape.shape) if shape is not None else None]
+
+        if op == 'Const':
+            tensor = _attr(node, 'value').tensor
+            value = const_value(tensor)
+            if value is not None:
+                self.values[node.name] = value
+            return [shape_from_proto(tensor.tensor_shape)]
+
+        if op in UNARY_OPS:
+            if op in ('Identity', 'Cast', 'ToFloat', 'StopGradient', 'Snapshot') and inputs[0][1] is not None:
+                self.values[node.name] = inputs[0][1]
+            shapes = [inputs[0][0]]
+            if op.startswith('FusedBatchNorm'):
+                channels = [inputs[1][0][0]] if inputs[1][0] else None
+                shapes += [channels] * (5 if op == 'FusedBatchNormV3' else 4)
+            return shapes
+
+        if op in BINARY_OPS:
+            return [_broadcast(inputs[0][0], inputs[1][0])]
+
+        if op in ('AddN', 'Merge'):
+            return [inputs[0][0]] + ([[]] if op == 'Merge' else [])
+
+        if op in ('Conv2D', 'DepthwiseConv2dNative', 'MaxPool', 'AvgPool'):
+            return [self._infer_window(node, inputs)]
+
+        if op == 'Reshape':
+            return [self._infer_reshape(inputs)]
+
+        if op in ('ConcatV2', 'Concat'):
+            return [self._infer_concat(node, inputs)]
+
+        if op == 'Squeeze':
+            return [self._infer_squeeze(node, inputs)]
+
+        if op == 'ExpandDims':
+            shape, axis = inputs[0][0], inputs[1][1]
+            if shape is None or axis is None:
+                return [None]
+            axis = axis[0] if axis[0] >= 0 else axis[0] + len(shape) + 1
+            return [shape[:axis] + [1] + shape[axis:]]
+
+        if op == 'Shape':
+            shape = inputs[0][0]
+            if shape is None:
+                return [[-1]]
+            if all(dim >= 0 for dim in shape):
+                self.values[node.name] = list(shape)
+            return [[len(shape)]]
+
+        if op in ('Size', 'Rank'):
+            if op == 'Rank' and inputs[0][0] is not None:
+                self.values[node.name] = [len(inputs[0][0])]
+            elif op == 'Size' and _num_elements(inputs[0][0]) >= 0:
+                self.values[node.name] = [_num_elements(inputs[0][0])]
+            return [[]]
+
+        if op == 'Pack':
+            return [self._infer_pack(node, inputs)]
+
+        if op == 'StridedSlice':
+            return [self._infer_strided_slice(node, inputs)]
+
+        if op == 'Transpose':
+            shape, perm = inputs[0][0], inputs[1][1]
+            if shape is None or perm is None:
+                return [None]
+            return [[shape[axis] for axis in perm]]
+
+        if op in ('Pad', 'PadV2', 'MirrorPad'):
+            shape, paddings = inputs[0][0], inputs[1][1]
+            if shape is None or paddings is None:
+                return [None]
+            return [[dim + paddings[2 * idx] + paddings[2 * idx + 1] if dim >= 0 else -1
+                     for idx, dim in enumerate(shape)]]
+
+        if op in ('ResizeBilinear', 'ResizeNearestNeighbor', 'ResizeBicubic', 'ResizeArea'):
+            shape, size = inputs[0][0], inputs[1][1]
+            if shape is None:
+                return [None]
+            size = size if size is not None else [-1, -1]
+            return [[shape[0], size[0], size[1], shape[3]]]
+
+        if op == 'MatMul':
+            shape_a, shape_b = inputs[0][0], inputs[1][0]
+            if shape_a is None or shape_b is None:
+                return [None]
+            rows = shape_a[1] if _attr_b(node, 'transpose_a') else shape_a[0]
+            cols = shape_b[0] if _attr_b(node, 'transpose_b') else shape_b[1]
+            return [[rows, cols]]
+
+        if op in ('Split', 'SplitV'):
+            return self._infer_split(node, inputs)
+
+        if op == 'Unpack':
+            shape = inputs[0][0]
+            num = _attr_i(node, 'num')
+            if shape is None:
+                return [None] * num
+            axis = _attr_i(node, 'axis')
+            axis = axis if axis >= 0 else axis + len(shape)
+            return [shape[:axis] + shape[axis + 1:]] * num
+
+        if op in ('Mean', 'Sum', 'Max', 'Min', 'Prod', 'ArgMax', 'ArgMin'):
+            return [self._infer_reduce(node, inputs)]
+
+        return None
+
+    def _infer_window(self, node, inputs):
+        shape = inputs[0][0]
+        if shape is None:
+            return None
+
+        nchw = _attr_s(node, 'data_format', b'NHWC') == b'NCHW'
+        h_axis, w_axis, c_axis = (2, 3, 1) if nchw else (1, 2, 3)
+        strides = _attr_ints(node, 'strides') or [1, 1, 1, 1]
+        dilations = _attr_ints(node, 'dilations') or [1, 1, 1, 1]
+        padding = _attr_s(node, 'padding')
+
+        if node.op in ('MaxPool', 'AvgPool'):
+            ksize = _attr_ints(node, 'ksize')
+            kernel_h, kernel_w = ksize[h_axis], ksize[w_axis]
+            channels = shape[c_axis]
+        else:
+            filter_shape = inputs[1][0]
+            if filter_shape is None:
+                filter_shape = [-1, -1, -1, -1]
+            kernel_h, kernel_w = filter_shape[0], filter_shape[1]
+            if node.op == 'Conv2D':
+                channels = filter_shape[3]
+            elif shape[c_axis] < 0 or filter_shape[3] < 0:
+                channels = -1
+            else:
+                channels = shape[c_axis] * filter_shape[3]
+
+        result = list(shape)
+        result[h_axis] = _window_output(shape[h_axis], kernel_h, strides[h_axis], dilations[h_axis], padding)
+        result[w_axis] = _window_output(shape[w_axis], kernel_w, strides[w_axis], dilations[w_axis], padding)
+        result[c_axis] = channels
+        return result
+
+    def _infer_reshape(self, inputs):
+        shape, target = inputs[0][0], inputs[1][1]
+        if target is None:
+            target_shape = inputs[1][0]
+            if target_shape is None or target_shape[0] < 0:
+                return None
+            return [-1] * target_shape[0]
+
+        target = list(target)
+        if target.count(-1) == 1:
+            known = 1
+            for dim in target:
+                if dim != -1:
+                    known *= dim
+            total = _num_elements(shape)
+            if total >= 0 and known > 0:
+                target[target.index(-1)] = total // known
+        return target
+
+    def _infer_concat(self, node, inputs):
+        if node.op == 'ConcatV2':
+            axis, parts = inputs[-1][1], inputs[:-1]
+        else:
+            axis, parts = inputs[0][1], inputs[1:]
+        shapes = [shape for shape, _ in parts]
+        if axis is None or any(shape is None for shape in shapes):
+            return None
+
+        rank = len(shapes[0])
+        axis = axis[0] if axis[0] >= 0 else axis[0] + rank
+        result = list(shapes[0])
+        for shape in shapes[1:]:
+            for idx, dim in enumerate(shape):
+                if idx == axis:
+                    result[idx] = -1 if result[idx] < 0 or dim < 0 else result[idx] + dim
+                elif result[idx] < 0:
+                    result[idx] = dim
+
+        values = [value for _, value in parts]
+        if rank == 1 and all(value is not None for value in values):
+            self.values[node.name] = [dim for value in values for dim in value]
+        return result
+
+    def _infer_squeeze(self, node, inputs):
+        shape = inputs[0][0]
+        if shape is None:
+            return None
+        squeeze_dims = _attr_ints(node, 'squeeze_dims')
+        if not squeeze_dims:
+            if -1 in shape:
+                return None
+            return [dim for dim in shape if dim != 1]
+        squeeze_dims = {axis if axis >= 0 else axis + len(shape) for axis in squeeze_dims}
+        return [dim for idx, dim in enumerate(shape) if idx not in squeeze_dims]
+
+    def _infer_pack(self, node, inputs):
+        shapes = [shape for shape, _ in inputs]
+        if any(shape is None for shape in shapes):
+            return None
+        axis = _attr_i(node, 'axis')
+        shape = list(shapes[0])
+        axis = axis if axis >= 0 else axis + len(shape) + 1
+        values = [value for _, value in inputs]
+        if not shape and all(value is not None for value in values):
+            self.values[node.name] = [value[0] for value in values]
+        return shape[:axis] + [len(inputs)] + shape[axis:]
+
+    # Only slices of 1-D tensors are resolved, which covers the shape arithmetic SSD graphs perform on Shape outputs
+    def _infer_strided_slice(self, node, inputs):
+        shape = inputs[0][0]
+        value, begin, end, strides = [value for _, value in inputs[:4]]
+        if shape is None or len(shape) != 1 or begin is None or end is None or strides is None:
+            return None
+        if _attr_i(node, 'ellipsis_mask') or _attr_i(node, 'new_axis_mask'):
+            return None
+
+        length = shape[0]
+        if length < 0:
+            return None
+        start = None if _attr_i(node, 'begin_mask') & 1 else begin[0]
+        stop = None if _attr_i(node, 'end_mask') & 1 else end[0]
+        selected = list(range(length))[slice(start, stop, strides[0])]
+
+        if _attr_i(node, 'shrink_axis_mask') & 1:
+            if value is not None:
+                self.values[node.name] = [value[begin[0]]]
+            return []
+        if value is not None:
+            self.values[node.name] = [value[idx] for idx in selected]
+        return [len(selected)]
+
+    def _infer_split(self, node, inputs):
+        num_split = _attr_i(node, 'num_split')
+        if node.op == 'Split':
+            axis, (shape, _) = inputs[0][1], inputs[1]
+            sizes = None
+        else:
+            (shape, _), sizes, axis = inputs[0], inputs[1][1], inputs[2][1]
+        if shape is None or axis is None:
+            return [None] * num_split
+
+        axis = axis[0] if axis[0] >= 0 else axis[0] + len(shape)
+        if sizes is None:
+            sizes = [shape[axis] // num_split if shape[axis] >= 0 else -1] * num_split
+        elif -1 in sizes and shape[axis] >= 0:
+            sizes = list(sizes)
+            sizes[sizes.index(-1)] = shape[axis] - sum(size for size in sizes if size != -1)
+        return [shape[:axis] + [size] + shape[axis + 1:] for size in sizes]
+
+    def _infer_reduce(self, node, inputs):
+        shape, axes = inputs[0][0], inputs[1][1]
+        if shape is None or axes is None:
+            return None
+        axes = {axis if axis >= 0 else axis + len(shape) for axis in axes}
+        if node.op in ('ArgMax', 'ArgMin'):
+            keep_dims = False
+        else:
+            keep_dims = _attr_b(node, 'keep_dims')
+        return [1 if idx in axes else dim for idx, dim in enumerate(shape) if keep_dims or idx not in axes]
+
+
+# Returns a dictionary that maps node names to their list of output shapes. See ShapeInference
+def infer_shapes(graph_chars, input_shapes=None):
+    return ShapeInference(graph_chars, input_shapes=input_shapes).shapes
+
+
+# Proposes values for the unknown (-1) dimensions of an NHWC image input node, or returns None if it cannot. The batch
+# dimension is taken to be 1, and the spatial dimensions are read from the first resize op with a constant size found
+# downstream of the input, which is how the object detection API preprocessor fixes the model resolution. The shapes
+# inferred from the placeholders' own shapes are shared with the other analyses of graph_chars
+def infer_input_dims(graph_chars, input_node, node_dims):
+    if len(node_dims) != 4:
+        return None
+
+    index = graph_chars.index
+    dims = list(node_dims)
+    if dims[0] == -1:
+        dims[0] = 1
+
+    if dims[1] == -1 or dims[2] == -1:
+        inference = graph_chars.shape_inference()
+        size = None
+        visited = bytearray(len(index))
+        frontier = [index.ids[input_node.name]]
+        while frontier and size is None:
+            next_frontier = []
+            for node_id in frontier:
+                for dst in index.outputs(node_id):
+                    if visited[dst]:
+                        continue
+                    visited[dst] = 1
+                    node = index.nodes[dst]
+                    if node.op.startswith('Resize') and len(node.input) > 1:
+                        parsed = parse_input(node.input[1])
+                        value = inference.values.get(parsed[0]) if parsed is not None else None
+                        if value is not None and len(value) == 2:
+                            size = value
+                            break
+                    next_frontier.append(dst)
+                if size is not None:
+                    break
+            frontier = next_frontier
+
+        if size is None:
+            return None
+        dims[1] = size[0] if dims[1] == -1 else dims[1]
+        dims[2] = size[1] if dims[2] == -1 else dims[2]
+
+    if dims[3] == -1:
+        return None
+    return dims
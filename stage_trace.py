@@ -0,0 +1,213 @@
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then not recorded
+    resource = None
+
+
+def add_trace_args(parser):
+    parser.add_argument("--trace", help="Write the timing, CPU time and peak RSS of every conversion stage, and the "
+                                        "diagnostic events, to this JSON file")
+    parser.add_argument("--chrome_trace", help="Write the stages and events to this file in Chrome trace event "
+                                               "format, for chrome://tracing or Perfetto")
+    parser.add_argument("--profile", help="Run the named stage (e.g. edgetpu/tflite_convert) under cProfile. May be "
+                                          "given several times", action='append', default=[])
+
+
+# Returns the peak resident set size of this process, or of its largest finished child process, in bytes
+def peak_rss(children=False):
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# A finished stage
+# name: Stage name, e.g. "parse" or "edgetpu/compile"
+# parent: Name of the enclosing stage, or None
+# pid, tid: Process and thread the stage ran in
+# start: Wall clock start time, in seconds since the epoch
+# wall: Wall time in seconds
+# cpu: CPU time of the process in seconds
+# peak_rss: Peak resident set size of the process at the end of the stage, in bytes. This is a high-water mark, so it
+#   only grows from stage to stage
+# children_peak_rss: Largest peak resident set size of the finished child processes (e.g. edgetpu_compiler)
+# fields: Dictionary of extra details
+class Stage:
+
+    def __init__(self, name, parent, pid, tid, start, wall, cpu, peak_rss, children_peak_rss, fields):
+        self.name = name
+        self.parent = parent
+        self.pid = pid
+        self.tid = tid
+        self.start = start
+        self.wall = wall
+        self.cpu = cpu
+        self.peak_rss = peak_rss
+        self.children_peak_rss = children_peak_rss
+        self.fields = fields
+
+    def to_json(self):
+        return {'name': self.name, 'parent': self.parent, 'pid': self.pid, 'tid': self.tid, 'start': self.start,
+                'wall': self.wall, 'cpu': self.cpu, 'peak_rss': self.peak_rss,
+                'children_peak_rss': self.children_peak_rss, 'fields': self.fields}
+
+
+# A diagnostic event
+# name: Event name, e.g. "input_names"
+# message: The message printed for the event
+# stage: Name of the stage the event happened in, or None
+# pid, tid: Process and thread the event happened in
+# time: Wall clock time, in seconds since the epoch
+# fields: Dictionary of structured details
+class Event:
+
+    def __init__(self, name, message, stage, pid, tid, time, fields):
+        self.name = name
+        self.message = message
+        self.stage = stage
+        self.pid = pid
+        self.tid = tid
+        self.time = time
+        self.fields = fields
+
+    def to_json(self):
+        return {'name': self.name, 'message': self.message, 'stage': self.stage, 'pid': self.pid, 'tid': self.tid,
+                'time': self.time, 'fields': self.fields}
+
+
+# Records the stages and events of a conversion run. Stages nest; each thread has its own stack of open stages
+class Tracer:
+
+    def __init__(self):
+        self.stages = []
+        self.events = []
+        self.profile_stages = set()
+        self.profile_prefix = "./converted_model"
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    # Context manager timing the code it wraps as the stage name, run under cProfile if name was selected with
+    # --profile. fields are stored with the stage
+    @contextlib.contextmanager
+    def stage(self, name, **fields):
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        stack.append(name)
+
+        profiler = None
+        if name in self.profile_stages:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler, e.g. of an enclosing stage, is already active
+                profiler = None
+
+        start = time.time()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            if profiler is not None:
+                profiler.disable()
+                self._write_profile(name, profiler)
+            stack.pop()
+            with self._lock:
+                self.stages.append(Stage(name, parent, os.getpid(), threading.get_ident(), start, wall, cpu,
+                                         peak_rss(), peak_rss(children=True), fields))
+
+    # Prints message and records it as the event name, with the structured details in fields
+    def event(self, name, message, **fields):
+        print(message)
+        stack = self._stack()
+        with self._lock:
+            self.events.append(Event(name, message, stack[-1] if stack else None, os.getpid(), threading.get_ident(),
+                                     time.time(), fields))
+
+    def _write_profile(self, name, profiler):
+        path = "{}_{}.prof".format(self.profile_prefix, name.replace('/', '_'))
+        profiler.dump_stats(path)
+        print("Profile of stage {} written to {}".format(name, path))
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+
+    # Removes and returns the recorded stages and events, for handing them to another process
+    def drain(self):
+        with self._lock:
+            stages, events = self.stages, self.events
+            self.stages, self.events = [], []
+        return stages, events
+
+    # Adds stages and events recorded by another process
+    def merge(self, stages, events):
+        with self._lock:
+            self.stages.extend(stages)
+            self.events.extend(events)
+
+    def to_json(self):
+        return {'stages': [stage.to_json() for stage in self.stages],
+                'events': [event.to_json() for event in self.events]}
+
+    # Returns the stages and events in Chrome trace event format
+    def to_chrome_trace(self):
+        trace_events = []
+        for stage in self.stages:
+            args = {'cpu_s': stage.cpu, 'peak_rss_mb': None if stage.peak_rss is None else stage.peak_rss / 2 ** 20}
+            args.update(stage.fields)
+            trace_events.append({'name': stage.name, 'cat': 'stage', 'ph': 'X', 'ts': stage.start * 1e6,
+                                 'dur': stage.wall * 1e6, 'pid': stage.pid, 'tid': stage.tid, 'args': args})
+            if stage.peak_rss is not None:
+                trace_events.append({'name': 'peak_rss_mb', 'ph': 'C', 'ts': (stage.start + stage.wall) * 1e6,
+                                     'pid': stage.pid, 'args': {'peak_rss_mb': stage.peak_rss / 2 ** 20}})
+        for event in self.events:
+            args = {'message': event.message}
+            args.update(event.fields)
+            trace_events.append({'name': event.name, 'cat': 'event', 'ph': 'i', 's': 't', 'ts': event.time * 1e6,
+                                 'pid': event.pid, 'tid': event.tid, 'args': args})
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+
+# Tracer of this process
+TRACER = Tracer()
+
+
+def stage(name, **fields):
+    return TRACER.stage(name, **fields)
+
+
+def event(name, message, **fields):
+    TRACER.event(name, message, **fields)
+
+
+# Applies the --profile selection of args. Profiles are written next to the converted model
+def configure(args):
+    TRACER.profile_stages = set(getattr(args, 'profile', None) or [])
+    TRACER.profile_prefix = getattr(args, 'output_dir', None) or TRACER.profile_prefix
+
+
+# Writes the trace files requested in args
+def write_traces(args):
+    if getattr(args, 'trace', None):
+        with open(args.trace, "w") as f:
+            json.dump(TRACER.to_json(), f, indent=2, default=str)
+    if getattr(args, 'chrome_trace', None):
+        with open(args.chrome_trace, "w") as f:
+            json.dump(TRACER.to_chrome_trace(), f, default=str)
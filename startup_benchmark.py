@@ -0,0 +1,56 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Framework modules that must not be imported just to start the CLI
+HEAVY_MODULES = ["tensorflow", "tensorrt", "uff", "graphsurgeon", "mo"]
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# Returns the wall times of running command repeats times
+def time_command(command, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True, cwd=SCRIPT_DIR)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+# Returns the heavy framework modules imported by importing module and building its argument parser
+def heavy_imports(module):
+    code = ("import argparse, json, sys\n"
+            "import {0}\n"
+            "{0}.setup_args(argparse.ArgumentParser())\n"
+            "print(json.dumps([m for m in {1} if m in sys.modules]))\n").format(module, HEAVY_MODULES)
+    output = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True, cwd=SCRIPT_DIR).stdout
+    return json.loads(output.decode())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", "-r", help="Number of timed runs", type=int, default=5)
+    parser.add_argument("--max_seconds", help="Fail if the median startup time exceeds this", type=float, default=1.0)
+    args = parser.parse_args()
+
+    failed = False
+
+    imported = heavy_imports("converter")
+    if imported:
+        print("FAIL: importing converter imports {}".format(", ".join(imported)))
+        failed = True
+
+    baseline = statistics.median(time_command([sys.executable, "-c", "pass"], args.repeats))
+    startup = statistics.median(time_command([sys.executable, "converter.py", "--help"], args.repeats))
+    print("Interpreter startup: {:.3f}s".format(baseline))
+    print("converter.py --help: {:.3f}s".format(startup))
+    if startup > args.max_seconds:
+        print("FAIL: converter.py --help took longer than {:.3f}s".format(args.max_seconds))
+        failed = True
+
+    exit(1 if failed else 0)
@@ -0,0 +1,149 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+
+import model_loader
+import stage_trace
+
+# Bump when the analyses or graph templates stored change
+STRUCTURE_CACHE_VERSION = 1
+
+# Number of structures kept. Entries hold analysis results and graphs without their weights, so they are small
+MAX_STRUCTURES = 256
+
+
+# On-disk cache of the analysis results and graph surgery of a graph structure, keyed by LoadedModel.fingerprint, so
+# that retrained models with an unchanged topology skip them. It lives in the "structures" directory of the conversion
+# cache. Each structure is a directory holding one <key>.json per analysis and one <key>.pb per graph template; its
+# modification time is refreshed on every hit, and the least recently used structures are evicted
+class StructureCache:
+
+    def __init__(self, cache_dir, max_entries=MAX_STRUCTURES):
+        self.cache_dir = os.path.join(cache_dir, "structures")
+        self.max_entries = max_entries
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_dir(self, fingerprint):
+        return os.path.join(self.cache_dir, "v{}-{}".format(STRUCTURE_CACHE_VERSION, fingerprint))
+
+    def _path(self, fingerprint, key, extension):
+        return os.path.join(self._entry_dir(fingerprint), re.sub(r'[^\w.-]', '_', key) + extension)
+
+    # Writes data to path through a private file moved into place, so readers never see partial files
+    def _write(self, fingerprint, path, data):
+        entry_dir = self._entry_dir(fingerprint)
+        created = not os.path.isdir(entry_dir)
+        os.makedirs(entry_dir, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(prefix=".staging-", dir=entry_dir)
+        try:
+            with os.fdopen(handle, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        if created:
+            self.evict()
+
+    # Returns the value stored under key for the structure fingerprint, or None on a cache miss
+    def load(self, fingerprint, key):
+        try:
+            with open(self._path(fingerprint, key, ".json")) as f:
+                value = json.load(f)['value']
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(self._entry_dir(fingerprint))
+        return value
+
+    # Stores value, which must be JSON serializable, under key for the structure fingerprint
+    def store(self, fingerprint, key, value):
+        self._write(fingerprint, self._path(fingerprint, key, ".json"), json.dumps({'value': value}).encode('utf-8'))
+
+    # Returns the graph stored under key for the structure of model, with the weights of model swapped in, or None on a
+    # cache miss
+    def load_graph(self, model, key):
+        names = self.load(model.fingerprint, key)
+        if names is None:
+            return None
+        try:
+            with open(self._path(model.fingerprint, key, ".pb"), "rb") as f:
+                graph_def = model_loader.parse_graph_def(f.read())
+        except OSError:
+            return None
+        names = set(names)
+        for node in graph_def.node:
+            if node.name in names:
+                node.attr['value'].tensor.CopyFrom(model.tensor(node.name))
+        return graph_def
+
+    # Stores graph_def, a graph derived from the graph of model (e.g. by graph surgery), under key for the structure of
+    # model. The parameters of model it holds are left out, to be swapped in from the model it is loaded for
+    def store_graph(self, model, key, graph_def):
+        template = type(graph_def)()
+        template.CopyFrom(graph_def)
+        names = []
+        for node in template.node:
+            if model.is_parameter(node.name) and node.op == 'Const':
+                tensor = node.attr['value'].tensor
+                dtype, shape = tensor.dtype, type(tensor.tensor_shape)()
+                shape.CopyFrom(tensor.tensor_shape)
+                tensor.Clear()
+                tensor.dtype = dtype
+                tensor.tensor_shape.CopyFrom(shape)
+                names.append(node.name)
+        self._write(model.fingerprint, self._path(model.fingerprint, key, ".pb"), template.SerializeToString())
+        # The names are written last, as they mark the template complete
+        self.store(model.fingerprint, key, names)
+
+    # Removes least recently used structures until at most max_entries remain
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            try:
+                entries.append((os.path.getmtime(os.path.join(self.cache_dir, name)), name))
+            except OSError:
+                continue
+        for _, name in sorted(entries)[:max(0, len(entries) - self.max_entries)]:
+            shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+
+# Returns the StructureCache selected by args, or None if caching is disabled
+def from_args(args):
+    if getattr(args, 'no_cache', True):
+        return None
+    return StructureCache(args.cache_dir)
+
+
+def _hit(model, key):
+    stage_trace.event("structure_cache_hit", "Restored {} of structure {} from cache"
+                      .format(key, model.fingerprint[:12]), key=key, fingerprint=model.fingerprint)
+
+
+# Returns compute(), a JSON serializable analysis of the structure of model, from cache if it holds the analysis key of
+# that structure, or else stores it there. Without a cache, only computes it
+def cached(cache, model, key, compute):
+    if cache is None:
+        return compute()
+    value = cache.load(model.fingerprint, key)
+    if value is not None:
+        _hit(model, key)
+        return value
+    value = compute()
+    cache.store(model.fingerprint, key, value)
+    return value
+
+
+# Returns build(), a GraphDef derived from the graph of model, from cache if it holds the graph key of that structure,
+# with the weights of model swapped in, or else stores it there. Without a cache, only builds it
+def cached_graph(cache, model, key, build):
+    if cache is None:
+        return build()
+    graph_def = cache.load_graph(model, key)
+    if graph_def is not None:
+        _hit(model, key)
+        return graph_def
+    graph_def = build()
+    cache.store_graph(model, key, graph_def)
+    return graph_def
@@ -28,12 +28,37 @@ SOFTWARE.
 """
 
 import argparse
-import tensorflow as tf
-import tensorrt as trt
-import uff
-import graphsurgeon as gs
 
 import converter_util
+import graph_surgery
+import model_loader
+import stage_trace
+import structure_cache
+
+# SSD namespaces add_plugin collapses, and the name of the node replacing each
+PLUGIN_NAMESPACES = {
+    "MultipleGridAnchorGenerator": "MultipleGridAnchorGenerator",
+    "Preprocessor": "Input",
+    "ToFloat": "Input",
+    "Cast": "Input",
+    "image_tensor": "Input",
+    "Postprocessor": "NMS",
+    "concat": "concat_box_loc",
+    "concat_1": "concat_box_conf",
+    "Concatenate": "concat_priorbox",
+    "MultipleGridAnchorGenerator/Concatenate": "concat_priorbox",
+    "SecondStagePostprocessor": "NMS"
+}
+
+# Op of each of those nodes
+PLUGIN_OPS = {
+    "Input": "Placeholder",
+    "MultipleGridAnchorGenerator": "GridAnchor_TRT",
+    "NMS": "NMS_TRT",
+    "concat_box_loc": "FlattenConcat_TRT",
+    "concat_box_conf": "FlattenConcat_TRT",
+    "concat_priorbox": "ConcatV2"
+}
 
 
 def setup_args(parser):
@@ -48,22 +73,36 @@ def add_tensorrt_arguments(parser):
                         action='store_true')
 
 
-def add_plugin(graph, input_dims, graph_chars=None):
-    graph_def = graph.as_graph_def()
+# Collapses the SSD pre- and postprocessing namespaces of a graph into TensorRT plugin nodes
+# graph: SurgeryGraph to operate on. A graphsurgeon graph is converted to one
+# graph_def: The GraphDef graph was built from, if available, used for analysis instead of re-serializing graph
+# graph_chars: GraphCharacteristics of graph_def
+# analysis: The ssd_analysis of graph_def, if already known
+# Returns the SurgeryGraph
+def add_plugin(graph, input_dims, graph_chars=None, graph_def=None, debug=False, analysis=None):
+    import graphsurgeon as gs
+
+    if not isinstance(graph, graph_surgery.SurgeryGraph):
+        graph = graph_surgery.SurgeryGraph(graph.as_graph_def())
+
+    if graph_def is None:
+        graph_def = graph.as_graph_def()
 
     if graph_chars is None:
         graph_chars = converter_util.GraphCharacteristics(graph_def)
 
-    num_classes = converter_util.get_num_classes(graph_def, graph_chars=graph_chars)
-    input_order = converter_util.get_NMS_input_order(graph_def, "Postprocessor", graph_chars=graph_chars)
+    if analysis is None:
+        analysis = ssd_analysis(graph_def, graph_chars)
+    num_classes, input_order = analysis['num_classes'], analysis['nms_input_order']
 
     if any(x == -1 for x in input_order):
-        print("NMS input order error: {} Aborting".format(input_order))
+        stage_trace.event("nms_input_order_error", "NMS input order error: {} Aborting".format(input_order),
+                          order=input_order)
         exit(1)
 
-    if args.debug:
-        print("Detected number of classes: ", num_classes)
-        print("Detected NMS input order: ", input_order)
+    if debug:
+        stage_trace.event("num_classes", "Detected number of classes: {}".format(num_classes), num_classes=num_classes)
+        stage_trace.event("nms_input_order", "Detected NMS input order: {}".format(input_order), order=input_order)
 
 
     assert_nodes = graph.find_nodes_by_op("Assert")
@@ -126,61 +165,79 @@ def add_plugin(graph, input_dims, graph_chars=None):
         axis=2
     )
 
-    namespace_map = {
-        "MultipleGridAnchorGenerator": PriorBox,
-        "Preprocessor": Input,
-        "ToFloat": Input,
-        "Cast": Input,
-        "image_tensor": Input,
-        "Postprocessor": NMS,
-        "concat": concat_box_loc,
-        "concat_1": concat_box_conf,
-        "Concatenate": concat_priorbox,
-        "MultipleGridAnchorGenerator/Concatenate": concat_priorbox,
-        "SecondStagePostprocessor": NMS
-    }
+    plugins = {node.name: node for node in (Input, PriorBox, NMS, concat_box_loc, concat_box_conf, concat_priorbox)}
+    namespace_map = {namespace: plugins[name] for namespace, name in PLUGIN_NAMESPACES.items()}
     graph.collapse_namespaces(namespace_map)
 
     graph.remove(graph.graph_outputs, remove_exclusive_dependencies=False)
-    if graph.find_nodes_by_op("NMS_TRT"):
-        if "Input" in graph.find_nodes_by_op("NMS_TRT")[0].input:
-            graph.find_nodes_by_op("NMS_TRT")[0].input.remove("Input")
-    if "image_tensor:0" in graph.find_nodes_by_name("Input")[0].input:
-        graph.find_nodes_by_name("Input")[0].input.remove("image_tensor:0")
-    if "image_tensor" in graph.find_nodes_by_name("Input")[0].input:
-        graph.find_nodes_by_name("Input")[0].input.remove("image_tensor")
-    if graph.find_nodes_by_name("ToFloat_3"):
-        if "image_tensor:0" in graph.find_nodes_by_name("ToFloat_3")[0].input:
-            graph.find_nodes_by_name("ToFloat_3")[0].input.remove("image_tensor:0")
+    for nms_node in graph.find_nodes_by_op("NMS_TRT")[:1]:
+        graph.remove_inputs(nms_node, ["Input"])
+    graph.remove_inputs(graph.node_map["Input"], ["image_tensor:0", "image_tensor"])
+    for to_float_node in graph.find_nodes_by_name("ToFloat_3"):
+        graph.remove_inputs(to_float_node, ["image_tensor:0"])
 
     return graph
 
 
-def convert_to_tensorrt(args, input_dims, graph_chars=None):
+# Returns the number of classes and the NMS input order of an SSD graph, which configure its NMS plugin
+def ssd_analysis(graph_def, graph_chars):
+    with stage_trace.stage("tensorrt/analysis"):
+        return {'num_classes': converter_util.get_num_classes(graph_def, graph_chars=graph_chars),
+                'nms_input_order': converter_util.get_NMS_input_order(graph_def, "Postprocessor",
+                                                                      graph_chars=graph_chars)}
+
+
+# model: LoadedModel of args.input, if it has already been loaded
+def convert_to_tensorrt(args, input_dims, graph_chars=None, model=None):
+    import tensorrt as trt
+    import uff
+
     TRT_LOGGER = trt.Logger(trt.Logger.INFO)
     trt.init_libnvinfer_plugins(TRT_LOGGER, '')
 
     input_dims_corrected = (input_dims[3], input_dims[1], input_dims[2])
 
-    graph = add_plugin(gs.DynamicGraph(args.input), input_dims_corrected, graph_chars=graph_chars)
+    if model is None:
+        model = model_loader.load_model(args.input)
+
+    if graph_chars is None:
+        graph_chars = model.graph_chars
+
+    # Graph surgery rewrites nodes in place, so it works on a copy of the shared graph. The copy has the nodes of the
+    # analyzed graph in the same order, so the surgery indexes are built from the existing graph index. Graphs with the
+    # structure of an earlier conversion reuse its analysis and collapsed graph, with their own weights swapped in
+    cache = structure_cache.from_args(args)
+
+    def build():
+        analysis = structure_cache.cached(cache, model, "tensorrt/ssd_analysis",
+                                          lambda: ssd_analysis(model.graph_def, graph_chars))
+        graph = graph_surgery.SurgeryGraph(model.copy_graph_def(), index=graph_chars.index)
+        graph = add_plugin(graph, input_dims_corrected, graph_chars=graph_chars, graph_def=model.graph_def,
+                           debug=args.debug, analysis=analysis)
+        return graph.as_graph_def()
+
+    with stage_trace.stage("tensorrt/add_plugin"):
+        graph_def = structure_cache.cached_graph(
+            cache, model, "tensorrt/add_plugin_{}".format("x".join(str(dim) for dim in input_dims_corrected)), build)
 
-    print(graph.find_nodes_by_name("image_tensor"))
+    stage_trace.event("image_tensor", str([node for node in graph_def.node if node.name == "image_tensor"]))
 
     try:
-        uff.from_tensorflow(
-            graph.as_graph_def(),
-            output_nodes=['NMS'],
-            output_filename=(args.output_dir + ".uff"),
-            text=args.debug,
-            write_preprocessed=args.debug,
-            debug_mode=args.debug)
+        with stage_trace.stage("tensorrt/uff"):
+            uff.from_tensorflow(
+                graph_def,
+                output_nodes=['NMS'],
+                output_filename=(args.output_dir + ".uff"),
+                text=args.debug,
+                write_preprocessed=args.debug,
+                debug_mode=args.debug)
     except TypeError as e:
         if e.__str__() == "Cannot convert value 0 to a TensorFlow DType.":
             raise EnvironmentError("Please modify your graphsurgeon package according to the following:\n"
                                    "https://github.com/AastaNV/TRT_object_detection#update-graphsurgeon-converter")
 
     if args.no_cuda:
-        exit(0)
+        return
 
     with trt.Builder(TRT_LOGGER) as builder, builder.create_network() as network, trt.UffParser() as parser:
         builder.max_workspace_size = 1 << 28
@@ -190,7 +247,8 @@ def convert_to_tensorrt(args, input_dims, graph_chars=None):
         parser.register_input('Input', input_dims_corrected)
         parser.register_output('MarkOutput_0')
         parser.parse(args.output_dir + ".uff", network)
-        engine = builder.build_cuda_engine(network)
+        with stage_trace.stage("tensorrt/engine_build"):
+            engine = builder.build_cuda_engine(network)
 
         buf = engine.serialize()
         with open(args.output_dir + '_tensorrt.bin', 'wb') as f:
@@ -203,14 +261,12 @@ if __name__ == '__main__':
     add_tensorrt_arguments(parser)
     args = parser.parse_args()
 
-    with tf.compat.v1.gfile.GFile(args.input, "rb") as f:
-        graph_def = tf.compat.v1.GraphDef()
-        graph_def.ParseFromString(f.read())
+    model = model_loader.load_model(args.input)
 
     # Get graph data
-    graph_chars = converter_util.GraphCharacteristics(graph_def)
+    graph_chars = model.graph_chars
 
     # Set input dimensions
-    input_dims = converter_util.get_input_dims(args, graph_chars.input_nodes[0])
+    input_dims = converter_util.get_input_dims(args, graph_chars.input_nodes[0], graph_chars=graph_chars)
 
-    convert_to_tensorrt(args, input_dims, graph_chars=graph_chars)
+    convert_to_tensorrt(args, input_dims, graph_chars=graph_chars, model=model)
@@ -0,0 +1,799 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+import stage_trace
+
+# Reading, inspection and rewriting of TFLite flatbuffers (tensorflow/lite/schema/schema.fbs), without Tensorflow or the
+# flatbuffers package. The file is memory-mapped and decoded in place: tables are read with struct at their offsets,
+# and the contents of buffers are memoryviews of the file, so inspecting a model never reads its weights.
+
+# File identifier of TFLite flatbuffers, in bytes 4 to 8
+FILE_IDENTIFIER = b'TFL3'
+
+# Alignment of tensors in the TFLite tensor arena (kDefaultTensorAlignment)
+TENSOR_ALIGNMENT = 64
+
+DEFAULT_TOP = 10
+
+# Builtin operator names, by code (BuiltinOperator)
+BUILTIN_OPERATORS = [
+    'ADD', 'AVERAGE_POOL_2D', 'CONCATENATION', 'CONV_2D', 'DEPTHWISE_CONV_2D', 'DEPTH_TO_SPACE', 'DEQUANTIZE',
+    'EMBEDDING_LOOKUP', 'FLOOR', 'FULLY_CONNECTED', 'HASHTABLE_LOOKUP', 'L2_NORMALIZATION', 'L2_POOL_2D',
+    'LOCAL_RESPONSE_NORMALIZATION', 'LOGISTIC', 'LSH_PROJECTION', 'LSTM', 'MAX_POOL_2D', 'MUL', 'RELU',
+    'RELU_N1_TO_1', 'RELU6', 'RESHAPE', 'RESIZE_BILINEAR', 'RNN', 'SOFTMAX', 'SPACE_TO_DEPTH', 'SVDF', 'TANH',
+    'CONCAT_EMBEDDINGS', 'SKIP_GRAM', 'CALL', 'CUSTOM', 'EMBEDDING_LOOKUP_SPARSE', 'PAD',
+    'UNIDIRECTIONAL_SEQUENCE_RNN', 'GATHER', 'BATCH_TO_SPACE_ND', 'SPACE_TO_BATCH_ND', 'TRANSPOSE', 'MEAN', 'SUB',
+    'DIV', 'SQUEEZE', 'UNIDIRECTIONAL_SEQUENCE_LSTM', 'STRIDED_SLICE', 'BIDIRECTIONAL_SEQUENCE_RNN', 'EXP',
+    'TOPK_V2', 'SPLIT', 'LOG_SOFTMAX', 'DELEGATE', 'BIDIRECTIONAL_SEQUENCE_LSTM', 'CAST', 'PRELU', 'MAXIMUM',
+    'ARG_MAX', 'MINIMUM', 'LESS', 'NEG', 'PADV2', 'GREATER', 'GREATER_EQUAL', 'LESS_EQUAL', 'SELECT', 'SLICE',
+    'SIN', 'TRANSPOSE_CONV', 'SPARSE_TO_DENSE', 'TILE', 'EXPAND_DIMS', 'EQUAL', 'NOT_EQUAL', 'LOG', 'SUM', 'SQRT',
+    'RSQRT', 'SHAPE', 'POW', 'ARG_MIN', 'FAKE_QUANT', 'REDUCE_PROD', 'REDUCE_MAX', 'PACK', 'LOGICAL_OR', 'ONE_HOT',
+    'LOGICAL_AND', 'LOGICAL_NOT', 'UNPACK', 'REDUCE_MIN', 'FLOOR_DIV', 'REDUCE_ANY', 'SQUARE', 'ZEROS_LIKE', 'FILL',
+    'FLOOR_MOD', 'RANGE', 'RESIZE_NEAREST_NEIGHBOR', 'LEAKY_RELU', 'SQUARED_DIFFERENCE', 'MIRROR_PAD', 'ABS',
+    'SPLIT_V', 'UNIQUE', 'CEIL', 'REVERSE_V2', 'ADD_N', 'GATHER_ND', 'COS', 'WHERE', 'RANK', 'ELU',
+    'REVERSE_SEQUENCE', 'MATRIX_DIAG', 'QUANTIZE', 'MATRIX_SET_DIAG', 'ROUND', 'HARD_SWISH', 'IF', 'WHILE',
+    'NON_MAX_SUPPRESSION_V4', 'NON_MAX_SUPPRESSION_V5', 'SCATTER_ND', 'SELECT_V2', 'DENSIFY', 'SEGMENT_SUM',
+    'BATCH_MATMUL',
+]
+
+# Code of custom operators, which are named by their custom code (e.g. TFLite_Detection_PostProcess)
+CUSTOM = 32
+
+# Names and sizes in bits of the tensor types (TensorType). Strings, resources and variants have no fixed size
+TENSOR_TYPES = {0: ('float32', 32), 1: ('float16', 16), 2: ('int32', 32), 3: ('uint8', 8), 4: ('int64', 64),
+                5: ('string', 0), 6: ('bool', 8), 7: ('int16', 16), 8: ('complex64', 64), 9: ('int8', 8),
+                10: ('float64', 64), 11: ('complex128', 128), 12: ('uint64', 64), 13: ('resource', 0),
+                14: ('variant', 0), 15: ('uint32', 32), 16: ('uint16', 16), 17: ('int4', 4), 18: ('bfloat16', 16)}
+
+# Fields of the tables read and written, by vtable slot, as (name, kind) pairs. Kinds are a struct format character for
+# scalars, 'string', '[' and a format character for vectors of scalars ('[B' vectors are read as memoryviews of the
+# file, and '[B16' ones are 16-byte aligned), ('table', name), ('tables', name) for vectors of tables, and ('union',
+# type field, {type: table name}, highest type of scalar-only tables). Fields of kind None are not supported: they are
+# skipped when reading, and prevent rewriting the model
+_TABLES = {
+    'Model': [('version', 'I'), ('operator_codes', ('tables', 'OperatorCode')), ('subgraphs', ('tables', 'SubGraph')),
+              ('description', 'string'), ('buffers', ('tables', 'Buffer')), ('metadata_buffer', '[i'),
+              ('metadata', ('tables', 'Metadata')), ('signature_defs', ('tables', 'SignatureDef'))],
+    'OperatorCode': [('deprecated_builtin_code', 'b'), ('custom_code', 'string'), ('version', 'i'),
+                     ('builtin_code', 'i')],
+    'SubGraph': [('tensors', ('tables', 'Tensor')), ('inputs', '[i'), ('outputs', '[i'),
+                 ('operators', ('tables', 'Operator')), ('name', 'string'), ('debug_metadata_index', 'i')],
+    'Tensor': [('shape', '[i'), ('type', 'b'), ('buffer', 'I'), ('name', 'string'),
+               ('quantization', ('table', 'QuantizationParameters')), ('is_variable', '?'), ('sparsity', None),
+               ('shape_signature', '[i'), ('has_rank', '?'), ('variant_tensors', None)],
+    'QuantizationParameters': [('min', '[f'), ('max', '[f'), ('scale', '[f'), ('zero_point', '[q'),
+                               ('details_type', 'B'), ('details', ('union', 'details_type',
+                                                                   {1: 'CustomQuantization'}, 0)),
+                               ('quantized_dimension', 'i')],
+    'CustomQuantization': [('custom', '[B')],
+    # Up to RightShiftOptions (126), the builtin option tables not listed only hold scalars
+    'Operator': [('opcode_index', 'I'), ('inputs', '[i'), ('outputs', '[i'), ('builtin_options_type', 'B'),
+                 ('builtin_options', ('union', 'builtin_options_type',
+                                      {3: 'ConcatEmbeddingsOptions', 17: 'ReshapeOptions', 30: 'SqueezeOptions',
+                                       111: 'VarHandleOptions', 115: 'BucketizeOptions'}, 126)),
+                 ('custom_options', '[B'), ('custom_options_format', 'b'), ('mutating_variable_inputs', '[?'),
+                 ('intermediates', '[i'), ('large_custom_options_offset', 'Q'), ('large_custom_options_size', 'Q'),
+                 ('builtin_options_2_type', None), ('builtin_options_2', None), ('debug_metadata_index', 'i')],
+    'ConcatEmbeddingsOptions': [('num_channels', 'i'), ('num_columns_per_channel', '[i'),
+                                ('embedding_dim_per_channel', '[i')],
+    'ReshapeOptions': [('new_shape', '[i')],
+    'SqueezeOptions': [('squeeze_dims', '[i')],
+    'VarHandleOptions': [('container', 'string'), ('shared_name', 'string')],
+    'BucketizeOptions': [('boundaries', '[f')],
+    'Buffer': [('data', '[B16'), ('offset', 'Q'), ('size', 'Q')],
+    'Metadata': [('name', 'string'), ('buffer', 'I')],
+    'SignatureDef': [('inputs', ('tables', 'TensorMap')), ('outputs', ('tables', 'TensorMap')),
+                     ('signature_key', 'string'), ('deprecated_tag', 'string'), ('subgraph_index', 'I')],
+    'TensorMap': [('name', 'string'), ('tensor_index', 'I')],
+}
+
+_SCALARS = {fmt: struct.Struct('<' + fmt) for fmt in 'bBhHiIqQfd?'}
+_U32 = _SCALARS['I']
+_I32 = _SCALARS['i']
+_VTABLE_HEADER = struct.Struct('<HH')
+
+# Fields of each table by vtable slot, as (name, Struct of scalar fields or None, kind)
+_FIELDS = {name: [(field, _SCALARS.get(kind) if isinstance(kind, str) else None, kind) for field, kind in fields]
+           for name, fields in _TABLES.items()}
+
+# Structs of arrays of scalars, by element format and count
+_ARRAYS = {}
+
+
+def _array(fmt, count):
+    array = _ARRAYS.get((fmt, count))
+    if array is None:
+        array = _ARRAYS[(fmt, count)] = struct.Struct('<{}{}'.format(count, fmt))
+    return array
+
+
+# A table of a type whose schema is not listed, which only holds scalars, copied as raw bytes. fields is a list of
+# (slot, bytes) pairs, each holding the bytes of a field up to the next one, padding included
+class _RawTable:
+
+    def __init__(self, fields):
+        self.fields = fields
+
+
+# Decodes the tables of a flatbuffer into dictionaries of their present fields
+class _Reader:
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self.unsupported = set()
+
+    # Returns the start and length of the vector the offset at points to
+    def _vector(self, at, element_size):
+        target = at + _U32.unpack_from(self.buffer, at)[0]
+        length = _U32.unpack_from(self.buffer, target)[0]
+        if target + 4 + length * element_size > len(self.buffer):
+            raise ValueError("Vector at offset {} extends past the end of the file".format(target))
+        return target + 4, length
+
+    def table(self, name, pos):
+        buffer = self.buffer
+        vtable = pos - _I32.unpack_from(buffer, pos)[0]
+        vtable_size, object_size = _VTABLE_HEADER.unpack_from(buffer, vtable)
+        slots = _array('H', (vtable_size - 4) // 2).unpack_from(buffer, vtable + 4)
+        if name is None:
+            present = sorted((offset, slot) for slot, offset in enumerate(slots) if offset)
+            ends = [offset for offset, _ in present[1:]] + [object_size]
+            return _RawTable([(slot, bytes(buffer[pos + offset:pos + end]))
+                              for (offset, slot), end in zip(present, ends)])
+
+        fields = _FIELDS[name]
+        values = {}
+        for slot, offset in enumerate(slots):
+            if not offset:
+                continue
+            field, scalar, kind = fields[slot] if slot < len(fields) else (slot, None, None)
+            if scalar is not None:
+                values[field] = scalar.unpack_from(buffer, pos + offset)[0]
+            elif kind is None:
+                self.unsupported.add("{}.{}".format(name, field))
+            else:
+                value = self._value(kind, pos + offset, values)
+                if value is not None:
+                    values[field] = value
+        return values
+
+    def _value(self, kind, at, values):
+        if kind == 'string':
+            start, length = self._vector(at, 1)
+            return bytes(self.buffer[start:start + length]).decode('utf-8', 'replace')
+        if kind[0] == '[':
+            fmt = kind[1]
+            start, length = self._vector(at, _SCALARS[fmt].size)
+            if fmt == 'B':
+                return self.view[start:start + length]
+            return _array(fmt, length).unpack_from(self.buffer, start)
+        if kind[0] == 'tables':
+            start, length = self._vector(at, 4)
+            return [self.table(kind[1], start + 4 * index + offset)
+                    for index, offset in enumerate(_array('I', length).unpack_from(self.buffer, start))]
+
+        pos = at + _U32.unpack_from(self.buffer, at)[0]
+        if kind[0] == 'table':
+            return self.table(kind[1], pos)
+        union_type = values.get(kind[1], 0)
+        if union_type in kind[2]:
+            return self.table(kind[2][union_type], pos)
+        if 0 < union_type <= kind[3]:
+            return self.table(None, pos)
+        self.unsupported.add("{} {}".format(kind[1], union_type))
+        return None
+
+
+# Returns the alignment of a raw field of size bytes: the largest scalar size it can hold, as its padding is included
+def _alignment(size):
+    alignment = 1
+    while alignment * 2 <= min(size, 8):
+        alignment *= 2
+    return alignment
+
+
+# Encodes dictionaries of table fields as a flatbuffer. Objects are written front to back: each table is followed by
+# the vectors, strings and tables it points to, as flatbuffer offsets only point forward. The layout of the tables of
+# each type and set of fields is planned once, and their vtable is shared
+class _Writer:
+
+    def __init__(self):
+        # Root table offset and file identifier
+        self.data = bytearray(8)
+        self.plans = {}
+
+    def _pad(self, alignment, extra=0):
+        self.data += bytes(-(len(self.data) + extra) % alignment)
+
+    def finish(self, model):
+        root = self.table('Model', model)
+        _U32.pack_into(self.data, 0, root)
+        self.data[4:8] = FILE_IDENTIFIER
+        return self.data
+
+    # Lays out the tables of type name (None for raw tables) with the fields of values, and writes their vtable.
+    # Returns the vtable position, the alignment and size of the tables, the offsets and Structs of their scalar fields
+    # (the offsets of raw fields, in order), and the offsets, names and kinds of their offset fields
+    def _plan(self, name, values):
+        # Inline fields as (alignment, slot, size, field, Struct, kind) tuples
+        entries = []
+        if name is None:
+            for position, (slot, raw) in enumerate(values.fields):
+                entries.append((_alignment(len(raw)), slot, len(raw), position, None, None))
+        else:
+            for slot, (field, scalar, kind) in enumerate(_FIELDS[name]):
+                if kind is not None and field in values:
+                    if scalar is not None:
+                        entries.append((scalar.size, slot, scalar.size, field, scalar, None))
+                    else:
+                        entries.append((4, slot, 4, field, None, kind))
+        entries.sort(key=lambda entry: -entry[0])
+
+        offsets = [0] * (max([entry[1] for entry in entries]) + 1 if entries else 0)
+        scalars, children = [], []
+        size = 4
+        for alignment, slot, field_size, field, scalar, kind in entries:
+            size += -size % alignment
+            offsets[slot] = size
+            if kind is None:
+                scalars.append((size, field, scalar))
+            else:
+                children.append((size, field, kind))
+            size += field_size
+        if name is None:
+            scalars.sort(key=lambda scalar: scalar[1])
+
+        self._pad(2)
+        vtable_pos = len(self.data)
+        self.data += _array('H', len(offsets) + 2).pack(4 + 2 * len(offsets), size, *offsets)
+        return vtable_pos, max([4] + [entry[0] for entry in entries]), size, scalars, children
+
+    def table(self, name, values):
+        if name is None:
+            key = (None,) + tuple((slot, len(raw)) for slot, raw in values.fields)
+        else:
+            key = (name,) + tuple(values)
+        plan = self.plans.get(key)
+        if plan is None:
+            plan = self.plans[key] = self._plan(name, values)
+        vtable_pos, alignment, size, scalars, children = plan
+
+        layout = bytearray(size)
+        if name is None:
+            for (offset, _, _), (_, raw) in zip(scalars, values.fields):
+                layout[offset:offset + len(raw)] = raw
+        else:
+            for offset, field, scalar in scalars:
+                scalar.pack_into(layout, offset, values[field])
+        data = self.data
+        data += bytes(-len(data) % alignment)
+        pos = len(data)
+        _I32.pack_into(layout, 0, pos - vtable_pos)
+        data += layout
+
+        for offset, field, kind in children:
+            _U32.pack_into(data, pos + offset, self._value(kind, values[field], values) - pos - offset)
+        return pos
+
+    def _value(self, kind, value, values):
+        data = self.data
+        if kind == 'string':
+            encoded = value.encode('utf-8')
+            data += bytes(-len(data) % 4)
+            pos = len(data)
+            data += _U32.pack(len(encoded)) + encoded + b'\0'
+            return pos
+        if kind[0] == '[':
+            fmt = kind[1]
+            self._pad(16 if kind == '[B16' else max(4, _SCALARS[fmt].size), extra=4)
+            pos = len(data)
+            data += _U32.pack(len(value))
+            if fmt == 'B':
+                data += value
+            else:
+                data += _array(fmt, len(value)).pack(*value)
+            return pos
+        if kind[0] == 'table':
+            return self.table(kind[1], value)
+        if kind[0] == 'tables':
+            data += bytes(-len(data) % 4)
+            pos = len(data)
+            data += _U32.pack(len(value)) + bytes(4 * len(value))
+            for index, table in enumerate(value):
+                at = pos + 4 + 4 * index
+                _U32.pack_into(data, at, self.table(kind[1], table) - at)
+            return pos
+
+        if isinstance(value, _RawTable):
+            return self.table(None, value)
+        return self.table(kind[2][values[kind[1]]], value)
+
+
+# A TFLite flatbuffer, memory-mapped and decoded in place. Properties:
+# path: Path of the flatbuffer
+# buffer: Read-only memory map of the file
+# model: The decoded Model table: a dictionary of its present fields, holding lists of dictionaries for the tables it
+#   points to. Buffer contents and custom options are memoryviews of the file, which must be released before close().
+#   optimize_model rewrites it in place
+# unsupported: Names of the fields present in the file that are not decoded. The model cannot be rewritten with them
+class TFLiteModel:
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            self.buffer = b''
+        if len(self.buffer) < 8 or self.buffer[4:8] != FILE_IDENTIFIER:
+            self.close()
+            raise ValueError("{} is not a TFLite flatbuffer".format(path))
+
+        reader = _Reader(self.buffer)
+        error = None
+        try:
+            self.model = reader.table('Model', _U32.unpack_from(self.buffer, 0)[0])
+        except (struct.error, IndexError, ValueError) as e:
+            # The file is closed once the traceback, which holds views of it, is released
+            error = str(e)
+        reader.view.release()
+        if error is not None:
+            self.close()
+            raise ValueError("{} is not a valid TFLite flatbuffer: {}".format(path, error))
+        self.unsupported = sorted(reader.unsupported)
+
+    # Returns the contents of buffer index, without copying them
+    def buffer_data(self, index):
+        buffer = self.model['buffers'][index]
+        # Models over 2 GiB keep buffers after the flatbuffer, at an offset of the file
+        if buffer.get('offset', 0) > 1:
+            return memoryview(self.buffer)[buffer['offset']:buffer['offset'] + buffer['size']]
+        return buffer.get('data', b'')
+
+    def close(self):
+        self.model = None
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Loads the TFLite flatbuffer at path. Raises ValueError if it is not one
+def load_tflite(path):
+    return TFLiteModel(path)
+
+
+def _builtin_code(operator_code):
+    # Codes above 127 are only in builtin_code; older files only have deprecated_builtin_code
+    return max(operator_code.get('deprecated_builtin_code', 0), operator_code.get('builtin_code', 0))
+
+
+# Returns the name of the operator code opcode_index of model: the builtin operator name, or the custom code
+def operator_name(model, opcode_index):
+    operator_code = model['operator_codes'][opcode_index]
+    code = _builtin_code(operator_code)
+    if code == CUSTOM:
+        return operator_code.get('custom_code', 'CUSTOM')
+    return BUILTIN_OPERATORS[code] if code < len(BUILTIN_OPERATORS) else "BUILTIN_{}".format(code)
+
+
+# Returns the size of a tensor, from its type and shape. Dimensions only known at run time count as 1
+def tensor_bytes(tensor):
+    count = 1
+    for dim in tensor.get('shape', ()):
+        count *= max(dim, 1)
+    return (count * TENSOR_TYPES.get(tensor.get('type', 0), (None, 0))[1] + 7) // 8
+
+
+# Returns the indices of the tensors of subgraph index of model that the model refers to: operator inputs, outputs and
+# intermediates, subgraph inputs and outputs, signature tensors and variables
+def _used_tensors(model, index, subgraph):
+    used = set(subgraph.get('inputs', ())) | set(subgraph.get('outputs', ()))
+    for operator in subgraph.get('operators', []):
+        used.update(operator.get('inputs', ()))
+        used.update(operator.get('outputs', ()))
+        used.update(operator.get('intermediates', ()))
+    for signature in model.get('signature_defs', []):
+        if signature.get('subgraph_index', 0) == index:
+            entries = signature.get('inputs', []) + signature.get('outputs', [])
+            used.update(entry.get('tensor_index', 0) for entry in entries)
+    used.update(position for position, tensor in enumerate(subgraph.get('tensors', [])) if tensor.get('is_variable'))
+    return used
+
+
+# Estimates the tensor arena of a subgraph the way TFLite plans it: every tensor that is neither constant nor a variable
+# lives from the operator producing it (or the subgraph start, for inputs) to its last consumer (or the subgraph end,
+# for outputs), and tensors are placed largest first at the lowest aligned offset not overlapping a tensor alive at the
+# same time (the greedy memory planner). tensors are the report entries of the subgraph's tensors. Returns the arena
+# size, and the peak of the total size of the tensors alive at once, the lower bound of any plan
+def _plan_arena(subgraph, tensors):
+    operators = subgraph.get('operators', [])
+    first, last = {}, {}
+    for index in subgraph.get('inputs', ()):
+        first[index] = last[index] = 0
+    for position, operator in enumerate(operators):
+        for index in operator.get('inputs', ()):
+            first.setdefault(index, position)
+            last[index] = position
+        for index in tuple(operator.get('outputs', ())) + tuple(operator.get('intermediates', ())):
+            first.setdefault(index, position)
+            last[index] = max(last.get(index, position), position)
+    for index in subgraph.get('outputs', ()):
+        first.setdefault(index, len(operators))
+        last[index] = len(operators)
+
+    lives = []
+    for index, start in first.items():
+        if 0 <= index < len(tensors):
+            tensor = tensors[index]
+            if not tensor['constant'] and not tensor['variable'] and tensor['bytes'] > 0:
+                aligned = -(-tensor['bytes'] // TENSOR_ALIGNMENT) * TENSOR_ALIGNMENT
+                lives.append((aligned, start, last[index]))
+
+    changes = [0] * (len(operators) + 2)
+    for size, start, end in lives:
+        changes[start] += size
+        changes[end + 1] -= size
+    peak = live = 0
+    for change in changes:
+        live += change
+        peak = max(peak, live)
+
+    # Placed tensors as (offset, end) pairs, by operator they are alive at
+    placed = [[] for _ in range(len(operators) + 1)]
+    arena = 0
+    for size, start, end in sorted(lives, key=lambda life: (-life[0], life[1])):
+        offset = 0
+        for other_offset, other_end in sorted(set().union(*placed[start:end + 1])):
+            if offset + size <= other_offset:
+                break
+            offset = max(offset, other_end)
+        for step in range(start, end + 1):
+            placed[step].append((offset, offset + size))
+        arena = max(arena, offset + size)
+    return arena, peak
+
+
+# Returns a report of a TFLiteModel: its size, operator histogram, custom operators, the type, shape and size of every
+# tensor, the constant and activation bytes by type, and the estimated tensor arena of each subgraph
+def inspect_model(tflite):
+    model = tflite.model
+    histogram = {}
+    custom_operators = []
+    by_type = {}
+    subgraphs = []
+    constant_buffers = set()
+    unused_tensors = 0
+    for index, subgraph in enumerate(model.get('subgraphs', [])):
+        tensors = []
+        for tensor in subgraph.get('tensors', []):
+            buffer = tensor.get('buffer', 0)
+            data_bytes = len(tflite.buffer_data(buffer)) if buffer else 0
+            type_name = TENSOR_TYPES.get(tensor.get('type', 0), ("type_{}".format(tensor.get('type')), 0))[0]
+            entry = {'name': tensor.get('name', ''), 'type': type_name, 'shape': list(tensor.get('shape', ())),
+                     'bytes': data_bytes or tensor_bytes(tensor), 'constant': data_bytes > 0, 'buffer': buffer,
+                     'variable': bool(tensor.get('is_variable')),
+                     'quantized': 'scale' in tensor.get('quantization', {})}
+            tensors.append(entry)
+
+            totals = by_type.setdefault(type_name, {'tensors': 0, 'constant_bytes': 0, 'activation_bytes': 0})
+            totals['tensors'] += 1
+            if entry['constant']:
+                if buffer not in constant_buffers:
+                    totals['constant_bytes'] += data_bytes
+                constant_buffers.add(buffer)
+            elif not entry['variable']:
+                totals['activation_bytes'] += entry['bytes']
+        unused_tensors += len(tensors) - len(_used_tensors(model, index, subgraph) - {-1})
+
+        operators = subgraph.get('operators', [])
+        for position, operator in enumerate(operators):
+            name = operator_name(model, operator.get('opcode_index', 0))
+            histogram[name] = histogram.get(name, 0) + 1
+            if _builtin_code(model['operator_codes'][operator.get('opcode_index', 0)]) == CUSTOM:
+                custom_operators.append({
+                    'code': name, 'subgraph': index, 'operator': position,
+                    'inputs': [tensors[tensor]['name'] for tensor in operator.get('inputs', ()) if tensor >= 0],
+                    'outputs': [tensors[tensor]['name'] for tensor in operator.get('outputs', ())],
+                    'options_bytes': len(operator.get('custom_options', b''))})
+
+        arena, peak = _plan_arena(subgraph, tensors)
+        subgraphs.append({'index': index, 'name': subgraph.get('name', ''), 'operators': len(operators),
+                          'inputs': [tensors[tensor] for tensor in subgraph.get('inputs', ())],
+                          'outputs': [tensors[tensor] for tensor in subgraph.get('outputs', ())],
+                          'arena_bytes': arena, 'peak_live_bytes': peak, 'tensors': tensors})
+
+    buffers = model.get('buffers', [])
+    metadata = [{'name': entry.get('name', ''), 'bytes': len(tflite.buffer_data(entry.get('buffer', 0)))}
+                for entry in model.get('metadata', [])]
+    return {
+        'path': tflite.path, 'bytes': len(tflite.buffer), 'version': model.get('version', 0),
+        'description': model.get('description', ''),
+        'operators': sum(histogram.values()),
+        'operator_histogram': dict(sorted(histogram.items(), key=lambda item: (-item[1], item[0]))),
+        'custom_operators': custom_operators,
+        'tensors': sum(len(subgraph['tensors']) for subgraph in subgraphs), 'unused_tensors': unused_tensors,
+        'constant_bytes': sum(totals['constant_bytes'] for totals in by_type.values()),
+        'activation_bytes': sum(totals['activation_bytes'] for totals in by_type.values()),
+        'bytes_by_type': by_type,
+        # Each subgraph has its own arena
+        'arena_bytes': sum(subgraph['arena_bytes'] for subgraph in subgraphs),
+        'buffers': len(buffers), 'buffer_bytes': sum(len(tflite.buffer_data(index)) for index in range(len(buffers))),
+        'metadata': metadata, 'unsupported': tflite.unsupported, 'subgraphs': subgraphs,
+    }
+
+
+# Returns the reasons optimize_model cannot rewrite a TFLiteModel, or an empty list if it can
+def rewrite_blockers(tflite):
+    blockers = ["unsupported field {}".format(field) for field in tflite.unsupported]
+    if any(buffer.get('offset', 0) > 1 for buffer in tflite.model.get('buffers', [])):
+        blockers.append("buffers stored after the flatbuffer")
+    if any('large_custom_options_offset' in operator for subgraph in tflite.model.get('subgraphs', [])
+           for operator in subgraph.get('operators', [])):
+        blockers.append("custom options stored after the flatbuffer")
+    return blockers
+
+
+# Shrinks a TFLiteModel: constant buffers with identical contents are merged, tensors nothing refers to are removed,
+# with the metadata if strip_metadata is set, and then every buffer no tensor refers to (tensors without data point
+# to the empty buffer 0). The decoded model of tflite is changed in place. Returns the serialized flatbuffer and a
+# report of the changes. Raises ValueError if the model cannot be rewritten (see rewrite_blockers)
+def optimize_model(tflite, strip_metadata=True):
+    blockers = rewrite_blockers(tflite)
+    if blockers:
+        raise ValueError("Cannot rewrite {}: {}".format(tflite.path, ", ".join(blockers)))
+    model = tflite.model
+    subgraphs = model.get('subgraphs', [])
+    buffers = model.get('buffers', [])
+    report = {'bytes_before': len(tflite.buffer), 'duplicate_buffers': 0, 'duplicate_bytes': 0, 'tensors_removed': 0,
+              'metadata_removed': 0}
+
+    # Merge duplicate constants. Only buffers of the same size are hashed, and variables keep their own buffers
+    variable_buffers = {tensor.get('buffer', 0) for subgraph in subgraphs for tensor in subgraph.get('tensors', [])
+                        if tensor.get('is_variable')}
+    by_size = {}
+    for subgraph in subgraphs:
+        for tensor in subgraph.get('tensors', []):
+            buffer = tensor.get('buffer', 0)
+            if buffer and buffer not in variable_buffers:
+                size = len(tflite.buffer_data(buffer))
+                if size:
+                    by_size.setdefault(size, set()).add(buffer)
+    merged = {}
+    for size, indices in by_size.items():
+        if len(indices) < 2:
+            continue
+        canonical = {}
+        for buffer in sorted(indices):
+            first = canonical.setdefault(hashlib.sha256(tflite.buffer_data(buffer)).digest(), buffer)
+            if first != buffer:
+                merged[buffer] = first
+                report['duplicate_bytes'] += size
+    report['duplicate_buffers'] = len(merged)
+
+    # Remove unused tensors
+    for index, subgraph in enumerate(subgraphs):
+        tensors = subgraph.get('tensors', [])
+        used = _used_tensors(model, index, subgraph)
+        kept = [position for position in range(len(tensors)) if position in used]
+        if len(kept) < len(tensors):
+            report['tensors_removed'] += len(tensors) - len(kept)
+            renumbered = {old: new for new, old in enumerate(kept)}
+            renumbered[-1] = -1
+            subgraph['tensors'] = [tensors[position] for position in kept]
+            for field in ('inputs', 'outputs'):
+                if field in subgraph:
+                    subgraph[field] = tuple(renumbered[tensor] for tensor in subgraph[field])
+            for operator in subgraph.get('operators', []):
+                for field in ('inputs', 'outputs', 'intermediates'):
+                    if field in operator:
+                        operator[field] = tuple(renumbered[tensor] for tensor in operator[field])
+            for signature in model.get('signature_defs', []):
+                if signature.get('subgraph_index', 0) == index:
+                    for entry in signature.get('inputs', []) + signature.get('outputs', []):
+                        entry['tensor_index'] = renumbered[entry.get('tensor_index', 0)]
+
+    if strip_metadata:
+        report['metadata_removed'] = len(model.pop('metadata', []))
+        model.pop('metadata_buffer', None)
+
+    # Keep the buffers still referred to, in order, and buffer 0, the empty buffer of tensors without data
+    for subgraph in subgraphs:
+        for tensor in subgraph.get('tensors', []):
+            buffer = merged.get(tensor.get('buffer', 0), tensor.get('buffer', 0))
+            if buffer and buffer not in variable_buffers and not len(tflite.buffer_data(buffer)):
+                buffer = 0
+            tensor['buffer'] = buffer
+    referenced = {0} | {tensor['buffer'] for subgraph in subgraphs for tensor in subgraph.get('tensors', [])}
+    referenced.update(entry.get('buffer', 0) for entry in model.get('metadata', []))
+    referenced.update(model.get('metadata_buffer', ()))
+    kept = [index for index in range(len(buffers)) if index in referenced]
+    report['buffers_removed'] = len(buffers) - len(kept)
+    if buffers:
+        renumbered = {old: new for new, old in enumerate(kept)}
+        model['buffers'] = [buffers[index] for index in kept]
+        for subgraph in subgraphs:
+            for tensor in subgraph.get('tensors', []):
+                tensor['buffer'] = renumbered[tensor['buffer']]
+        for entry in model.get('metadata', []):
+            entry['buffer'] = renumbered[entry.get('buffer', 0)]
+        if 'metadata_buffer' in model:
+            model['metadata_buffer'] = tuple(renumbered[index] for index in model['metadata_buffer'])
+
+    data = _Writer().finish(model)
+    report['bytes_after'] = len(data)
+    return data, report
+
+
+def optimize_message(report):
+    return ("Optimized flatbuffer: {} -> {} bytes ({} duplicate buffers of {} bytes merged, {} unused tensors, {} "
+            "buffers and {} metadata entries removed)"
+            .format(report['bytes_before'], report['bytes_after'], report['duplicate_buffers'],
+                    report['duplicate_bytes'], report['tensors_removed'], report['buffers_removed'],
+                    report['metadata_removed']))
+
+
+# Writes data to path through a private file moved into place
+def _write_file(path, data):
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+# Optimizes the flatbuffer at path, writing the result to output, or over path if output is not given. Returns the
+# report of optimize_model
+def optimize_file(path, output=None, strip_metadata=True):
+    with load_tflite(path) as tflite:
+        data, report = optimize_model(tflite, strip_metadata=strip_metadata)
+    _write_file(output or path, data)
+    return report
+
+
+def custom_operators_message(report):
+    return "Custom operators, run by the TFLite runtime on the CPU: {}".format(", ".join(
+        "{} (subgraph {}, operator {}, inputs {})".format(entry['code'], entry['subgraph'], entry['operator'],
+                                                          ", ".join(entry['inputs']))
+        for entry in report['custom_operators']))
+
+
+def summary_message(report):
+    from cost_model import format_bytes
+
+    return "Flatbuffer {}: {}, {} operators ({}), {} of constants, ~{} tensor arena".format(
+        report['path'], format_bytes(report['bytes']), report['operators'],
+        ", ".join("{} {}".format(name, count) for name, count in report['operator_histogram'].items()),
+        format_bytes(report['constant_bytes']), format_bytes(report['arena_bytes']))
+
+
+# Returns the text form of a report, listing the top entries of each ranking
+def report_text(report, top=DEFAULT_TOP):
+    from cost_model import format_bytes
+
+    lines = ["{}: {}, {} subgraphs, {} operators, {} tensors, {} buffers".format(
+        report['path'], format_bytes(report['bytes']), len(report['subgraphs']), report['operators'],
+        report['tensors'], report['buffers'])]
+    if report['description']:
+        lines.append("Description: {}".format(report['description']))
+    for subgraph in report['subgraphs']:
+        lines.append("Subgraph {} {}: {} operators, ~{} tensor arena ({} of tensors alive at once at peak)".format(
+            subgraph['index'], subgraph['name'], subgraph['operators'], format_bytes(subgraph['arena_bytes']),
+            format_bytes(subgraph['peak_live_bytes'])))
+        for role in ('inputs', 'outputs'):
+            lines.append("  {}: {}".format(role.capitalize(), ", ".join(
+                "{} {} {}".format(tensor['name'], tensor['type'], tensor['shape']) for tensor in subgraph[role])))
+
+    lines += ["", "Operators:"]
+    for name, count in list(report['operator_histogram'].items())[:top]:
+        lines.append("  {:>6}  {}".format(count, name))
+    if len(report['operator_histogram']) > top:
+        lines.append("  ... {} more".format(len(report['operator_histogram']) - top))
+    if report['custom_operators']:
+        lines += ["", custom_operators_message(report)]
+
+    lines += ["", "Tensors by type:"]
+    for type_name, totals in sorted(report['bytes_by_type'].items(),
+                                    key=lambda item: -item[1]['constant_bytes'] - item[1]['activation_bytes']):
+        lines.append("  {:<10} {:>6} tensors {:>11} constant {:>11} activations".format(
+            type_name, totals['tensors'], format_bytes(totals['constant_bytes']),
+            format_bytes(totals['activation_bytes'])))
+
+    tensors = [tensor for subgraph in report['subgraphs'] for tensor in subgraph['tensors']]
+    for title, constant in (("Largest constants:", True), ("Largest activations:", False)):
+        lines += ["", title]
+        ranked = sorted((tensor for tensor in tensors if tensor['constant'] == constant),
+                        key=lambda tensor: -tensor['bytes'])
+        for tensor in ranked[:top]:
+            lines.append("  {:>11}  {} {} {}".format(format_bytes(tensor['bytes']), tensor['name'], tensor['type'],
+                                                     tensor['shape']))
+
+    if report['metadata']:
+        lines += ["", "Metadata: {}".format(", ".join("{} ({})".format(entry['name'], format_bytes(entry['bytes']))
+                                                      for entry in report['metadata']))]
+    if report['unused_tensors']:
+        lines.append("{} tensors are not used".format(report['unused_tensors']))
+    if report['unsupported']:
+        lines.append("Fields not read: {}".format(", ".join(report['unsupported'])))
+    return "\n".join(lines)
+
+
+def add_inspect_args(parser):
+    parser.add_argument("--no_tflite_optimize", help="Compile the tflite flatbuffers as converted, without merging "
+                                                     "duplicate buffers and removing unused tensors and metadata",
+                        action='store_true')
+    parser.add_argument("--keep_tflite_metadata", help="Keep the metadata of the tflite flatbuffers when optimizing "
+                                                       "them", action='store_true')
+
+
+# Optimizes the flatbuffer at path in place unless --no_tflite_optimize is given, then inspects it, records both as
+# events, and writes the inspection report to report_path if given. Returns the report. Raises ValueError if path is
+# not a valid TFLite flatbuffer
+def check_flatbuffer(args, path, report_path=None):
+    if not args.no_tflite_optimize:
+        with stage_trace.stage("edgetpu/tflite_optimize"):
+            with load_tflite(path) as tflite:
+                blockers = rewrite_blockers(tflite)
+                if not blockers:
+                    data, report = optimize_model(tflite, strip_metadata=not args.keep_tflite_metadata)
+            if not blockers:
+                _write_file(path, data)
+        if blockers:
+            stage_trace.event("tflite_not_optimized", "Flatbuffer {} left as converted: {}"
+                              .format(path, ", ".join(blockers)), path=path, reasons=blockers)
+        else:
+            stage_trace.event("tflite_optimized", optimize_message(report), path=path, **report)
+
+    with stage_trace.stage("edgetpu/tflite_inspect"):
+        with load_tflite(path) as tflite:
+            report = inspect_model(tflite)
+    stage_trace.event("tflite_inspected", summary_message(report), path=path, bytes=report['bytes'],
+                      operators=report['operator_histogram'], constant_bytes=report['constant_bytes'],
+                      arena_bytes=report['arena_bytes'])
+    if report['custom_operators']:
+        stage_trace.event("tflite_custom_operators", custom_operators_message(report), path=path,
+                          operators=[entry['code'] for entry in report['custom_operators']])
+    if report_path is not None:
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def setup_args(parser):
+    parser.add_argument("--input", "-i", help="Path to the .tflite flatbuffer", required=True, type=str)
+    parser.add_argument("--output", "-o", help="Write the optimized flatbuffer to this path, and report on it")
+    parser.add_argument("--keep_metadata", help="Keep the metadata when optimizing", action='store_true')
+    parser.add_argument("--top", help="Number of entries listed in each ranking", type=int, default=DEFAULT_TOP)
+    parser.add_argument("--json", help="Write the full report to this JSON file")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    setup_args(parser)
+    args = parser.parse_args()
+
+    path = args.input
+    try:
+        if args.output:
+            print(optimize_message(optimize_file(args.input, args.output, strip_metadata=not args.keep_metadata)))
+            path = args.output
+        with load_tflite(path) as tflite:
+            report = inspect_model(tflite)
+    except ValueError as e:
+        print("Error: {}".format(e))
+        exit(1)
+    print(report_text(report, top=args.top))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)